@@ -8,9 +8,16 @@ https://docs.djangoproject.com/en/5.0/howto/deployment/asgi/
 """
 
 import os
+import time
+
+started = time.perf_counter()
 
 from django.core.asgi import get_asgi_application
 
+from myportfolio.startup import load_application
+
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "myportfolio.settings")
+# Beacons are handled by the native async view under ASGI
+os.environ.setdefault("ANALYTICS_ASYNC_BEACON", "1")
 
-application = get_asgi_application()
+application = load_application(get_asgi_application, started)
@@ -15,7 +15,6 @@ import os
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
-print("BASE_DIR", BASE_DIR)
 
 
 # Quick-start development settings - unsuitable for production
@@ -29,13 +28,84 @@ DEBUG = True
 
 ALLOWED_HOSTS = ['*']
 
-GEOIP_PATH = '/path/to/GeoLite2-City.mmdb'
+GEOIP_PATH = os.environ.get('GEOIP_PATH', os.path.join(BASE_DIR, 'data', 'geoip'))
+# Used only when an address is missing from the local database, e.g.
+# GEOIP_FALLBACK_URL='https://ipinfo.io/{ip}/json?token=<token>'. Unset by
+# default, which keeps lookups offline. Runs on the analytics writer thread.
+GEOIP_FALLBACK_URL = os.environ.get('GEOIP_FALLBACK_URL') or None
+GEOIP_FALLBACK_TIMEOUT = 2  # seconds
+# Concurrent fallback requests per event loop on the async beacon path
+GEOIP_FALLBACK_CONCURRENCY = 20
+# In-process LRU of resolved addresses, mirrored into the "shared" cache so
+# every worker benefits from each other's lookups. TTLs are in seconds.
+GEOIP_CACHE = {
+    'MAX_SIZE': 10000,
+    'TTL': 24 * 60 * 60,
+    'NEGATIVE_TTL': 5 * 60,
+    'SHARED_ALIAS': 'shared',
+}
 
-GDAL_LIBRARY_PATH = '/opt/homebrew/Cellar/gdal/3.9.2_1/lib/libgdal.dylib' 
-GEOS_LIBRARY_PATH = '/opt/homebrew/lib/libgeos_c.dylib' 
+# Nothing uses GeoDjango, and loading it needs the GDAL and GEOS native
+# libraries, so it is only installed with DJANGO_ENABLE_GIS=1. The library
+# paths are taken from the environment when they are not on the default path.
+ENABLE_GIS = os.environ.get('DJANGO_ENABLE_GIS', '') == '1'
+if os.environ.get('GDAL_LIBRARY_PATH'):
+    GDAL_LIBRARY_PATH = os.environ['GDAL_LIBRARY_PATH']
+if os.environ.get('GEOS_LIBRARY_PATH'):
+    GEOS_LIBRARY_PATH = os.environ['GEOS_LIBRARY_PATH']
+
+# CKEditor's upload and image browser views are not routed by default;
+# CKEDITOR_UPLOADS=1 installs the app and adds them under /ckeditor/.
+CKEDITOR_UPLOADS = os.environ.get('CKEDITOR_UPLOADS', '') == '1'
+
+
+# Sessions live in the cache and reach the database through a batched
+# background writer (portfolio/sessions.py), which also deletes expired
+# sessions every SWEEP_INTERVAL seconds. The cache must be shared by every
+# worker process: a new session exists only there until it is flushed.
+# Signed-cookie sessions would need no server storage, but their key
+# changes on every save and visitor analytics are keyed by session.
+SESSION_ENGINE = "portfolio.sessions"
+SESSION_CACHE_ALIAS = "sessions"
+SESSION_WRITE_BEHIND = {
+    'FLUSH_INTERVAL': 2.0,
+    'MAX_PENDING': 500,
+    'SWEEP_INTERVAL': 60 * 60,
+}
 
+# Blog posts are appended to data/blogposts.log and folded back into
+# data/blogposts.csv once the log holds this many records
+BLOG_LOG_COMPACT_THRESHOLD = 200
+
+# Analytics events are queued and written by a background thread in batches
+ANALYTICS_INGEST = {
+    'FLUSH_INTERVAL': 1.0,  # seconds
+    'MAX_BATCH_SIZE': 500,
+    'MAX_QUEUE_SIZE': 10000,
+    'BACKPRESSURE': 'block',  # 'block', 'drop' or 'sync'
+    'BLOCK_TIMEOUT': 0.5,
+}
 
-SESSION_ENGINE = "django.contrib.sessions.backends.file"
+# /metrics is for staff users, or scrapers sending "Authorization: Bearer
+# <METRICS_TOKEN>". METRICS_ALLOWED_IPS lets addresses in without either;
+# behind a reverse proxy every request comes from the proxy's address, so
+# only list addresses that cannot be reached through it.
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+METRICS_ALLOWED_IPS = []
+
+# Serve /track_analytics/ from the async view. asgi.py turns this on;
+# under WSGI the sync view is used.
+ANALYTICS_ASYNC_BEACON = os.environ.get('ANALYTICS_ASYNC_BEACON', '') == '1'
+
+# Requests that skip sessions and visitor profiles (portfolio/traffic.py).
+# BOT_USER_AGENTS can be overridden the same way.
+ANALYTICS_TRAFFIC = {
+    'EXCLUDED_PATH_PREFIXES': [
+        '/static/', '/media/', '/admin/', '/ckeditor/', '/track_analytics/',
+        '/favicon.ico', '/robots.txt', '/sitemap.xml', '/health', '/metrics',
+    ],
+    'SKIP_EMPTY_USER_AGENT': True,
+}
 
 # Application definition
 
@@ -48,10 +118,11 @@ INSTALLED_APPS = [
     "django.contrib.staticfiles",
     "portfolio",
     "ckeditor",
-    'ckeditor_uploader',
-    'django.contrib.gis',
-
 ]
+if CKEDITOR_UPLOADS:
+    INSTALLED_APPS.append('ckeditor_uploader')
+if ENABLE_GIS:
+    INSTALLED_APPS.append('django.contrib.gis')
 
 
 CKEDITOR_UPLOAD_PATH = "uploads/"
@@ -69,9 +140,9 @@ CKEDITOR_CONFIGS = {
         'width': '100%',
     }
 }
-print(CKEDITOR_CONFIGS)
 
 MIDDLEWARE = [
+    "portfolio.middleware.MetricsMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -95,6 +166,8 @@ CKEDITOR_CONFIGS = {
     },
 }
 
+# With no "loaders" option Django wraps the loaders below in the cached
+# loader, so each template is read and compiled once per process.
 TEMPLATES = [
     {
         "BACKEND": "django.template.backends.django.DjangoTemplates",
@@ -113,6 +186,19 @@ TEMPLATES = [
 
 WSGI_APPLICATION = "myportfolio.wsgi.application"
 
+# wsgi.py and asgi.py log how long the application took to load. Run them
+# under `python -X importtime` to see which modules the time went to.
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'myportfolio': {'handlers': ['console'], 'level': 'INFO'},
+    },
+}
+
 
 # Database
 # https://docs.djangoproject.com/en/5.0/ref/settings/#databases
@@ -125,6 +211,40 @@ DATABASES = {
 }
 
 
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    },
+    # Visible to every worker process on the host. Sized to hold
+    # GEOIP_CACHE['MAX_SIZE'] addresses alongside anything else put there.
+    "shared": {
+        "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+        "LOCATION": os.path.join(BASE_DIR, "data", "cache"),
+        "OPTIONS": {"MAX_ENTRIES": 20000},
+    },
+    # Sessions only, so other entries never crowd them out; a culled session
+    # is reloaded from the database. The file backend lists its directory on
+    # every write, so busier sites should use memcached or redis here.
+    "sessions": {
+        "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+        "LOCATION": os.path.join(BASE_DIR, "data", "sessions"),
+        "OPTIONS": {"MAX_ENTRIES": 50000, "CULL_FREQUENCY": 10},
+    },
+}
+
+
+# Rendered blog_list pages and blog_detail fragments. Keys carry content
+# versions, so entries are invalidated by writes rather than by expiry;
+# TIMEOUT only bounds how long superseded entries linger. Point ALIAS at
+# "shared" (or a memcached/redis cache) to share it between workers.
+BLOG_FRAGMENT_CACHE = {
+    'ALIAS': 'default',
+    'TIMEOUT': 24 * 60 * 60,
+}
+# Part of every blog page ETag; bump it when a template change should make
+# browsers fetch pages again
+BLOG_ETAG_VERSION = 1
+
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
 
@@ -167,6 +287,32 @@ USE_TZ = True
 
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+# None to stream media from Django (zero-copy where the server supports
+# sendfile), or 'x-accel-redirect' (nginx) / 'x-sendfile' (Apache, lighttpd)
+# to let the fronting proxy send the file after Django has validated it
+MEDIA_ACCEL_MODE = None
+MEDIA_ACCEL_PREFIX = '/protected-media/'
+
+# Uploaded blog images are resized to these widths (in AVIF, WebP and JPEG,
+# as supported by Pillow) by background workers
+BLOG_IMAGE_WIDTHS = (320, 640, 1024, 1600)
+
+STORAGES = {
+    "default": {
+        "BACKEND": "django.core.files.storage.FileSystemStorage",
+    },
+    "staticfiles": {
+        "BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage",
+    },
+    # Post images and PDFs, stored by SHA-256 so identical uploads share a file
+    "blog_media": {
+        "BACKEND": "portfolio.storages.ContentAddressedStorage",
+    },
+}
+BACKGROUND_TASK_WORKERS = 2
+# Uploaded PDFs get a first-page preview and text extraction (for search)
+# from pypdfium2, limited to this many pages
+PDF_TEXT_MAX_PAGES = 50
 
 
 # Default primary key field type
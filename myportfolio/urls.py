@@ -15,17 +15,17 @@ Including another URLconf
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
 from django.contrib import admin
-from django.urls import path
+from django.urls import path, re_path
 from django.conf.urls import include
 from django.conf import settings
-from django.conf.urls.static import static
+from portfolio.media import serve_media
 
 urlpatterns = [
     path("admin/", admin.site.urls),
     path("", include("portfolio.urls")),
     # path('blog/', include('blog.urls')),
+    # Served in production too; set MEDIA_ACCEL_MODE to hand files to the proxy
+    re_path(r"^%s(?P<path>.*)$" % settings.MEDIA_URL.lstrip("/"), serve_media, name="media"),
 ]
-
-
-if settings.DEBUG:
-    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
\ No newline at end of file
+if settings.CKEDITOR_UPLOADS:
+    urlpatterns.insert(1, path("ckeditor/", include("ckeditor_uploader.urls")))
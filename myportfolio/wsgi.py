@@ -8,9 +8,14 @@ https://docs.djangoproject.com/en/5.0/howto/deployment/wsgi/
 """
 
 import os
+import time
+
+started = time.perf_counter()
 
 from django.core.wsgi import get_wsgi_application
 
+from myportfolio.startup import load_application
+
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "myportfolio.settings")
 
-application = get_wsgi_application()
+application = load_application(get_wsgi_application, started)
@@ -4,3 +4,8 @@ from django.apps import AppConfig
 class PortfolioConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "portfolio"
+
+    def ready(self):
+        from .metrics import register_default_gauges
+
+        register_default_gauges()
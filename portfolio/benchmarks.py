@@ -0,0 +1,347 @@
+"""Benchmarks of the file-backed models at increasing data sizes.
+
+``run(sizes, seed)`` seeds isolated stores in a temporary directory with
+deterministic synthetic data, swaps them onto the models, times model
+operations and test-client requests, and returns a JSON-serialisable dict.
+Nothing under ``data/`` is read or written. See the ``benchmark``
+management command.
+"""
+import contextlib
+import csv
+import itertools
+import json
+import os
+import platform
+import random
+import statistics
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+import django
+from django.test import Client, override_settings
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+WORDS = (
+    "django python cache index storage latency request session profile analytics search "
+    "render template image variant content excerpt window queue batch column rollup metric "
+    "portfolio blog post comment visitor page scroll time country region device source"
+).split()
+AUTHORS = ("Lokesh", "Asha", "Ravi", "Meera", "Kiran", "Dev")
+PAGES = ("welcome page", "blog list page", "blog view page", "blog create page", "/contact/")
+DEVICES = ("Desktop", "Mobile", "Tablet")
+COUNTRIES = ("US", "IN", "DE", "GB", "Unknown")
+BODY_VARIANTS = 200
+
+
+class SyntheticData:
+    """Deterministic posts, comments and visitor profiles for a seed."""
+
+    def __init__(self, seed):
+        self.seed = seed
+
+    def _random(self, kind, size):
+        return random.Random(f'{self.seed}:{kind}:{size}')
+
+    def sentence(self, rng, words):
+        return " ".join(rng.choice(WORDS) for _ in range(words))
+
+    def posts(self, count):
+        from .content import derive_content_fields
+
+        rng = self._random('posts', count)
+        bodies = []
+        for _ in range(BODY_VARIANTS):
+            paragraphs = [f"<p>{self.sentence(rng, rng.randint(20, 80))}</p>" for _ in range(rng.randint(1, 6))]
+            content = "".join(paragraphs)
+            bodies.append((content, derive_content_fields(content)))
+        start = datetime(2020, 1, 1, tzinfo=timezone.utc)
+        for index in range(count):
+            content, derived = rng.choice(bodies)
+            yield {
+                'id': str(uuid.UUID(int=rng.getrandbits(128))),
+                'title': self.sentence(rng, rng.randint(3, 9)).title(),
+                'content': content,
+                'image': '',
+                'pdf': '',
+                'published_date': (start + timedelta(minutes=37 * index)).isoformat(),
+                'author': rng.choice(AUTHORS),
+                'image_variants': '',
+                'pdf_info': '',
+                **derived,
+            }
+
+    def comments(self, posts, count):
+        rng = self._random('comments', count)
+        for _ in range(count):
+            post = rng.choice(posts)
+            yield {
+                'blog_post_id': post['id'],
+                'blog_post_title': post['title'],
+                'author': rng.choice(AUTHORS),
+                'text': self.sentence(rng, rng.randint(5, 30)),
+                'created_at': datetime(2024, 1, 1, tzinfo=timezone.utc).isoformat(),
+            }
+
+    def profiles(self, count):
+        rng = self._random('profiles', count)
+        for _ in range(count):
+            visits = rng.randint(1, 8)
+            yield {
+                'session_id': uuid.UUID(int=rng.getrandbits(128)).hex,
+                'ip_address': f"{rng.randint(1, 223)}.{rng.randint(0, 255)}.{rng.randint(0, 255)}.{rng.randint(1, 254)}",
+                'utm_source': rng.choice(('', '', 'twitter', 'newsletter')),
+                'user_agent': 'Mozilla/5.0 (benchmark)',
+                'device_type': rng.choice(DEVICES),
+                'page_urls': [rng.choice(PAGES) for _ in range(visits)],
+                'scroll_depth': [f"{rng.randint(0, 100)}%" for _ in range(visits)],
+                'time_spent': [rng.randint(1, 600) for _ in range(visits)],
+                'country': rng.choice(COUNTRIES),
+                'region': 'Unknown',
+                'date_time_visited': datetime(2024, 1, 1, tzinfo=timezone.utc).isoformat(),
+            }
+
+
+@contextlib.contextmanager
+def isolated_stores(directory):
+    """Point every model at fresh stores under ``directory``."""
+    from .comment_store import CommentStore
+    from .events import EventStore
+    from .fragment_cache import fragment_cache
+    from .models import BlogPost, Comment, VisitorProfile, upgrade_post_row
+    from .profile_store import VisitorProfileStore
+    from .repository import BlogPostRepository
+    from .rollups import RollupStore
+    from .search import SearchIndex
+
+    saved = {
+        (BlogPost, 'repository'): BlogPost.repository,
+        (BlogPost, 'search_index'): BlogPost.search_index,
+        (Comment, 'store'): Comment.store,
+        (VisitorProfile, 'store'): VisitorProfile.store,
+        (VisitorProfile, 'events'): VisitorProfile.events,
+        (VisitorProfile, 'rollups'): VisitorProfile.rollups,
+    }
+    repository = BlogPostRepository(
+        os.path.join(directory, 'blogposts.csv'), BlogPost.fields,
+        log_path=os.path.join(directory, 'blogposts.log'), upgrade=upgrade_post_row,
+    )
+    repository.subscribe(fragment_cache.on_repository_change)
+    BlogPost.repository = repository
+    BlogPost.search_index = SearchIndex(repository)
+    Comment.store = CommentStore(os.path.join(directory, 'comments'), Comment.fields)
+    VisitorProfile.store = VisitorProfileStore(os.path.join(directory, 'profiles.sqlite3'), VisitorProfile.fields)
+    VisitorProfile.events = EventStore(os.path.join(directory, 'events'))
+    VisitorProfile.rollups = RollupStore(os.path.join(directory, 'rollups.sqlite3'))
+    # Versions from an earlier size must not serve cached pages
+    fragment_cache.bump('generation')
+    try:
+        yield
+    finally:
+        for (model, attribute), value in saved.items():
+            setattr(model, attribute, value)
+        fragment_cache.bump('generation')
+
+
+def seed(directory, data, size):
+    """Write ``size`` posts, comments and profiles; returns the post and profile rows."""
+    from .models import BlogPost, Comment, VisitorProfile
+
+    posts = list(data.posts(size))
+    # Written as a snapshot in one go; putting rows one by one would fsync each
+    with open(os.path.join(directory, 'blogposts.csv'), 'w', newline='') as csvfile:
+        writer = csv.DictWriter(csvfile, fieldnames=BlogPost.fields)
+        writer.writeheader()
+        writer.writerows(posts)
+    BlogPost.repository.invalidate()
+    for row in data.comments(posts, size):
+        Comment.store.append(row)
+    profiles = list(data.profiles(size))
+    VisitorProfile.store.upsert_many(profiles)
+    return posts, profiles
+
+
+def measure(func, repeat):
+    """Run ``func`` ``repeat`` times; timings in milliseconds."""
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - start)
+    samples.sort()
+    return {
+        'runs': len(samples),
+        'min_ms': round(samples[0] * 1000, 4),
+        'median_ms': round(statistics.median(samples) * 1000, 4),
+        'p90_ms': round(samples[min(len(samples) - 1, int(len(samples) * 0.9))] * 1000, 4),
+        'mean_ms': round(statistics.fmean(samples) * 1000, 4),
+    }
+
+
+def model_benchmarks(data, posts, profiles, size, repeat):
+    from .models import BlogPost, Comment, VisitorProfile
+
+    rng = random.Random(f'{data.seed}:ops:{size}')
+    # Scans are slow at large sizes, so fewer runs
+    scan_repeat = max(1, repeat // 2) if size >= 100000 else repeat
+    results = {}
+
+    results['blogpost.all'] = measure(BlogPost.all, scan_repeat)
+    results['blogpost.get'] = measure(lambda: BlogPost.get(rng.choice(posts)['id']), repeat * 20)
+
+    def latest_page():
+        start = rng.randrange(0, size, 5)
+        return BlogPost.latest()[start:start + 5]
+    results['blogpost.latest_page'] = measure(latest_page, repeat * 20)
+
+    def save_post():
+        BlogPost(title=data.sentence(rng, 5), content=f"<p>{data.sentence(rng, 60)}</p>", author="Bench").save()
+    results['blogpost.save'] = measure(save_post, repeat)
+
+    def update_post():
+        BlogPost.get(rng.choice(posts)['id']).update(title=data.sentence(rng, 4))
+    results['blogpost.update'] = measure(update_post, repeat)
+
+    created = []
+
+    def delete_post():
+        post = BlogPost(title="to delete", content="<p>x</p>", author="Bench")
+        post.save()
+        created.append(post)
+    for _ in range(repeat):
+        delete_post()
+    results['blogpost.delete'] = measure(lambda: created.pop().delete(), repeat)
+    BlogPost.search_index.search('warm')  # build outside the timed query
+    results['blogpost.search'] = measure(lambda: list(BlogPost.search(rng.choice(WORDS))[:5]), repeat * 4)
+
+    results['comment.all'] = measure(Comment.all, scan_repeat)
+    results['comment.for_post'] = measure(lambda: Comment.for_post(rng.choice(posts)['id']), repeat * 20)
+
+    def save_comment():
+        post = rng.choice(posts)
+        Comment(post['title'], "Bench", data.sentence(rng, 12), blog_post_id=post['id']).save()
+    results['comment.save'] = measure(save_comment, repeat * 4)
+
+    profiles = list(profiles)
+    results['visitorprofile.all'] = measure(VisitorProfile.all, scan_repeat)
+    results['visitorprofile.exists'] = measure(lambda: VisitorProfile.exists(rng.choice(profiles)['session_id']), repeat * 20)
+    new_profiles = list(itertools.islice(data.profiles(size + 1), repeat))
+
+    results['visitorprofile.save'] = measure(lambda: VisitorProfile._from_row(dict(new_profiles.pop())).save(), len(new_profiles))
+
+    def update_profile():
+        profile = VisitorProfile.get(rng.choice(profiles)['session_id'])
+        profile.utm_source = 'benchmark'
+        profile.update()
+    results['visitorprofile.update'] = measure(update_profile, repeat * 4)
+    results['visitorprofile.delete'] = measure(
+        lambda: VisitorProfile._from_row(dict(profiles.pop())).delete(), repeat * 4,
+    )
+    return results
+
+
+def request_benchmarks(data, posts, size, repeat):
+    from .fragment_cache import fragment_cache
+    from .ingest import analytics_queue
+
+    rng = random.Random(f'{data.seed}:requests:{size}')
+    client = Client(HTTP_USER_AGENT='Mozilla/5.0 (benchmark)')
+    results = {}
+    pages = max(1, size // 5)
+
+    # Cached runs revisit a few pages; uncached runs drop every cached fragment first
+    hot_pages = [rng.randint(1, pages) for _ in range(3)]
+    hot_posts = [rng.choice(posts)['id'] for _ in range(3)]
+
+    def blog_list(cold):
+        if cold:
+            fragment_cache.bump('generation')
+        page = rng.randint(1, pages) if cold else rng.choice(hot_pages)
+        response = client.get('/blog', {'page': page})
+        assert response.status_code == 200, response.status_code
+
+    def blog_detail(cold):
+        if cold:
+            fragment_cache.bump('generation')
+        post_id = rng.choice(posts)['id'] if cold else rng.choice(hot_posts)
+        response = client.get(f"/blog/details/{post_id}/")
+        assert response.status_code == 200, response.status_code
+
+    client.get('/blog')  # creates the session and profile
+    analytics_queue.drain()
+    results['request.blog_list'] = measure(lambda: blog_list(False), repeat * 4)
+    results['request.blog_list_uncached'] = measure(lambda: blog_list(True), repeat * 4)
+    results['request.blog_detail'] = measure(lambda: blog_detail(False), repeat * 4)
+    results['request.blog_detail_uncached'] = measure(lambda: blog_detail(True), repeat * 4)
+
+    def beacon():
+        body = json.dumps({
+            'page_urls': [rng.choice(PAGES)],
+            'scroll_depth': [f"{rng.randint(0, 100)}%"],
+            'time_spent': [rng.randint(1, 300)],
+            'utm_source': None,
+            'country': 'US',
+            'region': 'Unknown',
+        })
+        response = client.post('/track_analytics/', body, content_type='application/json')
+        assert response.status_code == 200, response.status_code
+    results['request.track_analytics'] = measure(beacon, repeat * 10)
+    results['ingest.drain'] = measure(analytics_queue.drain, 1)
+    return results
+
+
+def run(sizes, seed_value=0, repeat=5, log=None):
+    """Benchmark every size in ``sizes``; returns the results document."""
+    data = SyntheticData(seed_value)
+    results = {}
+    setup_test_environment()
+    try:
+        # Signed-cookie sessions keep the benchmark out of the session database
+        with override_settings(SESSION_ENGINE='django.contrib.sessions.backends.signed_cookies'):
+            for size in sizes:
+                with tempfile.TemporaryDirectory(prefix='portfolio-bench-') as directory:
+                    with isolated_stores(directory):
+                        started = time.perf_counter()
+                        posts, profiles = seed(directory, data, size)
+                        if log:
+                            log(f"size {size}: seeded in {time.perf_counter() - started:.1f}s")
+                        size_results = model_benchmarks(data, posts, profiles, size, repeat)
+                        size_results.update(request_benchmarks(data, posts, size, repeat))
+                        results[str(size)] = size_results
+                        if log:
+                            log(f"size {size}: done")
+    finally:
+        teardown_test_environment()
+    return {
+        'meta': {
+            'seed': seed_value,
+            'repeat': repeat,
+            'sizes': list(sizes),
+            'created': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'platform': platform.platform(),
+        },
+        'results': results,
+    }
+
+
+def compare(current, baseline, threshold):
+    """Benchmarks whose median grew by more than ``threshold`` (0.2 = 20%)."""
+    regressions = []
+    for size, benchmarks in current['results'].items():
+        for name, stats in benchmarks.items():
+            before = baseline.get('results', {}).get(size, {}).get(name)
+            if not before or not before['median_ms']:
+                continue
+            change = stats['median_ms'] / before['median_ms'] - 1
+            if change > threshold:
+                regressions.append({
+                    'size': size,
+                    'benchmark': name,
+                    'baseline_ms': before['median_ms'],
+                    'current_ms': stats['median_ms'],
+                    'change': round(change, 3),
+                })
+    return regressions
@@ -0,0 +1,144 @@
+import contextlib
+import csv
+import logging
+import os
+import re
+import shutil
+import threading
+from itertools import islice
+
+try:
+    import fcntl
+except ImportError:  # Windows: fall back to in-process locking only
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+_SAFE_ID = re.compile(r'^[A-Za-z0-9_-]+$')
+
+
+class CommentStore:
+    """Comments kept in one CSV file per blog post, named by post id.
+
+    Reading a post's thread opens only that post's file, and a page of it
+    stops reading once it has enough rows. Keying by id rather than title
+    means renaming a post keeps its comments attached.
+
+    Appends and the legacy migration hold an exclusive lock on
+    ``<directory>.lock``, so workers sharing the directory do not interleave
+    them.
+    """
+
+    def __init__(self, directory, fields, legacy_csv=None):
+        self.directory = directory
+        self.fields = fields
+        self.legacy_csv = legacy_csv
+        self.lock_path = directory.rstrip(os.sep) + '.lock'
+        self._lock = threading.Lock()
+        self._migrated = False
+
+    @contextlib.contextmanager
+    def _locked(self):
+        """Hold the thread lock and, where supported, an exclusive file lock."""
+        with self._lock:
+            if fcntl is None:
+                yield
+                return
+            os.makedirs(os.path.dirname(self.lock_path) or '.', exist_ok=True)
+            with open(self.lock_path, 'a') as lockfile:
+                fcntl.flock(lockfile, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lockfile, fcntl.LOCK_UN)
+
+    def _path(self, post_id, directory=None):
+        if not post_id or not _SAFE_ID.match(post_id):
+            return None
+        return os.path.join(directory or self.directory, f'{post_id}.csv')
+
+    def _ensure_migrated(self):
+        if self._migrated:
+            return
+        with self._locked():
+            if not self._migrated:
+                os.makedirs(self.directory, exist_ok=True)
+                # Checked under the file lock: another worker may have
+                # migrated it while this one waited
+                if self.legacy_csv and os.path.exists(self.legacy_csv):
+                    self._migrate_legacy()
+                self._migrated = True
+
+    def _migrate_legacy(self):
+        """Split the old title-keyed comments.csv into per-post files.
+
+        The files are built in a staging directory and moved into place
+        before the legacy file is renamed, so a crash part way through
+        leaves the legacy file to be migrated again from scratch.
+        """
+        from .models import BlogPost
+
+        ids_by_title = {post.title: post.id for post in BlogPost.latest()[::-1]}
+        staging = self.directory.rstrip(os.sep) + '.migrating'
+        shutil.rmtree(staging, ignore_errors=True)
+        os.makedirs(staging)
+        with open(self.legacy_csv, 'r', newline='') as csvfile:
+            for row in csv.DictReader(csvfile):
+                row['blog_post_id'] = ids_by_title.get(row.get('blog_post_title'), '_orphaned')
+                if self._path(row['blog_post_id']) is None:
+                    logger.warning("Skipping legacy comment with invalid blog post id: %r", row)
+                    continue
+                self._append(row, directory=staging)
+        for name in os.listdir(staging):
+            os.replace(os.path.join(staging, name), os.path.join(self.directory, name))
+        os.rmdir(staging)
+        os.replace(self.legacy_csv, self.legacy_csv + '.migrated')
+
+    def _append(self, row, directory=None):
+        path = self._path(row['blog_post_id'], directory)
+        if path is None:
+            raise ValueError(f"Invalid blog post id: {row['blog_post_id']!r}")
+        is_new = not os.path.exists(path)
+        with open(path, 'a', newline='') as csvfile:
+            writer = csv.DictWriter(csvfile, fieldnames=self.fields, extrasaction='ignore')
+            if is_new:
+                writer.writeheader()
+            writer.writerow(row)
+
+    def append(self, row):
+        self._ensure_migrated()
+        # Locked so two first comments on a post write one header
+        with self._locked():
+            self._append(row)
+
+    def stamp(self, post_id):
+        """``(mtime_ns, size)`` of a post's comment file, or None without one.
+
+        Changes whenever any process appends a comment to the post.
+        """
+        self._ensure_migrated()
+        path = self._path(post_id)
+        if path is None:
+            return None
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def for_post(self, post_id, offset=0, limit=None):
+        """Rows for one post, oldest first, optionally a slice of them."""
+        self._ensure_migrated()
+        path = self._path(post_id)
+        if path is None or not os.path.exists(path):
+            return []
+        with open(path, 'r', newline='') as csvfile:
+            reader = csv.DictReader(csvfile)
+            stop = None if limit is None else offset + limit
+            return list(islice(reader, offset, stop))
+
+    def rows(self):
+        self._ensure_migrated()
+        for name in sorted(os.listdir(self.directory)):
+            if name.endswith('.csv'):
+                yield from self.for_post(name[:-len('.csv')])
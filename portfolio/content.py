@@ -0,0 +1,188 @@
+import math
+import re
+from html import escape
+from html.parser import HTMLParser
+from urllib.parse import urlsplit
+
+EXCERPT_WORDS = 30
+WORDS_PER_MINUTE = 200
+# Stored with the derived fields; bump it when the sanitizer's output
+# changes so posts saved earlier are derived again (see BlogPost)
+CONTENT_FORMAT = 2
+
+# What CKEditor's default toolbar produces; everything else is dropped
+ALLOWED_TAGS = {
+    'a', 'abbr', 'b', 'blockquote', 'br', 'caption', 'code', 'del', 'div', 'em', 'figcaption',
+    'figure', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'hr', 'i', 'img', 'ins', 'li', 'ol', 'p', 'pre',
+    's', 'span', 'strike', 'strong', 'sub', 'sup', 'table', 'tbody', 'td', 'tfoot', 'th', 'thead',
+    'tr', 'u', 'ul', 'iframe',
+}
+ALLOWED_ATTRIBUTES = {
+    '*': {'class', 'title', 'style'},
+    'a': {'href', 'name', 'target', 'rel'},
+    'img': {'src', 'alt', 'width', 'height'},
+    'iframe': {'src', 'width', 'height', 'allow', 'allowfullscreen', 'frameborder'},
+    'td': {'colspan', 'rowspan'},
+    'th': {'colspan', 'rowspan', 'scope'},
+    'ol': {'start', 'type'},
+}
+# Alignment and sizing set by CKEditor; values are further limited by _STYLE_VALUE
+ALLOWED_STYLE_PROPERTIES = {
+    'text-align', 'width', 'height', 'float', 'margin', 'margin-top', 'margin-right',
+    'margin-bottom', 'margin-left',
+}
+# Embeds are kept only when served over https from one of these hosts
+ALLOWED_IFRAME_HOSTS = {
+    'www.youtube.com', 'www.youtube-nocookie.com', 'player.vimeo.com', 'www.google.com',
+}
+URL_ATTRIBUTES = {'href', 'src'}
+ALLOWED_SCHEMES = {'http', 'https', 'mailto'}
+VOID_TAGS = {'br', 'hr', 'img'}
+# Elements whose text is dropped along with the tags; an allowed iframe is
+# kept but its fallback content is not
+DISCARD_CONTENT_TAGS = {'script', 'style', 'iframe', 'object', 'embed', 'template', 'noscript'}
+# Attributes written without a value
+BOOLEAN_ATTRIBUTES = {'allowfullscreen'}
+BLOCK_TAGS = {
+    'blockquote', 'br', 'caption', 'div', 'figcaption', 'figure', 'h1', 'h2', 'h3', 'h4', 'h5',
+    'h6', 'hr', 'li', 'p', 'pre', 'td', 'th', 'tr',
+}
+
+_SCHEME = re.compile(r'^([a-z][a-z0-9+.-]*):', re.IGNORECASE)
+_CONTROL = re.compile(r'[\x00-\x20]+')
+# Keywords, lengths, percentages and colours; no url(), expression() or escapes
+_STYLE_VALUE = re.compile(r'^[#a-z0-9.%\s-]+$', re.IGNORECASE)
+
+
+def _safe_url(value):
+    match = _SCHEME.match(_CONTROL.sub('', value))
+    return match is None or match.group(1).lower() in ALLOWED_SCHEMES
+
+
+def _allowed_iframe(attrs):
+    src = dict(attrs).get('src') or ''
+    try:
+        url = urlsplit(_CONTROL.sub('', src))
+    except ValueError:
+        return False
+    return url.scheme == 'https' and url.hostname in ALLOWED_IFRAME_HOSTS
+
+
+def _clean_style(value):
+    """The declarations of a style attribute that are on the allowlist."""
+    declarations = []
+    for declaration in value.split(';'):
+        name, colon, style = declaration.partition(':')
+        name, style = name.strip().lower(), style.strip()
+        if colon and name in ALLOWED_STYLE_PROPERTIES and _STYLE_VALUE.match(style):
+            declarations.append(f'{name}: {style}')
+    return '; '.join(declarations)
+
+
+class _ContentParser(HTMLParser):
+    """Builds the sanitized HTML and the plain text of a post in one pass."""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.html = []
+        self.text = []
+        self.open_tags = []
+        self.discarding = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in DISCARD_CONTENT_TAGS:
+            if tag == 'iframe' and not self.discarding and _allowed_iframe(attrs):
+                self.html.append(f'<iframe{"".join(self._attributes(tag, attrs))}></iframe>')
+            self.discarding += 1
+            return
+        if self.discarding:
+            return
+        if tag in BLOCK_TAGS:
+            self.text.append(' ')
+        if tag not in ALLOWED_TAGS:
+            return
+        rendered = self._attributes(tag, attrs)
+        if tag == 'a' and any(name == 'target' for name, _ in attrs):
+            rendered = [attr for attr in rendered if not attr.startswith(' rel=')]
+            rendered.append(' rel="noopener noreferrer"')
+        self.html.append(f'<{tag}{"".join(rendered)}>')
+        if tag not in VOID_TAGS:
+            self.open_tags.append(tag)
+
+    def _attributes(self, tag, attrs):
+        allowed = ALLOWED_ATTRIBUTES['*'] | ALLOWED_ATTRIBUTES.get(tag, set())
+        rendered = []
+        for name, value in attrs:
+            if name not in allowed:
+                continue
+            if name in BOOLEAN_ATTRIBUTES:
+                rendered.append(f' {name}')
+                continue
+            if value is None:
+                continue
+            if name in URL_ATTRIBUTES and not _safe_url(value):
+                continue
+            if name == 'style':
+                value = _clean_style(value)
+                if not value:
+                    continue
+            rendered.append(f' {name}="{escape(value)}"')
+        return rendered
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs)
+        if tag not in VOID_TAGS and tag in ALLOWED_TAGS and not self.discarding:
+            self.handle_endtag(tag)
+
+    def handle_endtag(self, tag):
+        if tag in DISCARD_CONTENT_TAGS:
+            self.discarding = max(self.discarding - 1, 0)
+            return
+        if self.discarding:
+            return
+        if tag in BLOCK_TAGS:
+            self.text.append(' ')
+        if tag not in self.open_tags:
+            return
+        # Close anything left open inside this element
+        while self.open_tags:
+            open_tag = self.open_tags.pop()
+            self.html.append(f'</{open_tag}>')
+            if open_tag == tag:
+                break
+
+    def handle_data(self, data):
+        if self.discarding:
+            return
+        self.html.append(escape(data, quote=False))
+        self.text.append(data)
+
+    def close(self):
+        super().close()
+        while self.open_tags:
+            self.html.append(f'</{self.open_tags.pop()}>')
+
+
+def derive_content_fields(content):
+    """Fields computed from a post's CKEditor HTML when it is saved.
+
+    Returns ``content_html`` (the HTML reduced to an allowlist of tags,
+    attributes, style properties, URL schemes and embed hosts, safe to
+    render unescaped), ``excerpt`` (the first words as plain text),
+    ``word_count``, ``reading_time`` in minutes and the ``content_format``
+    they were derived with.
+    """
+    parser = _ContentParser()
+    parser.feed(content or '')
+    parser.close()
+    words = ''.join(parser.text).split()
+    excerpt = ' '.join(words[:EXCERPT_WORDS])
+    if len(words) > EXCERPT_WORDS:
+        excerpt += '…'
+    return {
+        'content_format': CONTENT_FORMAT,
+        'content_html': ''.join(parser.html),
+        'excerpt': excerpt,
+        'word_count': len(words),
+        'reading_time': max(1, math.ceil(len(words) / WORDS_PER_MINUTE)) if words else 0,
+    }
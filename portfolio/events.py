@@ -0,0 +1,234 @@
+import contextlib
+import os
+import re
+import threading
+from array import array
+from datetime import datetime, timezone
+
+try:
+    import fcntl
+except ImportError:  # Windows: fall back to in-process locking only
+    fcntl = None
+
+# Column name -> array typecode. Every column holds one value per event.
+COLUMNS = {
+    'time': 'I',      # seconds since midnight UTC of the partition's day
+    'session': 'I',   # index into the day's session dictionary
+    'url': 'I',       # index into the day's url dictionary
+    'scroll': 'B',    # maximum scroll depth, percent
+    'seconds': 'I',   # time spent on the page
+}
+DICTIONARIES = ('session', 'url')
+
+_DAY = re.compile(r'^\d{4}-\d{2}-\d{2}$')
+_MAX_SECONDS = 2 ** 32 - 1
+
+
+def _column_path(directory, column):
+    return os.path.join(directory, f'{column}.{COLUMNS[column]}')
+
+
+def _itemsize(column):
+    return array(COLUMNS[column]).itemsize
+
+
+def parse_scroll(value):
+    """Scroll depth as an int percent; beacons send strings like ``"57%"``."""
+    try:
+        depth = int(float(str(value).strip().rstrip('%')))
+    except (ValueError, OverflowError):
+        return 0
+    return min(max(depth, 0), 100)
+
+
+def clean_url(url):
+    # Newlines would split a dictionary entry
+    return ' '.join(str(url).split())[:2000]
+
+
+def parse_seconds(value):
+    try:
+        seconds = int(float(value))
+    except (TypeError, ValueError, OverflowError):
+        return 0
+    return min(max(seconds, 0), _MAX_SECONDS)
+
+
+class _Partition:
+    """Append state for one day: dictionaries loaded so far and the lock file."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.values = {name: [] for name in DICTIONARIES}
+        self.index = {name: {} for name in DICTIONARIES}
+        self.offsets = {name: 0 for name in DICTIONARIES}
+
+    def refresh(self, name):
+        """Pick up dictionary entries appended by other processes."""
+        path = os.path.join(self.directory, f'{name}.dict')
+        try:
+            with open(path, 'rb') as dictfile:
+                dictfile.seek(self.offsets[name])
+                data = dictfile.read()
+        except FileNotFoundError:
+            return
+        # Only whole lines; a torn tail is rewritten by the next append
+        complete = data.rfind(b'\n') + 1
+        for line in data[:complete].decode('utf-8').splitlines():
+            self.index[name][line] = len(self.values[name])
+            self.values[name].append(line)
+        self.offsets[name] += complete
+
+
+class EventStore:
+    """Append-only, column-per-file store of page view events.
+
+    Each UTC day is a directory with one binary file per column (see
+    ``COLUMNS``) and a dictionary file per string column, so a day holds
+    fixed-width integers only and queries read just the columns they need.
+    URLs and session ids are dictionary-encoded per day, which keeps every
+    partition self-contained: rolling over to a new day starts new files,
+    and old days can be archived or deleted as whole directories.
+
+    Appends take an exclusive lock on the day, so several processes can
+    write (where ``fcntl`` is available; elsewhere, only one process). A crash between column writes leaves columns of unequal length;
+    readers use the shortest, and the next append truncates the rest.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._partitions = {}
+
+    def day_directory(self, day):
+        return os.path.join(self.directory, day)
+
+    def days(self):
+        """Partition days, oldest first, as ``YYYY-MM-DD`` strings."""
+        try:
+            return sorted(name for name in os.listdir(self.directory) if _DAY.match(name))
+        except FileNotFoundError:
+            return []
+
+    @contextlib.contextmanager
+    def _locked(self, directory):
+        if fcntl is None:
+            yield
+            return
+        with open(os.path.join(directory, '.lock'), 'a') as lockfile:
+            fcntl.flock(lockfile, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lockfile, fcntl.LOCK_UN)
+
+    def _partition(self, day):
+        partition = self._partitions.get(day)
+        if partition is None:
+            directory = self.day_directory(day)
+            os.makedirs(directory, exist_ok=True)
+            partition = self._partitions[day] = _Partition(directory)
+            # Writers only append to the current days
+            for old in sorted(self._partitions)[:-2]:
+                del self._partitions[old]
+        return partition
+
+    def _encode(self, partition, name, value, added):
+        code = partition.index[name].get(value)
+        if code is None:
+            code = len(partition.values[name])
+            partition.index[name][value] = code
+            partition.values[name].append(value)
+            added.append(value)
+        return code
+
+    def _repair(self, directory):
+        """Truncate columns to the number of complete events."""
+        lengths = {}
+        for column in COLUMNS:
+            try:
+                lengths[column] = os.path.getsize(_column_path(directory, column)) // _itemsize(column)
+            except FileNotFoundError:
+                lengths[column] = 0
+        rows = min(lengths.values())
+        for column, length in lengths.items():
+            if length != rows:
+                os.truncate(_column_path(directory, column), rows * _itemsize(column))
+
+    def append(self, events):
+        """Append ``(timestamp, session_id, url, scroll, seconds)`` tuples.
+
+        ``timestamp`` is a Unix time, ``scroll`` a percent and ``seconds`` an
+        int; see ``parse_scroll`` and ``parse_seconds``. Returns the number of
+        events written.
+        """
+        by_day = {}
+        for event in events:
+            moment = datetime.fromtimestamp(event[0], tz=timezone.utc)
+            by_day.setdefault(moment.strftime('%Y-%m-%d'), []).append((moment, *event[1:]))
+
+        with self._lock:
+            for day, day_events in by_day.items():
+                partition = self._partition(day)
+                with self._locked(partition.directory):
+                    self._repair(partition.directory)
+                    columns = {column: array(typecode) for column, typecode in COLUMNS.items()}
+                    added = {name: [] for name in DICTIONARIES}
+                    for name in DICTIONARIES:
+                        partition.refresh(name)
+                    for moment, session_id, url, scroll, seconds in day_events:
+                        columns['time'].append(moment.hour * 3600 + moment.minute * 60 + moment.second)
+                        columns['session'].append(self._encode(partition, 'session', session_id, added['session']))
+                        columns['url'].append(self._encode(partition, 'url', url, added['url']))
+                        columns['scroll'].append(scroll)
+                        columns['seconds'].append(seconds)
+
+                    # Dictionaries first, so every code a column refers to exists
+                    for name, values in added.items():
+                        if values:
+                            self._append_dictionary(partition, name, values)
+                    for column, values in columns.items():
+                        with open(_column_path(partition.directory, column), 'ab') as columnfile:
+                            values.tofile(columnfile)
+        return sum(len(day_events) for day_events in by_day.values())
+
+    def _append_dictionary(self, partition, name, values):
+        path = os.path.join(partition.directory, f'{name}.dict')
+        data = ''.join(f'{value}\n' for value in values).encode('utf-8')
+        with open(path, 'ab') as dictfile:
+            # Drop a torn line left by a crashed writer
+            if dictfile.tell() != partition.offsets[name]:
+                dictfile.truncate(partition.offsets[name])
+            dictfile.write(data)
+        partition.offsets[name] += len(data)
+
+    def read(self, day, columns=tuple(COLUMNS)):
+        """``{column: array}`` for one day, reading only ``columns``."""
+        directory = self.day_directory(day)
+        sizes = {}
+        for column in COLUMNS:
+            try:
+                sizes[column] = os.path.getsize(_column_path(directory, column)) // _itemsize(column)
+            except FileNotFoundError:
+                sizes[column] = 0
+        rows = min(sizes.values())
+        result = {}
+        for column in columns:
+            values = array(COLUMNS[column])
+            if rows:
+                with open(_column_path(directory, column), 'rb') as columnfile:
+                    values.fromfile(columnfile, rows)
+            result[column] = values
+        return result
+
+    def dictionary(self, day, name):
+        """The values a day's ``name`` column codes refer to, by code."""
+        partition = _Partition(self.day_directory(day))
+        partition.refresh(name)
+        return partition.values[name]
+
+    def scan(self, columns, start=None, end=None):
+        """Yield ``(day, {column: array})`` for days in ``[start, end]``."""
+        for day in self.days():
+            if (start is None or day >= start) and (end is None or day <= end):
+                yield day, self.read(day, columns)
@@ -73,11 +73,13 @@ class CommentForm(forms.Form):
         })
     )
 
+    blog_post_id = forms.CharField(widget=forms.HiddenInput())
     blog_post_title = forms.CharField(widget=forms.HiddenInput())
 
     def save(self):
         data = self.cleaned_data
         comment = Comment(
+            blog_post_id=data['blog_post_id'],
             blog_post_title=data['blog_post_title'],
             author=data['author'],
             text=data['text']
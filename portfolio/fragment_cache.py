@@ -0,0 +1,93 @@
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+
+
+class FragmentCache:
+    """Rendered blog HTML cached under content version counters.
+
+    Every key embeds the version of what it was rendered from: the post list
+    version for list pages, a per-post version for detail fragments, and a
+    global generation for both. Writes bump only the versions they affect, so
+    cached HTML is served until something it depends on changes, and stale
+    entries are never read again and simply age out of the cache.
+
+    Versions live in the same cache as the fragments. A shared backend
+    therefore shares invalidation across processes; with a per-process
+    backend, a reload of the post files (another process wrote) bumps the
+    generation instead. Comments are written to their own files, so a post's
+    version also carries the stat of its comment file, which every process
+    sees change.
+    """
+
+    def __init__(self, alias='default', timeout=24 * 60 * 60):
+        self.alias = alias
+        self.timeout = timeout
+
+    @classmethod
+    def from_settings(cls):
+        config = getattr(settings, 'BLOG_FRAGMENT_CACHE', {})
+        return cls(alias=config.get('ALIAS', 'default'), timeout=config.get('TIMEOUT', 24 * 60 * 60))
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def version(self, scope):
+        key = f'blog:version:{scope}'
+        version = self.cache.get(key)
+        if version is None:
+            # Start from the clock so an evicted counter never reuses an old value
+            self.cache.add(key, time.time_ns(), None)
+            version = self.cache.get(key)
+        return version
+
+    def bump(self, scope):
+        key = f'blog:version:{scope}'
+        try:
+            self.cache.incr(key)
+        except ValueError:
+            self.cache.set(key, time.time_ns(), None)
+
+    def list_versions(self):
+        return self.version('generation'), self.version('list')
+
+    def post_versions(self, post_id):
+        from .models import Comment
+
+        comments = Comment.store.stamp(post_id) or (0, 0)
+        return self.version('generation'), self.version(f'post:{post_id}'), *comments
+
+    def list_key(self, page_number):
+        generation, version = self.list_versions()
+        return f'blog:list:{generation}:{version}:{page_number}'
+
+    def post_key(self, post_id):
+        versions = ':'.join(str(version) for version in self.post_versions(post_id))
+        return f'blog:post:{post_id}:{versions}'
+
+    def get_or_render(self, key, render):
+        html = self.cache.get(key)
+        if html is None:
+            html = render()
+            self.cache.set(key, html, self.timeout)
+        return html
+
+    def post_changed(self, post_id):
+        self.bump('list')
+        self.bump(f'post:{post_id}')
+
+    def comments_changed(self, post_id):
+        self.bump(f'post:{post_id}')
+
+    def on_repository_change(self, event, payload):
+        if event == 'reset':
+            self.bump('generation')
+        elif event == 'put':
+            self.post_changed(payload['id'])
+        elif event == 'delete':
+            self.post_changed(payload)
+
+
+fragment_cache = FragmentCache.from_settings()
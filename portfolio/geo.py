@@ -0,0 +1,345 @@
+import asyncio
+import ipaddress
+import logging
+import os
+import threading
+import time
+import weakref
+from collections import OrderedDict
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from .metrics import timed
+
+logger = logging.getLogger(__name__)
+
+UNKNOWN = ('Unknown', 'Unknown')
+
+_reader = None
+_reader_lock = threading.Lock()
+_reader_unavailable = False
+
+
+def _database_path():
+    path = getattr(settings, 'GEOIP_PATH', None)
+    if not path:
+        return None
+    path = str(path)
+    if os.path.isdir(path):
+        for name in ('GeoLite2-City.mmdb', 'GeoIP2-City.mmdb', 'GeoLite2-Country.mmdb', 'GeoIP2-Country.mmdb'):
+            candidate = os.path.join(path, name)
+            if os.path.exists(candidate):
+                return candidate
+        return None
+    return path if os.path.exists(path) else None
+
+
+def get_reader():
+    """The memory-mapped MaxMind reader, or None if no database is available."""
+    global _reader, _reader_unavailable
+    if _reader is not None or _reader_unavailable:
+        return _reader
+    with _reader_lock:
+        if _reader is None and not _reader_unavailable:
+            path = _database_path()
+            try:
+                if path is None:
+                    raise FileNotFoundError(getattr(settings, 'GEOIP_PATH', None))
+                import maxminddb
+                # MODE_AUTO uses the C extension over mmap when it is built,
+                # and pure-Python mmap otherwise
+                _reader = maxminddb.open_database(path, maxminddb.MODE_AUTO)
+            except (ImportError, OSError, ValueError) as exc:
+                logger.warning("GeoIP database unavailable, local lookups disabled: %s", exc)
+                _reader_unavailable = True
+    return _reader
+
+
+def lookup_local(ip_address):
+    """Resolve from the local database; None when the address is not found."""
+    reader = get_reader()
+    if reader is None:
+        return None
+    try:
+        record = reader.get(ip_address)
+    except ValueError:
+        return None
+    if not record:
+        return None
+    country = record.get('country', {}).get('iso_code') or 'Unknown'
+    subdivisions = record.get('subdivisions')
+    region = subdivisions[-1].get('names', {}).get('en') if subdivisions else None
+    return country, region or 'Unknown'
+
+
+def lookup_remote(ip_address):
+    """Resolve through the HTTP provider in GEOIP_FALLBACK_URL, if configured."""
+    url = getattr(settings, 'GEOIP_FALLBACK_URL', None)
+    if not url:
+        return None
+    import requests
+    try:
+        response = requests.get(url.format(ip=ip_address), timeout=getattr(settings, 'GEOIP_FALLBACK_TIMEOUT', 2))
+        if response.status_code != 200:
+            logger.warning("GeoIP fallback returned %s for %s", response.status_code, ip_address)
+            return None
+        # requests' JSONDecodeError is a ValueError
+        return _location(response.json())
+    except (requests.RequestException, ValueError) as exc:
+        logger.warning("GeoIP fallback failed for %s: %s", ip_address, exc)
+        return None
+
+
+def _location(data):
+    """``(country, region)`` from a provider response body."""
+    if not isinstance(data, dict):
+        raise ValueError(f"unexpected response {data!r:.100}")
+    country, region = data.get('country'), data.get('region')
+    return (country if isinstance(country, str) and country else 'Unknown',
+            region if isinstance(region, str) and region else 'Unknown')
+
+
+def is_public(ip_address):
+    try:
+        return ipaddress.ip_address(ip_address).is_global
+    except ValueError:
+        return False
+
+
+class GeoCache:
+    """Bounded LRU cache of IP -> ``(country, region)`` with expiry.
+
+    Failed lookups are cached too, for the shorter ``negative_ttl``, so a
+    flood of unresolvable addresses does not turn into repeated lookups.
+    When ``shared_alias`` names a Django cache, entries are also written
+    there so that worker processes share each other's results.
+    """
+
+    def __init__(self, max_size=10000, ttl=86400, negative_ttl=300, shared_alias=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.shared_alias = shared_alias
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'shared_hits': 0, 'misses': 0, 'evictions': 0}
+
+    @classmethod
+    def from_settings(cls):
+        config = getattr(settings, 'GEOIP_CACHE', {})
+        return cls(
+            max_size=config.get('MAX_SIZE', 10000),
+            ttl=config.get('TTL', 86400),
+            negative_ttl=config.get('NEGATIVE_TTL', 300),
+            shared_alias=config.get('SHARED_ALIAS'),
+        )
+
+    def _shared(self):
+        if not self.shared_alias:
+            return None
+        from django.core.cache import caches
+        return caches[self.shared_alias]
+
+    def _get_local(self, ip_address):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(ip_address)
+            if entry is not None:
+                value, expires = entry
+                if expires > now:
+                    self._entries.move_to_end(ip_address)
+                    self.stats['hits'] += 1
+                    return value
+                del self._entries[ip_address]
+        return None
+
+    def _shared_hit(self, ip_address, value):
+        if value is None:
+            with self._lock:
+                self.stats['misses'] += 1
+            return None
+        value = tuple(value)
+        self._remember(ip_address, value)
+        with self._lock:
+            self.stats['shared_hits'] += 1
+        return value
+
+    def get(self, ip_address):
+        value = self._get_local(ip_address)
+        if value is not None:
+            return value
+        shared = self._shared()
+        return self._shared_hit(ip_address, shared.get(f'geoip:{ip_address}') if shared is not None else None)
+
+    async def aget(self, ip_address):
+        value = self._get_local(ip_address)
+        if value is not None:
+            return value
+        shared = self._shared()
+        # Not thread-sensitive: the default aget() would queue every beacon's
+        # file cache read on the one shared sync thread
+        return self._shared_hit(
+            ip_address,
+            await sync_to_async(shared.get, thread_sensitive=False)(f'geoip:{ip_address}')
+            if shared is not None else None,
+        )
+
+    def set(self, ip_address, value):
+        self._remember(ip_address, value)
+        shared = self._shared()
+        if shared is not None:
+            shared.set(f'geoip:{ip_address}', list(value), self._ttl_for(value))
+
+    async def aset(self, ip_address, value):
+        self._remember(ip_address, value)
+        shared = self._shared()
+        if shared is not None:
+            await sync_to_async(shared.set, thread_sensitive=False)(
+                f'geoip:{ip_address}', list(value), self._ttl_for(value),
+            )
+
+    def _ttl_for(self, value):
+        return self.negative_ttl if value == UNKNOWN else self.ttl
+
+    def _remember(self, ip_address, value):
+        expires = time.monotonic() + self._ttl_for(value)
+        with self._lock:
+            self._entries[ip_address] = (value, expires)
+            self._entries.move_to_end(ip_address)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.stats['evictions'] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+geo_cache = GeoCache.from_settings()
+
+
+def cache_stats():
+    """Hit/miss counters and current size of the geo cache."""
+    return {**geo_cache.stats, 'size': len(geo_cache)}
+
+
+@timed('geo.lookup')
+def get_country_and_region(ip_address):
+    """Return ``(country, region)`` for an IP, or ``('Unknown', 'Unknown')``.
+
+    Results are served from ``geo_cache`` when possible. Otherwise the local
+    MaxMind database is tried first, and the HTTP provider is only used when
+    it is configured and the address is missing from the database.
+    """
+    if not ip_address or not is_public(ip_address):
+        return UNKNOWN
+    cached = geo_cache.get(ip_address)
+    if cached is not None:
+        return cached
+    result = lookup_local(ip_address) or lookup_remote(ip_address) or UNKNOWN
+    geo_cache.set(ip_address, result)
+    return result
+
+
+class _LoopState:
+    """aiohttp session, concurrency limit and in-flight lookups of one event loop."""
+
+    def __init__(self, limit, timeout):
+        import aiohttp
+
+        self.session = aiohttp.ClientSession(
+            timeout=aiohttp.ClientTimeout(total=timeout),
+            connector=aiohttp.TCPConnector(limit=limit, ttl_dns_cache=300),
+        )
+        self.semaphore = asyncio.Semaphore(limit)
+        self.inflight = {}
+        self.closer = None
+
+    async def close_at_shutdown(self):
+        """Started once and left suspended; closes the session when finalised.
+
+        ``asyncio.run()``, which ASGI servers and asgiref use, closes open
+        async generators before it closes the loop, so the session is
+        closed on the loop that owns it.
+        """
+        try:
+            yield
+        finally:
+            await self.session.close()
+
+
+# aiohttp sessions are bound to the loop that created them
+_loop_states = weakref.WeakKeyDictionary()
+
+
+async def _loop_state():
+    loop = asyncio.get_running_loop()
+    state = _loop_states.get(loop)
+    if state is None or state.session.closed:
+        state = _loop_states[loop] = _LoopState(
+            limit=getattr(settings, 'GEOIP_FALLBACK_CONCURRENCY', 20),
+            timeout=getattr(settings, 'GEOIP_FALLBACK_TIMEOUT', 2),
+        )
+        state.closer = state.close_at_shutdown()
+        await state.closer.asend(None)
+    return state
+
+
+async def alookup_remote(ip_address):
+    """Async ``lookup_remote`` over a pooled aiohttp session.
+
+    At most ``GEOIP_FALLBACK_CONCURRENCY`` requests run at once per event
+    loop; waiting for a slot counts against ``GEOIP_FALLBACK_TIMEOUT``.
+    """
+    url = getattr(settings, 'GEOIP_FALLBACK_URL', None)
+    if not url:
+        return None
+    import aiohttp
+
+    state = await _loop_state()
+
+    async def fetch():
+        async with state.semaphore:
+            async with state.session.get(url.format(ip=ip_address)) as response:
+                if response.status != 200:
+                    logger.warning("GeoIP fallback returned %s for %s", response.status, ip_address)
+                    return None
+                return await response.json(content_type=None)
+
+    try:
+        data = await asyncio.wait_for(fetch(), getattr(settings, 'GEOIP_FALLBACK_TIMEOUT', 2))
+        return None if data is None else _location(data)
+    except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as exc:
+        logger.warning("GeoIP fallback failed for %s: %r", ip_address, exc)
+        return None
+
+
+async def _aresolve(ip_address):
+    result = lookup_local(ip_address) or await alookup_remote(ip_address) or UNKNOWN
+    await geo_cache.aset(ip_address, result)
+    return result
+
+
+@timed('geo.lookup')
+async def aget_country_and_region(ip_address):
+    """Async ``get_country_and_region`` that never blocks the event loop.
+
+    The local database is memory-mapped and answers in microseconds, so it
+    is read inline; only the HTTP fallback awaits. Concurrent lookups of
+    the same address share one request.
+    """
+    if not ip_address or not is_public(ip_address):
+        return UNKNOWN
+    cached = await geo_cache.aget(ip_address)
+    if cached is not None:
+        return cached
+    inflight = (await _loop_state()).inflight
+    task = inflight.get(ip_address)
+    if task is None:
+        task = inflight[ip_address] = asyncio.ensure_future(_aresolve(ip_address))
+        task.add_done_callback(lambda _: inflight.pop(ip_address, None))
+    return await asyncio.shield(task)
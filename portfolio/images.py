@@ -0,0 +1,91 @@
+import hashlib
+import io
+import logging
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WIDTHS = (320, 640, 1024, 1600)
+# Preferred first; formats the installed Pillow cannot write are skipped
+FORMATS = (
+    ('avif', 'AVIF', 'image/avif', {'quality': 60}),
+    ('webp', 'WEBP', 'image/webp', {'quality': 80, 'method': 4}),
+    ('jpeg', 'JPEG', 'image/jpeg', {'quality': 82, 'optimize': True, 'progressive': True}),
+)
+
+
+def content_hash(uploaded_file):
+    """SHA-256 of an uploaded file, leaving it rewound for saving."""
+    digest = hashlib.sha256()
+    for chunk in uploaded_file.chunks():
+        digest.update(chunk)
+    uploaded_file.seek(0)
+    return digest.hexdigest()
+
+
+@lru_cache(maxsize=None)
+def available_formats():
+    from PIL import Image
+
+    Image.init()
+    return tuple(fmt for fmt in FORMATS if fmt[1] in Image.SAVE)
+
+
+def variant_name(digest, width, ext):
+    return f'blog_images/derived/{digest[:2]}/{digest}-{width}w.{ext}'
+
+
+def build_variants(image_path, digest, storage=None):
+    """Write resized copies of an image; returns ``{ext: {width: name}}``.
+
+    Widths wider than the original are skipped, but the smallest configured
+    width is always produced so small uploads still get modern formats.
+    Names derive from the original's content hash, so rebuilding is a no-op
+    for variants that already exist.
+    """
+    from PIL import Image, ImageOps
+
+    from .storages import get_media_storage, touch
+
+    storage = storage or default_storage
+    widths = sorted(getattr(settings, 'BLOG_IMAGE_WIDTHS', DEFAULT_WIDTHS))
+    with get_media_storage().open(image_path, 'rb') as source:
+        image = ImageOps.exif_transpose(Image.open(source))
+        image.load()
+
+    targets = [width for width in widths if width < image.width] or [min(widths[0], image.width)]
+    variants = {}
+    for ext, pil_format, _, options in available_formats():
+        for width in targets:
+            name = variant_name(digest, width, ext)
+            if not storage.exists(name):
+                resized = image.copy()
+                resized.thumbnail((width, round(width * image.height / image.width) or 1), Image.LANCZOS)
+                if pil_format == 'JPEG' and resized.mode not in ('RGB', 'L'):
+                    resized = resized.convert('RGB')
+                buffer = io.BytesIO()
+                resized.save(buffer, pil_format, **options)
+                storage.save(name, ContentFile(buffer.getvalue()))
+            else:
+                touch(storage, name)
+            variants.setdefault(ext, {})[width] = name
+    return variants
+
+
+def generate_post_variants(post_id, image_path, digest):
+    """Background task: build variants and record them on the post."""
+    from .models import BlogPost
+
+    try:
+        variants = build_variants(image_path, digest)
+    except (OSError, ValueError) as exc:
+        logger.warning("Could not build image variants for %s: %s", image_path, exc)
+        return
+    post = BlogPost.get(post_id)
+    # Skip if the post was deleted or its image replaced in the meantime
+    if post is not None:
+        post.update(expected={'image': image_path}, image_variants=variants)
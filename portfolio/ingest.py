@@ -0,0 +1,326 @@
+import atexit
+import logging
+import queue
+import threading
+import time
+from datetime import datetime, timezone
+
+from django.conf import settings
+
+from .events import clean_url, parse_scroll, parse_seconds
+from .geo import UNKNOWN, get_country_and_region
+from .rollups import RollupAccumulator, parse_visit_time, view_dimensions, visit_dimensions
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'FLUSH_INTERVAL': 1.0,
+    'MAX_BATCH_SIZE': 500,
+    'MAX_QUEUE_SIZE': 10000,
+    # What to do when the queue is full: 'block' (wait up to BLOCK_TIMEOUT,
+    # then drop), 'drop', or 'sync' (write the event on the calling thread)
+    'BACKPRESSURE': 'block',
+    'BLOCK_TIMEOUT': 0.5,
+}
+
+_STOP = object()
+
+
+def _as_list(value):
+    """A beacon's per-page field as a list; a lone value becomes one item."""
+    if isinstance(value, (list, tuple)):
+        return list(value)
+    if value is None or isinstance(value, dict):
+        return []
+    return [value]
+
+
+def _as_text(value, default):
+    return value if isinstance(value, str) else default
+
+
+class _Barrier:
+    def __init__(self):
+        self.done = threading.Event()
+
+
+class AnalyticsIngestQueue:
+    """Moves analytics writes off the request thread.
+
+    Requests enqueue new-profile and beacon events. A background writer drains
+    the queue in batches of up to ``max_batch_size`` events or
+    ``flush_interval`` seconds, coalesces events for the same session, and
+    writes each batch with a single upsert transaction. Pending events are
+    flushed at interpreter exit.
+    """
+
+    def __init__(self, flush_interval, max_batch_size, max_queue_size, backpressure, block_timeout):
+        self.flush_interval = flush_interval
+        self.max_batch_size = max_batch_size
+        self.backpressure = backpressure
+        self.block_timeout = block_timeout
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._atexit_registered = False
+        # Serialises the writer thread with 'sync' backpressure flushes
+        self._flush_lock = threading.Lock()
+        self.stats = {'enqueued': 0, 'dropped': 0, 'batches': 0, 'written': 0, 'events': 0, 'failed': 0}
+
+    @classmethod
+    def from_settings(cls):
+        config = {**DEFAULTS, **getattr(settings, 'ANALYTICS_INGEST', {})}
+        return cls(
+            flush_interval=config['FLUSH_INTERVAL'],
+            max_batch_size=config['MAX_BATCH_SIZE'],
+            max_queue_size=config['MAX_QUEUE_SIZE'],
+            backpressure=config['BACKPRESSURE'],
+            block_timeout=config['BLOCK_TIMEOUT'],
+        )
+
+    def _ensure_started(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="analytics-ingest", daemon=True)
+                self._thread.start()
+                if not self._atexit_registered:
+                    atexit.register(self.stop)
+                    self._atexit_registered = True
+
+    def submit_profile(self, profile):
+        """Queue creation of a profile; an existing profile for the session wins."""
+        from .models import VisitorProfile
+
+        # Count the session as known once queued, so follow-up requests do
+        # not queue duplicate profiles before this one is flushed. A dropped
+        # profile is not remembered and is submitted again next request.
+        if self._put(('profile', profile.session_id, profile._to_row())):
+            VisitorProfile.store.remember(profile.session_id)
+
+    def submit_beacon(self, session_id, ip_address, page_urls, scroll_depth, time_spent,
+                      utm_source=None, country='Unknown', region='Unknown', block=True):
+        """Queue a beacon for the session's profile.
+
+        With ``block=False`` (for event loops) the call never waits: a full
+        queue drops the beacon whatever the backpressure policy. Fields come
+        from client JSON, so they are coerced to lists and strings here.
+        """
+        self._put(('beacon', session_id, {
+            'received_at': time.time(),
+            'ip_address': ip_address,
+            'page_urls': _as_list(page_urls),
+            'scroll_depth': _as_list(scroll_depth),
+            'time_spent': _as_list(time_spent),
+            'utm_source': _as_text(utm_source, None),
+            'country': _as_text(country, 'Unknown'),
+            'region': _as_text(region, 'Unknown'),
+        }), block=block)
+
+    def _put(self, event, block=True):
+        """Queue an event; returns False if it was dropped."""
+        self._ensure_started()
+        try:
+            if not block:
+                self._queue.put_nowait(event)
+            elif self.backpressure == 'block':
+                self._queue.put(event, timeout=self.block_timeout)
+            else:
+                self._queue.put_nowait(event)
+        except queue.Full:
+            if block and self.backpressure == 'sync':
+                self._flush([event])
+            else:
+                self.stats['dropped'] += 1
+                logger.warning("Analytics queue full, dropped %s event", event[0])
+                return False
+            return True
+        self.stats['enqueued'] += 1
+        return True
+
+    def drain(self, timeout=None):
+        """Block until everything queued so far has been written."""
+        if self._thread is None or not self._thread.is_alive():
+            self._flush(self._take_all())
+            return
+        barrier = _Barrier()
+        self._queue.put(barrier)
+        barrier.done.wait(timeout)
+
+    def stop(self, timeout=10):
+        """Flush pending events and stop the writer."""
+        thread = self._thread
+        if thread is None or not thread.is_alive():
+            return
+        self._queue.put(_STOP)
+        thread.join(timeout)
+
+    def _take_all(self):
+        events = []
+        while True:
+            try:
+                event = self._queue.get_nowait()
+            except queue.Empty:
+                return events
+            if isinstance(event, _Barrier):
+                event.done.set()
+            elif event is not _STOP:
+                events.append(event)
+
+    def _run(self):
+        while True:
+            try:
+                event = self._queue.get()
+            except Exception:  # interpreter shutting down
+                return
+            batch = []
+            barriers = []
+            stopping = False
+            deadline = time.monotonic() + self.flush_interval
+            while True:
+                if event is _STOP:
+                    stopping = True
+                    batch.extend(self._take_all())
+                    break
+                if isinstance(event, _Barrier):
+                    barriers.append(event)
+                    break
+                batch.append(event)
+                remaining = deadline - time.monotonic()
+                if len(batch) >= self.max_batch_size or remaining <= 0:
+                    break
+                try:
+                    event = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+            self._flush(batch)
+            for barrier in barriers:
+                barrier.done.set()
+            if stopping:
+                return
+
+    def _flush(self, events):
+        if not events:
+            return
+        from .models import VisitorProfile
+
+        # Lookups may wait on the geo provider, so they run before the lock
+        # is taken and never hold up a 'sync' backpressure flush
+        self._resolve_locations(VisitorProfile.store, events)
+        with self._flush_lock:
+            self._write_batch(VisitorProfile.store, VisitorProfile.events, VisitorProfile.rollups, events)
+
+    def _resolve_locations(self, store, events):
+        """Look up the location of beacons that arrived without one.
+
+        Only for sessions whose profile does not have a location yet; each
+        address is looked up once per batch.
+        """
+        unresolved = [
+            (session_id, payload) for kind, session_id, payload in events
+            if kind == 'beacon' and (payload['country'], payload['region']) == UNKNOWN
+        ]
+        if not unresolved:
+            return
+        try:
+            profiles = {session_id: payload for kind, session_id, payload in events if kind == 'profile'}
+            profiles.update(store.get_many({session_id for session_id, _ in unresolved}))
+            locations = {}
+            for session_id, payload in unresolved:
+                row = profiles.get(session_id)
+                if row is None or (row['country'] != 'Unknown' and row['region'] != 'Unknown'):
+                    continue
+                ip_address = payload['ip_address']
+                if ip_address not in locations:
+                    locations[ip_address] = get_country_and_region(ip_address)
+                payload['country'], payload['region'] = locations[ip_address]
+        except Exception:
+            # The beacons are still written, without a location
+            logger.exception("Failed to resolve locations for %d beacons", len(unresolved))
+
+    def _write_batch(self, store, event_store, rollup_store, events):
+        try:
+            pending = {}
+            for kind, session_id, payload in events:
+                entry = pending.setdefault(session_id, {'profile': None, 'beacons': []})
+                if kind == 'profile':
+                    entry['profile'] = entry['profile'] or payload
+                else:
+                    entry['beacons'].append(payload)
+
+            existing = store.get_many(pending)
+            rows = []
+            page_views = []
+            rollups = RollupAccumulator()
+            for session_id, entry in pending.items():
+                row = existing.get(session_id) or entry['profile']
+                if row is None:
+                    # Beacons for sessions without a profile are ignored
+                    continue
+                try:
+                    row = dict(row)
+                    session_views = []
+                    for beacon in entry['beacons']:
+                        self._apply_beacon(row, beacon)
+                        session_views.extend(self._page_views(session_id, beacon))
+                    # Rollups use the profile as it is after this batch's beacons
+                    visit = None
+                    if session_id not in existing:
+                        moment = parse_visit_time(row['date_time_visited']) or datetime.now(timezone.utc)
+                        visit = (moment, visit_dimensions(row))
+                    views = [
+                        (datetime.fromtimestamp(timestamp, tz=timezone.utc), view_dimensions(row, url, scroll),
+                         seconds, scroll)
+                        for timestamp, _, url, scroll, seconds in session_views
+                    ]
+                except Exception:
+                    # Only this session's events are lost, not the batch
+                    self.stats['failed'] += 1
+                    logger.exception("Dropped analytics events of session %s", session_id)
+                    continue
+                rows.append(row)
+                page_views.extend(session_views)
+                if visit is not None:
+                    rollups.add_visit(*visit)
+                for moment, dimensions, seconds, scroll in views:
+                    rollups.add_views(moment, dimensions, 1, seconds, scroll)
+
+            # A backfill replacing these days sees all of the batch or none
+            with rollup_store.locked():
+                store.upsert_many(rows)
+                event_store.append(page_views)
+                rollup_store.add(rollups)
+            self.stats['batches'] += 1
+            self.stats['written'] += len(rows)
+            self.stats['events'] += len(page_views)
+        except Exception:
+            logger.exception("Failed to write %d analytics events", len(events))
+
+    def _page_views(self, session_id, beacon):
+        """One event store row per page in the beacon."""
+        scroll_depth, time_spent = beacon['scroll_depth'], beacon['time_spent']
+        # Built in full so a bad value fails before any view is kept
+        views = []
+        for position, url in enumerate(beacon['page_urls']):
+            views.append((
+                beacon['received_at'],
+                session_id,
+                clean_url(url),
+                parse_scroll(scroll_depth[position]) if position < len(scroll_depth) else 0,
+                parse_seconds(time_spent[position]) if position < len(time_spent) else 0,
+            ))
+        return views
+
+    def _apply_beacon(self, row, beacon):
+        # Page views go to the event store; the profile keeps session-level fields
+        row['utm_source'] = beacon['utm_source'] or row['utm_source']
+
+        # Update country and region if they are unknown; beacons that came
+        # without them were looked up by _resolve_locations()
+        if row['country'] == 'Unknown' or row['region'] == 'Unknown':
+            row['country'] = beacon['country']
+            row['region'] = beacon['region']
+
+
+analytics_queue = AnalyticsIngestQueue.from_settings()
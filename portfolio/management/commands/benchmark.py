@@ -0,0 +1,60 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from portfolio.benchmarks import compare, run
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark model operations and blog/analytics requests against synthetic data "
+        "of increasing size, in temporary stores. Prints JSON results."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sizes', type=int, nargs='+', default=[1000, 10000],
+            help="Rows of each kind to seed, one run per size (default: 1000 10000; try 100000).",
+        )
+        parser.add_argument('--seed', type=int, default=0, help="Seed for the data generators (default: 0).")
+        parser.add_argument('--repeat', type=int, default=5, help="Base number of runs per benchmark (default: 5).")
+        parser.add_argument('--output', help="Write the results to this file instead of stdout.")
+        parser.add_argument('--compare', metavar='BASELINE', help="Results file to compare medians against.")
+        parser.add_argument(
+            '--threshold', type=float, default=0.25,
+            help="With --compare, fail when a median grows by more than this fraction (default: 0.25).",
+        )
+
+    def handle(self, *args, **options):
+        baseline = None
+        if options['compare']:
+            try:
+                with open(options['compare']) as baseline_file:
+                    baseline = json.load(baseline_file)
+            except (OSError, ValueError) as exc:
+                raise CommandError(f"Cannot read baseline {options['compare']}: {exc}")
+
+        results = run(
+            options['sizes'], seed_value=options['seed'], repeat=options['repeat'],
+            log=lambda message: self.stderr.write(message),
+        )
+        if baseline is not None:
+            results['regressions'] = compare(results, baseline, options['threshold'])
+
+        document = json.dumps(results, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                output.write(document + '\n')
+        else:
+            self.stdout.write(document)
+
+        if baseline is not None:
+            for regression in results['regressions']:
+                self.stderr.write(
+                    f"{regression['benchmark']} @ {regression['size']}: "
+                    f"{regression['baseline_ms']}ms -> {regression['current_ms']}ms "
+                    f"(+{regression['change']:.0%})"
+                )
+            if results['regressions']:
+                raise CommandError(f"{len(results['regressions'])} benchmark(s) regressed.")
+            self.stderr.write(self.style.SUCCESS("No regressions."))
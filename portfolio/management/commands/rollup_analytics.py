@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from portfolio.models import VisitorProfile
+from portfolio.rollups import backfill
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute hourly and daily analytics rollups from the stored page view events. "
+        "Safe to run while the site is ingesting: it locks out the ingest writer while days are replaced."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', help="First day to recompute, YYYY-MM-DD (default: all days).")
+        parser.add_argument('--until', help="Last day to recompute, YYYY-MM-DD (default: all days).")
+        parser.add_argument(
+            '--batch-size', type=int, default=10000,
+            help="Visitor profiles to read and commit at a time (default: 10000).",
+        )
+        parser.add_argument(
+            '--restart', action='store_true',
+            help="Start over instead of resuming an interrupted run for the same days.",
+        )
+
+    def handle(self, *args, **options):
+        since, until = options['since'], options['until']
+        if since and until and since > until:
+            raise CommandError("--since must not be after --until.")
+        if options['batch_size'] < 1:
+            raise CommandError("--batch-size must be at least 1.")
+        days = [
+            day for day in VisitorProfile.events.days()
+            if (not since or day >= since) and (not until or day <= until)
+        ]
+        views = backfill(
+            VisitorProfile.rollups, VisitorProfile.events, VisitorProfile.store, days,
+            batch_size=options['batch_size'], restart=options['restart'],
+        )
+        self.stdout.write(self.style.SUCCESS(f"Rolled up {views} page view(s) over {len(days)} day(s)."))
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from portfolio.models import BlogPost
+from portfolio.storages import get_media_storage, reference_counts, sweep_orphans
+
+
+class Command(BaseCommand):
+    help = "Delete uploaded blog media that no post refers to any more."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--grace', type=int, default=3600,
+            help="Keep files modified within this many seconds (default: 3600).",
+        )
+        parser.add_argument('--dry-run', action='store_true', help="List orphans without deleting them.")
+
+    def handle(self, *args, **options):
+        referenced = reference_counts(BlogPost.all())
+        removed = sweep_orphans(
+            get_media_storage(), referenced,
+            grace_seconds=options['grace'], dry_run=options['dry_run'],
+        )
+        for name in removed:
+            self.stdout.write(name)
+        verb = "Would remove" if options['dry_run'] else "Removed"
+        self.stdout.write(self.style.SUCCESS(f"{verb} {len(removed)} orphaned file(s)."))
@@ -0,0 +1,172 @@
+import mimetypes
+import os
+import re
+import stat
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseNotModified
+from django.utils._os import safe_join
+from django.utils.http import http_date, parse_http_date_safe
+
+# Names written by ContentAddressedStorage embed their SHA-256
+_HASHED_NAME = re.compile(r'(?:^|/)([0-9a-f]{64})(?:-\d+w)?\.[A-Za-z0-9]+$')
+_RANGE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+REVALIDATE_CACHE_CONTROL = 'public, max-age=0, must-revalidate'
+
+
+class _FileRange:
+    """File-like view of ``length`` bytes of ``file`` from its current position.
+
+    It keeps ``fileno()`` and ``tell()``, so servers that use ``sendfile``
+    through ``wsgi.file_wrapper`` (gunicorn, for one) still send the range
+    zero-copy, bounded by Content-Length. Other servers read through
+    ``read()``, which stops at the end of the range.
+    """
+
+    def __init__(self, file, length):
+        self.file = file
+        self.remaining = length
+        self.name = file.name
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def tell(self):
+        return self.file.tell()
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def seekable(self):
+        return False
+
+    def close(self):
+        self.file.close()
+
+
+def _etag(path, st):
+    match = _HASHED_NAME.search(path)
+    if match:
+        return f'"{match.group(0).rsplit("/", 1)[-1]}"', True
+    return f'"{st.st_size:x}-{st.st_mtime_ns:x}"', False
+
+
+def _etag_matches(header, etag):
+    if header.strip() == '*':
+        return True
+    candidates = [candidate.strip() for candidate in header.split(',')]
+    # If-None-Match uses weak comparison
+    return etag in candidates or f'W/{etag}' in candidates
+
+
+def _not_modified(request, etag, mtime):
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if if_none_match is not None:
+        return _etag_matches(if_none_match, etag)
+    since = parse_http_date_safe(request.META.get('HTTP_IF_MODIFIED_SINCE') or '')
+    return since is not None and int(mtime) <= since
+
+
+def _requested_range(request, size, etag, mtime):
+    """``(start, end)`` inclusive, None for the whole file, or 'invalid'."""
+    header = request.META.get('HTTP_RANGE')
+    if not header or request.method not in ('GET', 'HEAD'):
+        return None
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if if_range:
+        if if_range.startswith(('"', 'W/')):
+            # If-Range requires a strong match
+            if if_range.strip() != etag:
+                return None
+        elif parse_http_date_safe(if_range) != int(mtime):
+            return None
+    match = _RANGE.match(header.strip())
+    if not match:
+        # Multiple or malformed ranges: serving the full file is allowed
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        start, end = max(size - int(last), 0), size - 1
+    else:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        return 'invalid'
+    return start, end
+
+
+def _set_common_headers(response, etag, mtime, immutable, content_type):
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(mtime)
+    response['Accept-Ranges'] = 'bytes'
+    response['Cache-Control'] = IMMUTABLE_CACHE_CONTROL if immutable else REVALIDATE_CACHE_CONTROL
+    if content_type and not response.has_header('Content-Type'):
+        response['Content-Type'] = content_type
+
+
+def serve_media(request, path):
+    """Serve a file from MEDIA_ROOT with Range and conditional GET support.
+
+    Content-addressed names get a strong ETag from their hash and a
+    year-long immutable Cache-Control. With ``MEDIA_ACCEL_MODE`` set to
+    ``'x-accel-redirect'`` (nginx) or ``'x-sendfile'`` (Apache, lighttpd)
+    the file itself is left to the fronting proxy after validation.
+    """
+    if request.method not in ('GET', 'HEAD'):
+        return HttpResponse(status=405, headers={'Allow': 'GET, HEAD'})
+    try:
+        fullpath = safe_join(settings.MEDIA_ROOT, path)
+    except SuspiciousFileOperation:
+        raise Http404("Media file not found")
+    try:
+        st = os.stat(fullpath)
+    except OSError:
+        raise Http404("Media file not found")
+    if not stat.S_ISREG(st.st_mode):
+        raise Http404("Media file not found")
+
+    etag, immutable = _etag(path, st)
+    content_type = mimetypes.guess_type(fullpath)[0] or 'application/octet-stream'
+
+    if _not_modified(request, etag, st.st_mtime):
+        response = HttpResponseNotModified()
+        _set_common_headers(response, etag, st.st_mtime, immutable, None)
+        return response
+
+    accel_mode = getattr(settings, 'MEDIA_ACCEL_MODE', None)
+    if accel_mode:
+        response = HttpResponse(content_type=content_type)
+        if accel_mode == 'x-accel-redirect':
+            prefix = getattr(settings, 'MEDIA_ACCEL_PREFIX', '/protected-media/')
+            response['X-Accel-Redirect'] = prefix.rstrip('/') + '/' + path.lstrip('/')
+        else:
+            response['X-Sendfile'] = fullpath
+        _set_common_headers(response, etag, st.st_mtime, immutable, content_type)
+        return response
+
+    byte_range = _requested_range(request, st.st_size, etag, st.st_mtime)
+    if byte_range == 'invalid':
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{st.st_size}'
+        return response
+
+    file = open(fullpath, 'rb')
+    if byte_range is None:
+        response = FileResponse(file, content_type=content_type)
+    else:
+        start, end = byte_range
+        file.seek(start)
+        response = FileResponse(_FileRange(file, end - start + 1), status=206, content_type=content_type)
+        response['Content-Length'] = end - start + 1
+        response['Content-Range'] = f'bytes {start}-{end}/{st.st_size}'
+    _set_common_headers(response, etag, st.st_mtime, immutable, content_type)
+    return response
@@ -0,0 +1,231 @@
+import bisect
+import contextlib
+import contextvars
+import functools
+import threading
+import time
+
+from asgiref.sync import iscoroutinefunction
+
+# Upper bounds in seconds, roughly doubling from 0.1ms to 10s
+DEFAULT_BUCKETS = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0,
+    2.5, 5.0, 10.0,
+)
+QUANTILES = (0.5, 0.9, 0.99)
+
+# Server-Timing entries of the request being handled, if any
+_request_timings = contextvars.ContextVar('request_timings', default=None)
+
+
+class Histogram:
+    """Fixed-bucket latency histogram; ``observe`` is a bisect and three adds."""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # the last one is +Inf
+        self.count = 0
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds):
+        index = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.sum += seconds
+
+    def snapshot(self):
+        with self._lock:
+            return list(self.counts), self.count, self.sum
+
+    def quantile(self, q, counts=None, count=None):
+        """Estimate a quantile by interpolating inside its bucket."""
+        if counts is None:
+            counts, count, _ = self.snapshot()
+        if not count:
+            return None
+        rank = q * count
+        seen = 0
+        for index, bucket_count in enumerate(counts):
+            if seen + bucket_count >= rank and bucket_count:
+                if index == len(self.buckets):
+                    return self.buckets[-1]
+                lower = self.buckets[index - 1] if index else 0.0
+                upper = self.buckets[index]
+                return lower + (upper - lower) * (rank - seen) / bucket_count
+            seen += bucket_count
+        return self.buckets[-1]
+
+
+class MetricsRegistry:
+    """Named histograms and gauges, rendered in the Prometheus text format."""
+
+    def __init__(self):
+        self._histograms = {}  # (name, labels) -> Histogram
+        self._help = {}
+        self._gauges = []  # (name, help, callable returning {labels: value})
+        self._lock = threading.Lock()
+
+    def histogram(self, name, help_text='', **labels):
+        key = (name, tuple(sorted(labels.items())))
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            with self._lock:
+                histogram = self._histograms.setdefault(key, Histogram())
+                self._help.setdefault(name, help_text)
+        return histogram
+
+    def gauge(self, name, help_text, collect):
+        """Register ``collect()``, called at scrape time for ``{labels: value}``."""
+        self._gauges.append((name, help_text, collect))
+
+    def render(self):
+        lines = []
+        families = {}
+        for (name, labels), histogram in sorted(self._histograms.items()):
+            families.setdefault(name, []).append((labels, histogram))
+        for name, members in families.items():
+            lines.append(f'# HELP {name} {self._help.get(name, "")}')
+            lines.append(f'# TYPE {name} histogram')
+            quantile_lines = []
+            for labels, histogram in members:
+                counts, count, total = histogram.snapshot()
+                cumulative = 0
+                for bound, bucket_count in zip(histogram.buckets + ('+Inf',), counts):
+                    cumulative += bucket_count
+                    lines.append(f'{name}_bucket{_labels(labels, le=bound)} {cumulative}')
+                lines.append(f'{name}_sum{_labels(labels)} {total:.6f}')
+                lines.append(f'{name}_count{_labels(labels)} {count}')
+                for q in QUANTILES:
+                    value = histogram.quantile(q, counts, count)
+                    if value is not None:
+                        quantile_lines.append(f'{name}_estimate{_labels(labels, quantile=q)} {value:.6f}')
+            if quantile_lines:
+                lines.append(f'# HELP {name}_estimate Quantiles of {name} estimated from its buckets')
+                lines.append(f'# TYPE {name}_estimate gauge')
+                lines.extend(quantile_lines)
+        for name, help_text, collect in self._gauges:
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} gauge')
+            for labels, value in collect().items():
+                lines.append(f'{name}{_labels(labels)} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(labels, **extra):
+    pairs = list(labels) + list(extra.items())
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in pairs) + '}'
+
+
+registry = MetricsRegistry()
+
+
+def record(operation, seconds):
+    """Add a store/lookup timing to its histogram and to Server-Timing."""
+    registry.histogram(
+        'portfolio_operation_seconds', 'Time spent in storage and lookup operations', operation=operation,
+    ).observe(seconds)
+    timings = _request_timings.get()
+    if timings is not None:
+        timings.append((operation, seconds))
+
+
+def start_request():
+    """Begin collecting Server-Timing entries; returns (entries, token)."""
+    timings = []
+    return timings, _request_timings.set(timings)
+
+
+def end_request(token):
+    _request_timings.reset(token)
+
+
+# Clients choose the method, so anything else shares one label value
+LABELLED_METHODS = frozenset({'GET', 'HEAD', 'POST'})
+
+
+def observe_request(view, method, seconds):
+    registry.histogram(
+        'portfolio_request_seconds', 'Request latency by view',
+        view=view, method=method if method in LABELLED_METHODS else 'OTHER',
+    ).observe(seconds)
+
+
+def server_timing(timings, total):
+    """``Server-Timing`` header value: the total plus each timed operation."""
+    merged = {}
+    for operation, seconds in timings:
+        count, duration = merged.get(operation, (0, 0.0))
+        merged[operation] = (count + 1, duration + seconds)
+    entries = [f'total;dur={total * 1000:.2f}']
+    for operation, (count, duration) in merged.items():
+        name = operation.replace('.', '-')
+        description = f';desc="{count} calls"' if count > 1 else ''
+        entries.append(f'{name};dur={duration * 1000:.2f}{description}')
+    return ', '.join(entries)
+
+
+@contextlib.contextmanager
+def timing(operation):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(operation, time.perf_counter() - start)
+
+
+def timed(operation):
+    """Decorator form of ``timing``; works on coroutine functions too."""
+    def decorator(func):
+        if iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return await func(*args, **kwargs)
+                finally:
+                    record(operation, time.perf_counter() - start)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                record(operation, time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+
+def _stats_gauge(name, help_text, stats):
+    registry.gauge(name, help_text, lambda: {(('kind', key),): value for key, value in stats().items()})
+
+
+def register_default_gauges():
+    """Counters kept by the stores, queues and caches, read at scrape time."""
+    from .geo import cache_stats
+    from .ingest import analytics_queue
+    from .models import BlogPost, VisitorProfile
+    from .sessions import write_behind
+    from .traffic import traffic_classifier
+
+    _stats_gauge('portfolio_geo_cache', 'GeoIP cache hits, misses, evictions and size', cache_stats)
+    _stats_gauge('portfolio_traffic_requests', 'Requests by analytics classification', lambda: traffic_classifier.stats)
+    _stats_gauge('portfolio_analytics_ingest', 'Analytics ingest queue counters', lambda: analytics_queue.stats)
+    _stats_gauge('portfolio_session_write_behind', 'Session write-behind counters', lambda: write_behind.stats)
+    registry.gauge(
+        'portfolio_stored_items', 'Number of stored items by kind',
+        lambda: {
+            (('kind', 'blog_posts'),): len(BlogPost.repository),
+            (('kind', 'visitor_profiles'),): VisitorProfile.store.count(),
+            (('kind', 'event_days'),): len(VisitorProfile.events.days()),
+        },
+    )
@@ -1,38 +1,84 @@
 import time
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
 from django.utils.deprecation import MiddlewareMixin
+from . import metrics
+from .ingest import analytics_queue
 from .models import VisitorProfile
+from .traffic import traffic_classifier
 from django.utils.timezone import now
 from pytz import timezone
 
 NYC_TIMEZONE = timezone('America/New_York')
 
+class MetricsMiddleware:
+    """Times every request per view and adds a ``Server-Timing`` header.
+
+    Listed first in MIDDLEWARE so the total covers the other middleware.
+    Store and lookup operations timed while the request is handled get their
+    own Server-Timing entries.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        timings, token = metrics.start_request()
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            metrics.end_request(token)
+        return self._finish(request, response, timings, time.perf_counter() - start)
+
+    async def __acall__(self, request):
+        timings, token = metrics.start_request()
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            metrics.end_request(token)
+        return self._finish(request, response, timings, time.perf_counter() - start)
+
+    def _finish(self, request, response, timings, total):
+        match = getattr(request, 'resolver_match', None)
+        view = match.url_name if match and match.url_name else 'unmatched'
+        metrics.observe_request(view, request.method, total)
+        response['Server-Timing'] = metrics.server_timing(timings, total)
+        return response
+
+
 class AnalyticsMiddleware(MiddlewareMixin):
 
     def process_request(self, request):
-        request.start_time = time.time()
+        # Static files, admin, beacons and crawlers get no session or profile
+        request.analytics_skip = traffic_classifier.classify_request(request)
+        if request.analytics_skip:
+            return
+
         if not request.session.session_key:
             request.session.save()
         
         session_id = request.session.session_key
-        if session_id:
-            visitor_profiles = VisitorProfile.all()
-            visitor_profile_exists = any(profile.session_id == session_id for profile in visitor_profiles)
-
-            if not visitor_profile_exists:
-                request.session['is_new_profile_needed'] = True
-            else:
-                request.session['is_new_profile_needed'] = False
+        # Kept on the request so the session is not rewritten on every page view
+        request.is_new_profile_needed = bool(session_id) and not VisitorProfile.exists(session_id)
 
     def process_response(self, request, response):
+        if getattr(request, 'analytics_skip', None):
+            return response
+
         session_id = request.session.session_key
         if not session_id:
             request.session.save()
             session_id = request.session.session_key
 
-        if request.path_info.startswith('/track_analytics/') or request.path_info.startswith('/media/'):
-            return response
-
-        if request.session.get('is_new_profile_needed'):
+        if getattr(request, 'is_new_profile_needed', False):
             ip_address = self.get_client_ip(request)
             user_agent = request.META.get('HTTP_USER_AGENT', '')
             device_type = self._get_device_type(user_agent)  
@@ -52,9 +98,7 @@ class AnalyticsMiddleware(MiddlewareMixin):
                 scroll_depth=[],
                 time_spent=[]
             )
-            new_profile.save()
-
-            request.session['is_new_profile_needed'] = False
+            analytics_queue.submit_profile(new_profile)
 
         return response
 
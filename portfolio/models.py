@@ -1,17 +1,33 @@
 import csv
+import json
 import os
 from datetime import datetime
+from asgiref.sync import sync_to_async
 from django.conf import settings
 from pytz import timezone
 from django.core.files.storage import default_storage
-import urllib.parse
+from . import tasks
+from .comment_store import CommentStore
+from .events import EventStore
+from .content import CONTENT_FORMAT, derive_content_fields
+from .fragment_cache import fragment_cache
+from .images import available_formats, content_hash, generate_post_variants
+from .metrics import timed
+from .pdfs import generate_post_pdf_info
+from .storages import get_media_storage
+from .profile_store import VisitorProfileStore
+from .repository import BlogPostRepository
+from .rollups import RollupStore
+from .search import SearchIndex, SearchResults
 
 NYC_TIMEZONE = timezone('America/New_York')
 
 # Paths for CSV files
 TAGS_CSV = os.path.join(settings.BASE_DIR, 'data', 'tags.csv')
 BLOGPOSTS_CSV = os.path.join(settings.BASE_DIR, 'data', 'blogposts.csv')
+BLOGPOSTS_LOG = os.path.join(settings.BASE_DIR, 'data', 'blogposts.log')
 COMMENTS_CSV = os.path.join(settings.BASE_DIR, 'data', 'comments.csv')
+COMMENTS_DIR = os.path.join(settings.BASE_DIR, 'data', 'comments')
 VISITORPROFILE_CSV = os.path.join(settings.BASE_DIR, 'data', 'visitorprofiles.csv')
 
 
@@ -29,9 +45,14 @@ def ensure_csv_exists(file_path, headers):
 
 import uuid
 class BlogPost:
-    fields = ["id", "title", "content", "image", "pdf", "published_date", "author"]
-
-    def __init__(self, title, content, image='', pdf='', author='', id=None, published_date=None):
+    fields = ["id", "title", "content", "image", "pdf", "published_date", "author", "image_variants",
+              "pdf_info", "excerpt", "content_html", "word_count", "reading_time", "content_format"]
+    # Computed from content whenever it is saved
+    derived_fields = ["excerpt", "content_html", "word_count", "reading_time", "content_format"]
+
+    def __init__(self, title, content, image='', pdf='', author='', id=None, published_date=None,
+                 image_variants=None, pdf_info=None, excerpt=None, content_html=None, word_count=None,
+                 reading_time=None, content_format=None):
         self.id = id or str(uuid.uuid4())  # Generate a unique ID if none is provided
         self.title = title
         self.content = content
@@ -43,144 +64,278 @@ class BlogPost:
         # File paths for saved image and pdf
         self.image_path = image if isinstance(image, str) else ''
         self.pdf_path = pdf if isinstance(pdf, str) else ''
+        # Resized copies of the image, {format: {width: path}}
+        self.image_variants = image_variants or {}
+        # Page count, metadata, excerpt and preview/text files of the PDF
+        self.pdf_info = pdf_info or {}
+
+        # Rows the repository has not upgraded yet get them computed here
+        if content_html is None:
+            self.derive_content_fields()
+        else:
+            self.excerpt = excerpt
+            self.content_html = content_html
+            self.word_count = word_count
+            self.reading_time = reading_time
+            self.content_format = content_format
+
+    def derive_content_fields(self):
+        for field, value in derive_content_fields(self.content).items():
+            setattr(self, field, value)
 
     def save(self):
         # Save image file
+        image_digest = None
         if self.image and not isinstance(self.image, str):
-            self.image_path = default_storage.save(f'blog_images/{self.image.name}', self.image)
+            image_digest = content_hash(self.image)
+            self.image_path = get_media_storage().save(f'blog_images/{self.image.name}', self.image)
+            self.image_variants = {}
         
         # Save PDF file
+        new_pdf = False
         if self.pdf and not isinstance(self.pdf, str):
-            self.pdf_path = default_storage.save(f'blog_pdfs/{self.pdf.name}', self.pdf)
+            self.pdf_path = get_media_storage().save(f'blog_pdfs/{self.pdf.name}', self.pdf)
+            self.pdf_info = {}
+            new_pdf = True
+
+        self.derive_content_fields()
+
+        # Append to the post log
+        self.repository.put(self._to_row())
+
+        # Resize the image for srcset off the request thread
+        if image_digest:
+            tasks.submit(generate_post_variants, self.id, self.image_path, image_digest)
+
+        # Extract text and render a preview of the PDF off the request thread
+        if new_pdf:
+            tasks.submit(generate_post_pdf_info, self.id, self.pdf_path)
+
+    def _to_row(self):
+        return {
+            'id': self.id,
+            'title': self.title,
+            'content': self.content,
+            'image': self.image_path,
+            'pdf': self.pdf_path,
+            'published_date': self.published_date,
+            'author': self.author,
+            'image_variants': json.dumps(self.image_variants) if self.image_variants else '',
+            'pdf_info': json.dumps(self.pdf_info) if self.pdf_info else '',
+            'excerpt': self.excerpt,
+            'content_html': self.content_html,
+            'word_count': self.word_count,
+            'reading_time': self.reading_time,
+            'content_format': self.content_format,
+        }
 
-        # Save to CSV
-        ensure_csv_exists(BLOGPOSTS_CSV, self.fields)
-        with open(BLOGPOSTS_CSV, 'a', newline='') as csvfile:
-            writer = csv.writer(csvfile)
-            writer.writerow([
-                self.id, self.title, self.content, self.image_path, self.pdf_path,
-                self.published_date, self.author
-            ])
+    @classmethod
+    def _from_row(cls, row):
+        return cls(
+            title=row['title'],
+            content=row['content'],
+            image=row['image'],
+            pdf=row['pdf'],
+            author=row['author'],
+            id=row['id'],
+            published_date=row['published_date'],
+            image_variants={
+                ext: {int(width): name for width, name in widths.items()}
+                for ext, widths in json.loads(row['image_variants'] or '{}').items()
+            },
+            pdf_info=json.loads(row['pdf_info'] or '{}'),
+            **({
+                'excerpt': row['excerpt'],
+                'content_html': row['content_html'],
+                'word_count': int(row['word_count'] or 0),
+                'reading_time': int(row['reading_time'] or 0),
+                'content_format': CONTENT_FORMAT,
+            } if _is_current(row) else {}),
+        )
 
     @classmethod
+    @timed('blogpost.all')
     def all(cls):
-        posts = []
-        ensure_csv_exists(BLOGPOSTS_CSV, cls.fields)
-        modified = False  
-        with open(BLOGPOSTS_CSV, 'r') as csvfile:
-            reader = csv.DictReader(csvfile)
-            for row in reader:
-                row_id = row.get('id') or str(uuid.uuid4())
-                if not row.get('id'):
-                    row['id'] = row_id 
-                    modified = True 
-
-                post = cls(
-                    title=row['title'],
-                    content=row['content'],
-                    image=row['image'],
-                    pdf=row['pdf'],
-                    author=row['author'],
-                    id=row_id,
-                    published_date=row['published_date']
-                )
-                posts.append(post)
-        
-        # Update CSV if any IDs were added
-        if modified:
-            with open(BLOGPOSTS_CSV, 'w', newline='') as csvfile:
-                writer = csv.DictWriter(csvfile, fieldnames=cls.fields)
-                writer.writeheader()
-                for post in posts:
-                    writer.writerow({
-                        'id': post.id,
-                        'title': post.title,
-                        'content': post.content,
-                        'image': post.image_path,
-                        'pdf': post.pdf_path,
-                        'published_date': post.published_date,
-                        'author': post.author,
-                    })
-
-        return posts
+        return [cls._from_row(row) for row in cls.repository.rows()]
+
+    @classmethod
+    def latest(cls):
+        """All posts, newest first, as a lazy sequence."""
+        return LatestPosts(cls)
+
+    @classmethod
+    @timed('blogpost.get')
+    def get(cls, id):
+        row = cls.repository.get(id)
+        return cls._from_row(row) if row else None
+
+    @classmethod
+    @timed('blogpost.search')
+    def search(cls, query):
+        """Posts matching ``query``, best match first, as a lazy sequence."""
+        return SearchResults(cls, cls.search_index.search(query))
 
     def delete(self):
-        posts = BlogPost.all()
-        posts = [post for post in posts if post.id != self.id]
-        ensure_csv_exists(BLOGPOSTS_CSV, self.fields)
-        with open(BLOGPOSTS_CSV, 'w', newline='') as csvfile:
-            writer = csv.writer(csvfile)
-            writer.writerow(self.fields)
-            for post in posts:
-                writer.writerow([
-                    post.id, post.title, post.content, post.image_path, post.pdf_path,
-                    post.published_date, post.author
-                ])
-
-    def update(self, **kwargs):
-        posts = BlogPost.all()
-        for post in posts:
-            if post.id == self.id:
-                for key, value in kwargs.items():
-                    setattr(post, key, value)
-        ensure_csv_exists(BLOGPOSTS_CSV, self.fields)
-        with open(BLOGPOSTS_CSV, 'w', newline='') as csvfile:
-            writer = csv.writer(csvfile)
-            writer.writerow(self.fields)
-            for post in posts:
-                writer.writerow([
-                    post.id, post.title, post.content, post.image_path, post.pdf_path,
-                    post.published_date, post.author
-                ])
+        self.repository.delete(self.id)
+
+    def update(self, expected=None, **kwargs):
+        """Store new values of some fields, leaving the others as stored.
+
+        ``expected`` maps row fields to the values they must still have for
+        the update to apply. Returns whether the post was updated.
+        """
+        for key, value in kwargs.items():
+            setattr(self, key, value)
+        changed = set(kwargs)
+        if 'content' in kwargs:
+            self.derive_content_fields()
+            changed.update(self.derived_fields)
+        row = self._to_row()
+        return self.repository.patch(
+            self.id, expected, **{field: row[field] for field in changed if field in row}
+        ) is not None
+
+    def media_files(self):
+        """Stored files this post refers to, for reference counting."""
+        names = [name for name in (self.image_path, self.pdf_path) if name]
+        for widths in self.image_variants.values():
+            names.extend(widths.values())
+        names.extend(self.pdf_info[key] for key in ('preview', 'text') if self.pdf_info.get(key))
+        return names
 
     def get_image_url(self):
         if self.image_path: 
-            return f"{settings.MEDIA_URL}/blog_images/{self.image_path}" 
+            return get_media_storage().url(self.image_path)
         return '/static/portfolio/images/unknown.png'
+
+    def get_thumbnail_url(self):
+        """Smallest JPEG variant, falling back to the original image."""
+        widths = self.image_variants.get('jpeg')
+        if widths:
+            return default_storage.url(widths[min(widths)])
+        return self.get_image_url()
+
+    def get_image_srcset(self, ext):
+        widths = self.image_variants.get(ext, {})
+        return ", ".join(f"{default_storage.url(name)} {width}w" for width, name in sorted(widths.items()))
+
+    def image_sources(self):
+        """``<source>`` type/srcset pairs for a ``<picture>``, best format first."""
+        return [
+            {'type': mime, 'srcset': self.get_image_srcset(ext)}
+            for ext, _, mime, _ in available_formats()
+            if self.image_variants.get(ext)
+        ]
     
     def get_pdf_url(self):
         if self.pdf_path:
-            encoded_path = urllib.parse.quote(self.pdf_path)
-            return f"{settings.MEDIA_URL}blog_pdfs/{encoded_path}"
+            return get_media_storage().url(self.pdf_path)
+        return None
+
+    def get_pdf_preview_url(self):
+        if self.pdf_info.get('preview'):
+            return default_storage.url(self.pdf_info['preview'])
         return None
 
     def content_preview(self):
-        return self.content[:100] + '...'
+        return self.excerpt
 
     def __str__(self):
         return self.title
 
+
+class LatestPosts:
+    """Newest-first posts that are only instantiated when sliced.
+
+    Supports ``count()`` and slicing against the repository's date index, so
+    ``Paginator(BlogPost.latest(), 5)`` builds just the five posts on the
+    requested page.
+    """
+    ordered = True
+
+    def __init__(self, model):
+        self.model = model
+
+    def count(self):
+        return len(self.model.repository)
+
+    def __len__(self):
+        return self.count()
+
+    @timed('blogpost.latest')
+    def __getitem__(self, key):
+        found = self.model.repository.newest_first_slice(key)
+        if isinstance(key, slice):
+            return [self.model._from_row(row) for row in found]
+        return self.model._from_row(found)
+
+    def __iter__(self):
+        for row in self.model.repository.newest_first():
+            yield self.model._from_row(row)
+
+
+def _is_current(row):
+    """Whether a stored row's derived content fields are up to date."""
+    return str(row['content_format']) == str(CONTENT_FORMAT)
+
+
+def upgrade_post_row(row):
+    """Derive the content fields of rows stored before them, or with an older sanitizer."""
+    if _is_current(row):
+        return row
+    return {**row, **derive_content_fields(row['content'])}
+
+
+BlogPost.repository = BlogPostRepository(
+    BLOGPOSTS_CSV, BlogPost.fields, log_path=BLOGPOSTS_LOG,
+    compact_threshold=getattr(settings, 'BLOG_LOG_COMPACT_THRESHOLD', 200),
+    upgrade=upgrade_post_row,
+)
+BlogPost.search_index = SearchIndex(BlogPost.repository)
+BlogPost.repository.subscribe(fragment_cache.on_repository_change)
+
 # Comment model
 class Comment:
-    fields = ["blog_post_title", "author", "text", "created_at"]
+    fields = ["blog_post_id", "blog_post_title", "author", "text", "created_at"]
 
-    def __init__(self, blog_post_title, author, text):
+    def __init__(self, blog_post_title, author, text, blog_post_id=None, created_at=None):
+        self.blog_post_id = blog_post_id
         self.blog_post_title = blog_post_title
         self.author = author
         self.text = text
-        self.created_at = get_nyc_time()
+        self.created_at = created_at or get_nyc_time()
 
     def save(self):
-        ensure_csv_exists(COMMENTS_CSV, self.fields)
-        with open(COMMENTS_CSV, 'a', newline='') as csvfile:
-            writer = csv.writer(csvfile)
-            writer.writerow([self.blog_post_title, self.author, self.text, self.created_at])
+        if not self.blog_post_id:
+            post = next((p for p in BlogPost.latest() if p.title == self.blog_post_title), None)
+            self.blog_post_id = post.id if post else None
+        self.store.append({field: getattr(self, field) for field in self.fields})
+        fragment_cache.comments_changed(self.blog_post_id)
+
+    @classmethod
+    def _from_row(cls, row):
+        return cls(row['blog_post_title'], row['author'], row['text'],
+                   blog_post_id=row['blog_post_id'], created_at=row['created_at'])
 
     @classmethod
     def all(cls, blog_post_title=None):
         """Retrieve all comments, or filter by blog post title if provided."""
-        comments = []
-        ensure_csv_exists(COMMENTS_CSV, cls.fields)
-        with open(COMMENTS_CSV, 'r') as csvfile:
-            reader = csv.DictReader(csvfile)
-            for row in reader:
-                if blog_post_title is None or row['blog_post_title'] == blog_post_title:
-                    comments.append(cls(row['blog_post_title'], row['author'], row['text']))
-        return comments
+        return [
+            cls._from_row(row) for row in cls.store.rows()
+            if blog_post_title is None or row['blog_post_title'] == blog_post_title
+        ]
+
+    @classmethod
+    def for_post(cls, blog_post_id, offset=0, limit=None):
+        """Comments on one post, oldest first; reads only that post's file."""
+        return [cls._from_row(row) for row in cls.store.for_post(blog_post_id, offset, limit)]
 
     def __str__(self):
         return f'Comment by {self.author} on {self.blog_post_title}'
 
+
+Comment.store = CommentStore(COMMENTS_DIR, Comment.fields, legacy_csv=COMMENTS_CSV)
+
 # VisitorProfile model
 import csv
 import os
@@ -191,6 +346,9 @@ from pytz import timezone
 
 NYC_TIMEZONE = timezone('America/New_York')
 VISITORPROFILE_CSV = os.path.join(settings.BASE_DIR, 'data', 'visitorprofiles.csv')
+VISITOR_EVENTS_DIR = os.path.join(settings.BASE_DIR, 'data', 'events')
+VISITORPROFILE_DB = os.path.join(settings.BASE_DIR, 'data', 'visitorprofiles.sqlite3')
+ANALYTICS_ROLLUPS_DB = os.path.join(settings.BASE_DIR, 'data', 'rollups.sqlite3')
 
 def get_nyc_time():
     return datetime.now(NYC_TIMEZONE).isoformat()
@@ -207,9 +365,14 @@ class VisitorProfile:
         "session_id", "ip_address", "utm_source", "user_agent", "device_type",
         "page_urls", "scroll_depth", "time_spent", "country", "region", "date_time_visited"
     ]
+    # Fields a beacon is allowed to change on an existing profile
+    update_fields = [
+        "page_urls", "scroll_depth", "time_spent", "utm_source", "country", "region", "date_time_visited"
+    ]
 
     def __init__(self, session_id, ip_address, utm_source, user_agent, device_type,
-                 page_urls, scroll_depth, time_spent, country="Unknown", region="Unknown"):
+                 page_urls, scroll_depth, time_spent, country="Unknown", region="Unknown",
+                 date_time_visited=None):
         self.session_id = session_id
         self.ip_address = ip_address
         self.utm_source = utm_source
@@ -220,73 +383,52 @@ class VisitorProfile:
         self.time_spent = time_spent
         self.country = country
         self.region = region
-        self.date_time_visited = get_nyc_time()
+        self.date_time_visited = date_time_visited or get_nyc_time()
+
+    def _to_row(self):
+        return {field: getattr(self, field) for field in self.fields}
+
+    @classmethod
+    def _from_row(cls, row):
+        return cls(**row)
 
     def save(self):
-        ensure_csv_exists(VISITORPROFILE_CSV, self.fields)
-        with open(VISITORPROFILE_CSV, 'a', newline='') as csvfile:
-            writer = csv.writer(csvfile)
-            writer.writerow([
-                self.session_id, self.ip_address, self.utm_source, self.user_agent, self.device_type,
-                json.dumps(self.page_urls), json.dumps(self.scroll_depth), json.dumps(self.time_spent),
-                self.country, self.region, self.date_time_visited
-            ])
+        self.store.upsert(self._to_row())
 
     @classmethod
+    @timed('visitorprofile.all')
     def all(cls):
-        profiles = []
-        ensure_csv_exists(VISITORPROFILE_CSV, cls.fields)
-        with open(VISITORPROFILE_CSV, 'r') as csvfile:
-            reader = csv.DictReader(csvfile)
-            for row in reader:
-                page_urls = json.loads(row["page_urls"])
-                scroll_depth = json.loads(row["scroll_depth"])
-                time_spent = json.loads(row["time_spent"])
-                profiles.append(cls(
-                    row["session_id"], row["ip_address"], row["utm_source"], row["user_agent"], row["device_type"],
-                    page_urls, scroll_depth, time_spent, row["country"], row["region"]
-                ))
-        return profiles
-    
+        return [cls._from_row(row) for row in cls.store.rows()]
+
+    @classmethod
+    def get(cls, session_id):
+        row = cls.store.get(session_id)
+        return cls._from_row(row) if row else None
+
+    @classmethod
+    @timed('visitorprofile.exists')
+    def exists(cls, session_id):
+        return cls.store.exists(session_id)
+
+    @classmethod
+    async def aexists(cls, session_id):
+        if cls.store.is_known(session_id):
+            return True
+        return await sync_to_async(cls.store.exists, thread_sensitive=False)(session_id)
+
+    @timed('visitorprofile.update')
     def update(self):
-        profiles = VisitorProfile.all()
-        
-        # Find and update the existing profile
-        for profile in profiles:
-            if profile.session_id == self.session_id:
-                profile.page_urls = self.page_urls
-                profile.scroll_depth = self.scroll_depth
-                profile.time_spent = self.time_spent
-                profile.utm_source = self.utm_source
-                profile.country = self.country
-                profile.region = self.region
-                profile.date_time_visited = self.date_time_visited
-
-        # Rewrite the CSV with the updated profiles
-        ensure_csv_exists(VISITORPROFILE_CSV, self.fields)
-        with open(VISITORPROFILE_CSV, 'w', newline='') as csvfile:
-            writer = csv.writer(csvfile)
-            writer.writerow(self.fields)
-            for profile in profiles:
-                writer.writerow([
-                    profile.session_id, profile.ip_address, profile.utm_source, profile.user_agent,
-                    profile.device_type, json.dumps(profile.page_urls), json.dumps(profile.scroll_depth),
-                    json.dumps(profile.time_spent), profile.country, profile.region, profile.date_time_visited
-                ])
+        self.store.update(self._to_row(), self.update_fields)
 
     def delete(self):
-        profiles = VisitorProfile.all()
-        profiles = [profile for profile in profiles if profile.session_id != self.session_id]
-        ensure_csv_exists(VISITORPROFILE_CSV, self.fields)
-        with open(VISITORPROFILE_CSV, 'w', newline='') as csvfile:
-            writer = csv.writer(csvfile)
-            writer.writerow(self.fields)
-            for profile in profiles:
-                writer.writerow([
-                    profile.session_id, profile.ip_address, profile.utm_source, profile.user_agent,
-                    profile.device_type, json.dumps(profile.page_urls), json.dumps(profile.scroll_depth),
-                    json.dumps(profile.time_spent), profile.country, profile.region, profile.date_time_visited
-                ])
+        self.store.delete(self.session_id)
 
     def __str__(self):
         return f'Session: {self.session_id}, Pages Visited: {self.page_urls}'
+
+
+VisitorProfile.store = VisitorProfileStore(VISITORPROFILE_DB, VisitorProfile.fields, legacy_csv=VISITORPROFILE_CSV)
+# Page views from beacons, one typed row per page
+VisitorProfile.events = EventStore(VISITOR_EVENTS_DIR)
+# Hourly and daily totals, kept up to date by the ingest writer
+VisitorProfile.rollups = RollupStore(ANALYTICS_ROLLUPS_DB)
@@ -0,0 +1,104 @@
+import hashlib
+import io
+import logging
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+
+from .storages import get_media_storage, touch
+
+logger = logging.getLogger(__name__)
+
+PREVIEW_WIDTH = 480
+EXCERPT_LENGTH = 300
+
+
+def _save(storage, name, data):
+    if storage.exists(name):
+        touch(storage, name)
+    else:
+        storage.save(name, ContentFile(data))
+    return name
+
+
+def extract_pdf(pdf_path, storage=None):
+    """Text, metadata and a first-page thumbnail for a stored PDF.
+
+    Returns a dict with ``pages``, ``title``, ``author``, ``excerpt``,
+    ``text`` (the name of the extracted text file) and ``preview`` (the name
+    of a WebP thumbnail), or None when pypdfium2 is not installed or the
+    file cannot be parsed. Outputs are named by the PDF's content hash.
+    """
+    try:
+        import pypdfium2 as pdfium
+    except ImportError:
+        logger.warning("pypdfium2 is not installed; skipping PDF preview for %s", pdf_path)
+        return None
+
+    storage = storage or default_storage
+    with get_media_storage().open(pdf_path, 'rb') as source:
+        data = source.read()
+    digest = hashlib.sha256(data).hexdigest()
+
+    try:
+        document = pdfium.PdfDocument(data)
+    except pdfium.PdfiumError as exc:
+        logger.warning("Could not open PDF %s: %s", pdf_path, exc)
+        return None
+    try:
+        metadata = document.get_metadata_dict(skip_empty=True)
+        max_pages = getattr(settings, 'PDF_TEXT_MAX_PAGES', 50)
+        chunks = []
+        for index in range(min(len(document), max_pages)):
+            textpage = document[index].get_textpage()
+            chunks.append(textpage.get_text_bounded())
+        text = "\n".join(chunks).replace('\r\n', '\n').strip()
+
+        info = {
+            'pages': len(document),
+            'title': metadata.get('Title', ''),
+            'author': metadata.get('Author', ''),
+            'excerpt': " ".join(text[:EXCERPT_LENGTH * 2].split())[:EXCERPT_LENGTH],
+            'text': _save(storage, f'blog_pdfs/text/{digest[:2]}/{digest}.txt', text.encode('utf-8')),
+            'preview': '',
+        }
+        if len(document):
+            first = document[0]
+            scale = PREVIEW_WIDTH / first.get_width()
+            image = first.render(scale=scale).to_pil()
+            buffer = io.BytesIO()
+            image.convert('RGB').save(buffer, 'WEBP', quality=80)
+            info['preview'] = _save(storage, f'blog_pdfs/previews/{digest[:2]}/{digest}.webp', buffer.getvalue())
+        return info
+    finally:
+        document.close()
+
+
+def read_pdf_text(info, storage=None):
+    """The extracted text recorded in a post's ``pdf_info``, or ''."""
+    if not info or not info.get('text'):
+        return ''
+    storage = storage or default_storage
+    try:
+        with storage.open(info['text'], 'rb') as textfile:
+            return textfile.read().decode('utf-8', errors='replace')
+    except OSError:
+        return ''
+
+
+def generate_post_pdf_info(post_id, pdf_path):
+    """Background task: extract a PDF and record the results on the post."""
+    from .models import BlogPost
+
+    try:
+        info = extract_pdf(pdf_path)
+    except OSError as exc:
+        logger.warning("Could not read PDF %s: %s", pdf_path, exc)
+        return
+    if info is None:
+        return
+    post = BlogPost.get(post_id)
+    # Skip if the post was deleted or its PDF replaced in the meantime
+    if post is not None:
+        post.update(expected={'pdf': pdf_path}, pdf_info=info)
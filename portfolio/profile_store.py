@@ -0,0 +1,195 @@
+import csv
+import json
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+
+
+class VisitorProfileStore:
+    """SQLite table of visitor profiles keyed by session_id.
+
+    Every operation touches a single indexed row, so the cost of a beacon does
+    not grow with the number of stored profiles. List-valued columns are
+    stored as JSON text. Rows from the legacy ``visitorprofiles.csv`` are
+    imported the first time the database is created.
+
+    Recently seen session ids are also kept in memory, up to
+    ``known_cache_size`` of them, so the per-request "does this session have a
+    profile?" check for an active visitor is a dict lookup. A miss is
+    confirmed against the primary key, which picks up profiles written by
+    other processes and costs one indexed read.
+    """
+
+    json_fields = ("page_urls", "scroll_depth", "time_spent")
+
+    def __init__(self, path, fields, legacy_csv=None, known_cache_size=100000):
+        self.path = path
+        self.fields = fields
+        self.legacy_csv = legacy_csv
+        self.known_cache_size = known_cache_size
+        self._local = threading.local()
+        self._init_lock = threading.Lock()
+        self._initialised = False
+        self._known = OrderedDict()  # session_id -> None, least recently seen first
+        self._known_lock = threading.Lock()
+
+    def connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            if not self._initialised:
+                with self._init_lock:
+                    if not self._initialised:
+                        self._create(conn)
+                        self._initialised = True
+        return conn
+
+    def _create(self, conn):
+        columns = ", ".join(
+            f"{field} TEXT PRIMARY KEY" if field == "session_id" else f"{field} TEXT"
+            for field in self.fields
+        )
+        with conn:
+            conn.execute(f"CREATE TABLE IF NOT EXISTS visitor_profiles ({columns})")
+            version = conn.execute("PRAGMA user_version").fetchone()[0]
+            if version == 0:
+                self._import_legacy(conn)
+                conn.execute("PRAGMA user_version = 1")
+
+    def _import_legacy(self, conn):
+        if not self.legacy_csv or not os.path.exists(self.legacy_csv):
+            return
+        with open(self.legacy_csv, 'r', newline='') as csvfile:
+            rows = [
+                tuple(row.get(field) or '' for field in self.fields)
+                for row in csv.DictReader(csvfile)
+                if row.get("session_id")
+            ]
+        conn.executemany(self._upsert_sql(self.fields), rows)
+
+    def _upsert_sql(self, fields):
+        updates = ", ".join(f"{field}=excluded.{field}" for field in fields if field != "session_id")
+        return (
+            f"INSERT INTO visitor_profiles ({', '.join(fields)}) "
+            f"VALUES ({', '.join('?' for _ in fields)}) "
+            f"ON CONFLICT(session_id) DO UPDATE SET {updates}"
+        )
+
+    def _encode(self, row, fields):
+        return tuple(
+            json.dumps(row[field]) if field in self.json_fields else row[field]
+            for field in fields
+        )
+
+    def _decode(self, values):
+        row = dict(zip(self.fields, values))
+        for field in self.json_fields:
+            row[field] = json.loads(row[field]) if row[field] else []
+        return row
+
+    def _select(self):
+        return f"SELECT {', '.join(self.fields)} FROM visitor_profiles"
+
+    def get(self, session_id):
+        values = self.connection().execute(
+            f"{self._select()} WHERE session_id = ?", (session_id,)
+        ).fetchone()
+        return self._decode(values) if values else None
+
+    def get_many(self, session_ids):
+        """Rows for the given sessions, keyed by session_id."""
+        session_ids = list(session_ids)
+        found = {}
+        conn = self.connection()
+        # Stay well below SQLite's bound-parameter limit
+        for start in range(0, len(session_ids), 500):
+            chunk = session_ids[start:start + 500]
+            query = f"{self._select()} WHERE session_id IN ({', '.join('?' for _ in chunk)})"
+            for values in conn.execute(query, chunk):
+                row = self._decode(values)
+                found[row["session_id"]] = row
+        return found
+
+    def remember(self, session_id):
+        """Record a session whose profile is about to be written."""
+        self._remember([session_id])
+
+    def _remember(self, session_ids):
+        with self._known_lock:
+            for session_id in session_ids:
+                self._known[session_id] = None
+                self._known.move_to_end(session_id)
+            while len(self._known) > self.known_cache_size:
+                self._known.popitem(last=False)
+
+    def is_known(self, session_id):
+        """Whether the session was seen recently, without touching the database."""
+        return session_id in self._known
+
+    def exists(self, session_id):
+        if session_id in self._known:
+            return True
+        found = self.connection().execute(
+            "SELECT 1 FROM visitor_profiles WHERE session_id = ?", (session_id,)
+        ).fetchone() is not None
+        if found:
+            self._remember([session_id])
+        return found
+
+    def rows(self):
+        return [self._decode(values) for values in self.connection().execute(self._select())]
+
+    def rows_after(self, rowid, limit):
+        """Up to ``limit`` ``(rowid, row)`` pairs after ``rowid``, in rowid order."""
+        return [
+            (values[0], self._decode(values[1:]))
+            for values in self.connection().execute(
+                f"SELECT rowid, {', '.join(self.fields)} FROM visitor_profiles "
+                "WHERE rowid > ? ORDER BY rowid LIMIT ?",
+                (rowid, limit),
+            )
+        ]
+
+    def last_rowid(self):
+        """Rowid of the newest profile, 0 when there are none."""
+        return self.connection().execute("SELECT MAX(rowid) FROM visitor_profiles").fetchone()[0] or 0
+
+    def count(self):
+        return self.connection().execute("SELECT COUNT(*) FROM visitor_profiles").fetchone()[0]
+
+    def session_ids(self):
+        for (session_id,) in self.connection().execute("SELECT session_id FROM visitor_profiles"):
+            yield session_id
+
+    def upsert(self, row):
+        self.upsert_many([row])
+
+    def upsert_many(self, rows, fields=None):
+        """Insert or replace rows in a single transaction."""
+        fields = fields or self.fields
+        conn = self.connection()
+        with conn:
+            conn.executemany(self._upsert_sql(fields), [self._encode(row, fields) for row in rows])
+        self._remember(row["session_id"] for row in rows)
+
+    def update(self, row, fields):
+        """Overwrite ``fields`` of an existing row; missing rows are left alone."""
+        assignments = ", ".join(f"{field} = ?" for field in fields)
+        conn = self.connection()
+        with conn:
+            conn.execute(
+                f"UPDATE visitor_profiles SET {assignments} WHERE session_id = ?",
+                self._encode(row, fields) + (row["session_id"],),
+            )
+
+    def delete(self, session_id):
+        conn = self.connection()
+        with conn:
+            conn.execute("DELETE FROM visitor_profiles WHERE session_id = ?", (session_id,))
+        with self._known_lock:
+            self._known.pop(session_id, None)
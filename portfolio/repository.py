@@ -0,0 +1,319 @@
+import bisect
+import csv
+import json
+import os
+import threading
+import uuid
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: fall back to in-process locking only
+    fcntl = None
+
+
+class BlogPostRepository:
+    """Process-wide, in-memory view of the blog posts.
+
+    Storage is log-structured: ``path`` is a CSV snapshot and ``log_path`` an
+    append-only JSON-lines log of ``put`` and ``delete`` records applied on top
+    of it. Writes append a single record, so they cost O(1) regardless of the
+    number of posts; once the log holds ``compact_threshold`` records it is
+    folded back into a fresh snapshot.
+
+    Crash recovery: a record is durable once its line, including the trailing
+    newline, has been fsynced. A torn final line is discarded by the next
+    writer, and replaying the log over a snapshot is idempotent, so a crash
+    during compaction leaves the data intact.
+
+    Rows are kept indexed by id and ordered by published_date. The files are
+    only re-read when their mtime or size changes, so lookups and list pages
+    do not touch the disk under load.
+
+    ``upgrade``, if given, is called with every row as the files are loaded
+    and returns the row to keep, or the same row when it is current. Rows it
+    changed are written back with a compaction, so each is upgraded once.
+
+    Callables registered with ``subscribe`` are told about every change:
+    ``('put', row)`` and ``('delete', row_id)`` for writes made through this
+    repository, and ``('reset', None)`` whenever the files are (re)loaded.
+    """
+
+    def __init__(self, path, fields, log_path=None, compact_threshold=200, upgrade=None):
+        self.path = path
+        self.fields = fields
+        self.upgrade = upgrade
+        self.log_path = log_path or os.path.splitext(path)[0] + '.log'
+        self.lock_path = self.path + '.lock'
+        self.compact_threshold = compact_threshold
+        self._lock = threading.RLock()
+        self._signature = None
+        self._log_records = 0
+        self._listeners = []
+        # (rows by id, ids in file order, ids oldest first), swapped as a unit
+        self._state = ({}, [], [])
+
+    def _ensure_file(self):
+        if not os.path.exists(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(self.path, mode='w', newline='') as csvfile:
+                csv.writer(csvfile).writerow(self.fields)
+
+    def _stat(self):
+        signature = []
+        for path in (self.path, self.log_path):
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                signature.append(None)
+            else:
+                signature.append((st.st_mtime_ns, st.st_size))
+        return tuple(signature)
+
+    def signature(self):
+        """``(mtime_ns, size)`` of the snapshot and the log.
+
+        Read from the files, so every process sharing them sees the same
+        value, and it changes with every write.
+        """
+        return self._stat()
+
+    @contextmanager
+    def _locked(self):
+        """Hold the thread lock and, where supported, an exclusive file lock."""
+        with self._lock:
+            self._ensure_file()
+            if fcntl is None:
+                yield
+                return
+            with open(self.lock_path, 'a') as lockfile:
+                fcntl.flock(lockfile, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lockfile, fcntl.LOCK_UN)
+
+    def refresh(self):
+        """Reload the snapshot and log if either changed since the last read."""
+        if self._signature is not None and self._stat() == self._signature:
+            return
+        with self._locked():
+            if self._stat() != self._signature:
+                self._load()
+
+    def subscribe(self, listener):
+        self._listeners.append(listener)
+
+    def _notify(self, event, payload):
+        for listener in self._listeners:
+            listener(event, payload)
+
+    def invalidate(self):
+        with self._lock:
+            self._signature = None
+
+    def _load(self):
+        rows = {}
+        order = []
+        modified = False
+        with open(self.path, 'r', newline='') as csvfile:
+            for row in csv.DictReader(csvfile):
+                row = self._clean(row)
+                if not row['id']:
+                    row['id'] = str(uuid.uuid4())
+                    modified = True
+                if row['id'] not in rows:
+                    order.append(row['id'])
+                rows[row['id']] = row
+
+        records = 0
+        for record in self._read_log():
+            records += 1
+            if record['op'] == 'put':
+                row = self._clean(record['row'])
+                if row['id'] not in rows:
+                    order.append(row['id'])
+                rows[row['id']] = row
+            elif record['op'] == 'delete' and record['id'] in rows:
+                del rows[record['id']]
+                order.remove(record['id'])
+
+        if self.upgrade is not None:
+            for row_id, row in rows.items():
+                upgraded = self.upgrade(row)
+                if upgraded is not row:
+                    rows[row_id] = self._clean(upgraded)
+                    modified = True
+
+        by_date = sorted(order, key=lambda row_id: rows[row_id]['published_date'])
+        self._state = (rows, order, by_date)
+        self._log_records = records
+
+        # Persist any ids that had to be generated and rows that were upgraded
+        if modified:
+            self._compact()
+        self._signature = self._stat()
+        self._notify('reset', None)
+
+    def _read_log(self):
+        try:
+            with open(self.log_path, 'r', encoding='utf-8') as logfile:
+                for line in logfile:
+                    # A line without its newline is a torn write and was never acknowledged
+                    if not line.endswith('\n'):
+                        break
+                    try:
+                        yield json.loads(line)
+                    except ValueError:
+                        continue
+        except FileNotFoundError:
+            return
+
+    def _clean(self, row):
+        return {field: row.get(field) or '' for field in self.fields}
+
+    def _append(self, record):
+        """Append one record to the log and fsync it. Caller holds the lock."""
+        with open(self.log_path, 'a+b') as logfile:
+            # Drop a torn tail left behind by a crashed writer
+            size = logfile.seek(0, os.SEEK_END)
+            if size:
+                logfile.seek(size - 1)
+                if logfile.read(1) != b'\n':
+                    logfile.seek(0)
+                    good = logfile.read().rfind(b'\n') + 1
+                    logfile.truncate(good)
+            logfile.write(json.dumps(record).encode('utf-8') + b'\n')
+            logfile.flush()
+            os.fsync(logfile.fileno())
+
+    def _write(self, record, apply):
+        with self._locked():
+            self._write_locked(record, apply)
+
+    def _write_locked(self, record, apply):
+        fresh = self._signature is not None and self._stat() == self._signature
+        self._append(record)
+        if fresh:
+            apply()
+            if record['op'] == 'put':
+                self._notify('put', record['row'])
+            else:
+                self._notify('delete', record['id'])
+            self._log_records += 1
+            if self._log_records >= self.compact_threshold:
+                self._compact()
+            self._signature = self._stat()
+        else:
+            # Someone else wrote since our last read; reload on next access
+            self._signature = None
+
+    def put(self, row):
+        """Insert or replace a row."""
+        self._write(*self._put_record(row))
+
+    def patch(self, row_id, expected=None, **fields):
+        """Set some fields of a row, reading and writing it under the lock.
+
+        Concurrent patches of different fields of one row all survive, where
+        ``get`` followed by ``put`` would let the last writer drop the
+        others' changes. If ``expected`` is given, the row is only changed
+        while each of its fields still has the expected value. Returns the
+        new row, or None if the row is gone or did not match.
+        """
+        with self._locked():
+            if self._stat() != self._signature:
+                self._load()
+            row = self._state[0].get(row_id)
+            if row is None:
+                return None
+            if expected and any(row[field] != value for field, value in expected.items()):
+                return None
+            record, apply = self._put_record({**row, **fields})
+            self._write_locked(record, apply)
+            return record['row']
+
+    def _put_record(self, row):
+        row = self._clean(row)
+
+        def apply():
+            rows, order, by_date = self._state
+            rows = dict(rows)
+            by_date = list(by_date)
+            if row['id'] in rows:
+                by_date.remove(row['id'])
+            else:
+                order = order + [row['id']]
+            rows[row['id']] = row
+            bisect.insort(by_date, row['id'], key=lambda row_id: rows[row_id]['published_date'])
+            self._state = (rows, order, by_date)
+
+        return {'op': 'put', 'row': row}, apply
+
+    def delete(self, row_id):
+        """Record a tombstone for a row."""
+        def apply():
+            rows, order, by_date = self._state
+            if row_id not in rows:
+                return
+            rows = dict(rows)
+            del rows[row_id]
+            order = [i for i in order if i != row_id]
+            by_date = [i for i in by_date if i != row_id]
+            self._state = (rows, order, by_date)
+
+        self._write({'op': 'delete', 'id': row_id}, apply)
+
+    def compact(self):
+        """Fold the log into a new snapshot."""
+        with self._locked():
+            if self._stat() != self._signature:
+                self._load()
+            self._compact()
+            self._signature = self._stat()
+
+    def _compact(self):
+        rows, order, _ = self._state
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', newline='') as csvfile:
+            writer = csv.DictWriter(csvfile, fieldnames=self.fields)
+            writer.writeheader()
+            for row_id in order:
+                writer.writerow(rows[row_id])
+            csvfile.flush()
+            os.fsync(csvfile.fileno())
+        os.replace(tmp_path, self.path)
+        # Replaying the old log over the new snapshot is harmless, so a crash
+        # before this truncate loses nothing
+        with open(self.log_path, 'w'):
+            pass
+        self._log_records = 0
+
+    def rows(self):
+        """All rows in file order."""
+        self.refresh()
+        rows, order, _ = self._state
+        return [rows[row_id] for row_id in order]
+
+    def newest_first(self):
+        """All rows ordered by published_date, newest first."""
+        self.refresh()
+        rows, _, by_date = self._state
+        return [rows[row_id] for row_id in reversed(by_date)]
+
+    def newest_first_slice(self, key):
+        """Rows at the given index or slice of the newest-first ordering."""
+        self.refresh()
+        rows, _, by_date = self._state
+        last = len(by_date) - 1
+        if isinstance(key, slice):
+            return [rows[by_date[last - i]] for i in range(len(by_date))[key]]
+        return rows[by_date[last - range(len(by_date))[key]]]
+
+    def get(self, row_id):
+        self.refresh()
+        return self._state[0].get(row_id)
+
+    def __len__(self):
+        self.refresh()
+        return len(self._state[1])
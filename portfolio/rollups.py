@@ -0,0 +1,314 @@
+import contextlib
+import os
+import sqlite3
+import threading
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+
+try:
+    import fcntl
+except ImportError:  # Windows: fall back to in-process locking only
+    fcntl = None
+
+PERIODS = ('hour', 'day')
+# Dimensions page views are broken down by; 'all' has the single value ''
+VIEW_DIMENSIONS = ('all', 'page', 'country', 'device', 'utm_source', 'scroll')
+# Dimensions new sessions (visits) are broken down by
+VISIT_DIMENSIONS = ('all', 'country', 'device', 'utm_source')
+METRICS = ('views', 'visits', 'seconds', 'scroll')
+
+
+def buckets(moment):
+    """``{period: bucket}`` for a UTC datetime."""
+    return {'hour': moment.strftime('%Y-%m-%dT%H'), 'day': moment.strftime('%Y-%m-%d')}
+
+
+def scroll_bucket(scroll):
+    """Scroll depth decile: '0', '10', ... '100'."""
+    return str(min(scroll // 10 * 10, 100))
+
+
+def parse_visit_time(value):
+    """UTC datetime of a profile's ``date_time_visited``, or None."""
+    try:
+        moment = datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        return None
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return moment.astimezone(timezone.utc)
+
+
+class RollupAccumulator:
+    """Sums page views and visits into rollup rows in memory."""
+
+    def __init__(self):
+        # (period, bucket, dimension, value) -> [views, visits, seconds, scroll]
+        self.rows = defaultdict(lambda: [0, 0, 0, 0])
+
+    def add_views(self, moment, dimensions, views, seconds, scroll_total):
+        """Add ``views`` page views that share a time and dimension values.
+
+        ``dimensions`` maps each of ``VIEW_DIMENSIONS`` to its value.
+        """
+        for period, bucket in buckets(moment).items():
+            for dimension in VIEW_DIMENSIONS:
+                totals = self.rows[(period, bucket, dimension, dimensions[dimension])]
+                totals[0] += views
+                totals[2] += seconds
+                totals[3] += scroll_total
+
+    def add_visit(self, moment, dimensions):
+        for period, bucket in buckets(moment).items():
+            for dimension in VISIT_DIMENSIONS:
+                self.rows[(period, bucket, dimension, dimensions[dimension])][1] += 1
+
+    def __len__(self):
+        return len(self.rows)
+
+
+def view_dimensions(profile, url, scroll):
+    return {
+        'all': '',
+        'page': url,
+        'country': profile.get('country') or 'Unknown',
+        'device': profile.get('device_type') or 'Unknown',
+        'utm_source': profile.get('utm_source') or '',
+        'scroll': scroll_bucket(scroll),
+    }
+
+
+def visit_dimensions(profile):
+    return {
+        'all': '',
+        'country': profile.get('country') or 'Unknown',
+        'device': profile.get('device_type') or 'Unknown',
+        'utm_source': profile.get('utm_source') or '',
+    }
+
+
+class RollupStore:
+    """Hourly and daily analytics totals in SQLite.
+
+    One row per (period, bucket, dimension, value) holds the number of page
+    views and new visits, plus summed seconds and scroll percent so averages
+    can be derived. The ingest writer adds each batch with a single upsert
+    transaction; ``backfill`` recomputes whole days from the event store.
+    Reports read a handful of rows per bucket however many events there are.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock_path = path + '.lock'
+        self._local = threading.local()
+        self._init_lock = threading.Lock()
+        self._write_lock = threading.RLock()
+        self._initialised = False
+
+    @contextlib.contextmanager
+    def locked(self):
+        """Hold this store's write lock, across processes where supported.
+
+        The ingest writer holds it while it adds a batch's profiles, events
+        and rollups, and ``backfill`` while it replaces days, so neither
+        sees the other half done.
+        """
+        with self._write_lock:
+            if fcntl is None:
+                yield
+                return
+            os.makedirs(os.path.dirname(self.lock_path), exist_ok=True)
+            with open(self.lock_path, 'a') as lockfile:
+                fcntl.flock(lockfile, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lockfile, fcntl.LOCK_UN)
+
+    def connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            if not self._initialised:
+                with self._init_lock:
+                    if not self._initialised:
+                        with conn:
+                            conn.execute(
+                                "CREATE TABLE IF NOT EXISTS rollups ("
+                                "period TEXT, bucket TEXT, dimension TEXT, value TEXT, "
+                                "views INTEGER, visits INTEGER, seconds INTEGER, scroll INTEGER, "
+                                "PRIMARY KEY (period, dimension, bucket, value))"
+                            )
+                            # Last profile rowid an unfinished backfill of ``days`` has
+                            # added, and the last one it will add
+                            conn.execute(
+                                "CREATE TABLE IF NOT EXISTS backfill_progress ("
+                                "days TEXT PRIMARY KEY, profile_rowid INTEGER, last_rowid INTEGER)"
+                            )
+                        self._initialised = True
+        return conn
+
+    def add(self, accumulator, progress=None):
+        """Add an accumulator's totals to the stored rollups.
+
+        ``progress``, a ``(days, profile_rowid, last_rowid)`` tuple, records
+        a backfill's position in the same transaction.
+        """
+        if not accumulator and progress is None:
+            return
+        conn = self.connection()
+        with conn:
+            if progress is not None:
+                conn.execute(
+                    "INSERT OR REPLACE INTO backfill_progress (days, profile_rowid, last_rowid) VALUES (?, ?, ?)",
+                    progress,
+                )
+            conn.executemany(
+                "INSERT INTO rollups (period, bucket, dimension, value, views, visits, seconds, scroll) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (period, dimension, bucket, value) DO UPDATE SET "
+                "views = views + excluded.views, visits = visits + excluded.visits, "
+                "seconds = seconds + excluded.seconds, scroll = scroll + excluded.scroll",
+                [key + tuple(totals) for key, totals in accumulator.rows.items()],
+            )
+
+    def replace_days(self, days, accumulator):
+        """Replace every rollup row of ``days`` with an accumulator's totals."""
+        conn = self.connection()
+        with conn:
+            for day in days:
+                conn.execute("DELETE FROM rollups WHERE period = 'day' AND bucket = ?", (day,))
+                conn.execute(
+                    "DELETE FROM rollups WHERE period = 'hour' AND bucket >= ? AND bucket <= ?",
+                    (f'{day}T00', f'{day}T23'),
+                )
+            conn.executemany(
+                "INSERT INTO rollups (period, bucket, dimension, value, views, visits, seconds, scroll) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [key + tuple(totals) for key, totals in accumulator.rows.items()],
+            )
+
+    def backfill_position(self, days):
+        """``(profile_rowid, last_rowid)`` of an unfinished backfill of ``days``, or None."""
+        return self.connection().execute(
+            "SELECT profile_rowid, last_rowid FROM backfill_progress WHERE days = ?", (days,)
+        ).fetchone()
+
+    def finish_backfill(self, days):
+        conn = self.connection()
+        with conn:
+            conn.execute("DELETE FROM backfill_progress WHERE days = ?", (days,))
+
+    def totals(self, period, dimension, start, end, limit=None):
+        """Summed metrics per value of ``dimension`` for buckets in [start, end].
+
+        Rows are dicts ordered by views, then visits, most first.
+        """
+        query = (
+            "SELECT value, SUM(views), SUM(visits), SUM(seconds), SUM(scroll) FROM rollups "
+            "WHERE period = ? AND dimension = ? AND bucket >= ? AND bucket <= ? "
+            "GROUP BY value ORDER BY SUM(views) DESC, SUM(visits) DESC, value"
+        )
+        params = [period, dimension, start, end]
+        if limit:
+            query += " LIMIT ?"
+            params.append(limit)
+        return [
+            dict(zip(('value',) + METRICS, row))
+            for row in self.connection().execute(query, params)
+        ]
+
+    def series(self, period, start, end):
+        """Overall metrics per bucket in [start, end], oldest first."""
+        return [
+            dict(zip(('bucket',) + METRICS, row))
+            for row in self.connection().execute(
+                "SELECT bucket, views, visits, seconds, scroll FROM rollups "
+                "WHERE period = ? AND dimension = 'all' AND bucket >= ? AND bucket <= ? ORDER BY bucket",
+                (period, start, end),
+            )
+        ]
+
+
+def backfill(rollup_store, event_store, profile_store, days, batch_size=10000, restart=False):
+    """Recompute the rollups of ``days`` from stored events and profiles.
+
+    Events are read column-wise and grouped with one pass over the integer
+    columns; dictionary values and profile dimensions are resolved once per
+    distinct session or url rather than per event. Each day's page views
+    replace its rollups in one transaction. New visits are then added from
+    the profile table ``batch_size`` rows at a time, in rowid order, each
+    batch committed with the position reached, so an interrupted backfill
+    of the same days resumes from there unless ``restart`` is set. Returns
+    the number of page views processed.
+
+    Safe to run alongside the ingest writer: the days are replaced under
+    ``rollup_store.locked()``, which the writer holds for each batch, and
+    visits are only added for profiles that existed then. Later profiles
+    were counted by the writer itself.
+    """
+    days = sorted(days)
+    if not days:
+        return 0
+    job = ','.join(days)
+    progress = None if restart else rollup_store.backfill_position(job)
+    total = 0
+
+    if progress is None:
+        with rollup_store.locked():
+            last_rowid = profile_store.last_rowid()
+            for day in days:
+                accumulator = RollupAccumulator()
+                total += _add_day_views(accumulator, event_store, profile_store, day)
+                rollup_store.replace_days([day], accumulator)
+            progress = (0, last_rowid)
+            rollup_store.add(RollupAccumulator(), progress=(job, *progress))
+    position, last_rowid = progress
+
+    wanted = set(days)
+    while position < last_rowid:
+        batch = [
+            (rowid, profile) for rowid, profile in profile_store.rows_after(position, batch_size)
+            if rowid <= last_rowid
+        ]
+        if not batch:
+            break
+        accumulator = RollupAccumulator()
+        for _, profile in batch:
+            moment = parse_visit_time(profile.get('date_time_visited'))
+            if moment is not None and moment.strftime('%Y-%m-%d') in wanted:
+                accumulator.add_visit(moment, visit_dimensions(profile))
+        position = batch[-1][0]
+        rollup_store.add(accumulator, progress=(job, position, last_rowid))
+
+    rollup_store.finish_backfill(job)
+    return total
+
+
+def _add_day_views(accumulator, event_store, profile_store, day):
+    """Add one day's stored page views; returns how many there were."""
+    columns = event_store.read(day)
+    if not columns['time']:
+        return 0
+    sessions = event_store.dictionary(day, 'session')
+    urls = event_store.dictionary(day, 'url')
+    profiles = profile_store.get_many(set(sessions))
+    midnight = datetime.strptime(day, '%Y-%m-%d').replace(tzinfo=timezone.utc)
+
+    groups = defaultdict(lambda: [0, 0, 0])
+    for time_of_day, session, url, scroll, seconds in zip(
+        columns['time'], columns['session'], columns['url'], columns['scroll'], columns['seconds']
+    ):
+        totals = groups[(time_of_day // 3600, session, url, scroll // 10)]
+        totals[0] += 1
+        totals[1] += seconds
+        totals[2] += scroll
+    for (hour, session, url, _), (views, seconds, scroll_total) in groups.items():
+        profile = profiles.get(sessions[session], {})
+        dimensions = view_dimensions(profile, urls[url], scroll_total // views)
+        accumulator.add_views(midnight + timedelta(hours=hour), dimensions, views, seconds, scroll_total)
+    return len(columns['time'])
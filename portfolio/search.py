@@ -0,0 +1,179 @@
+import bisect
+import html
+import math
+import re
+import json
+import threading
+from collections import defaultdict
+
+from .pdfs import read_pdf_text
+
+_TOKEN = re.compile(r'\w+', re.UNICODE)
+_TAG = re.compile(r'<[^>]*>')
+
+# Prefix expansions score lower than exact term matches
+PREFIX_PENALTY = 0.5
+MIN_PREFIX_LENGTH = 2
+
+
+def tokenize(text):
+    # Tags become spaces so that words in adjacent elements stay apart
+    return _TOKEN.findall(html.unescape(_TAG.sub(' ', text or '')).lower())
+
+
+class SearchIndex:
+    """Inverted index over blog post titles, content and authors.
+
+    The index follows the post repository: writes made through it are applied
+    incrementally, and a reload of the underlying files marks the index for a
+    rebuild on the next query. CKEditor HTML is stripped before indexing, and
+    text extracted from an attached PDF is indexed at a lower weight.
+    Results are ranked by a field-weighted TF-IDF score, and every query term
+    also matches indexed terms it is a prefix of.
+    """
+
+    field_weights = {'title': 3.0, 'author': 2.0, 'content': 1.0}
+    pdf_weight = 0.5
+
+    def __init__(self, repository):
+        self.repository = repository
+        self._lock = threading.RLock()
+        self._postings = defaultdict(dict)  # term -> {post_id: weighted tf}
+        self._doc_terms = {}  # post_id -> terms, for removal
+        self._doc_dates = {}  # post_id -> published_date, to break ties
+        self._vocabulary = []
+        self._vocabulary_dirty = False
+        self._built = False
+        self._changes = 0  # events seen, so a rebuild can tell it raced a write
+        repository.subscribe(self._on_change)
+
+    def _on_change(self, event, payload):
+        # Called with the repository lock held, so it takes the index lock
+        # second; _ensure_built never holds the index lock while calling
+        # into the repository
+        with self._lock:
+            self._changes += 1
+            if event == 'reset':
+                self._built = False
+            elif not self._built:
+                return
+            elif event == 'put':
+                self._remove(payload['id'])
+                self._add(payload)
+            elif event == 'delete':
+                self._remove(payload)
+
+    def _document(self, row):
+        """Weighted term frequencies for one post."""
+        weights = defaultdict(float)
+        for field, weight in self.field_weights.items():
+            for term in tokenize(row.get(field)):
+                weights[term] += weight
+        if row.get('pdf_info'):
+            for term in tokenize(read_pdf_text(json.loads(row['pdf_info']))):
+                weights[term] += self.pdf_weight
+        return weights
+
+    def _add(self, row):
+        weights = self._document(row)
+        for term, weight in weights.items():
+            postings = self._postings[term]
+            if not postings:
+                self._vocabulary_dirty = True
+            postings[row['id']] = weight
+        self._doc_terms[row['id']] = list(weights)
+        self._doc_dates[row['id']] = row.get('published_date') or ''
+
+    def _remove(self, post_id):
+        for term in self._doc_terms.pop(post_id, ()):
+            postings = self._postings.get(term)
+            if postings is None:
+                continue
+            postings.pop(post_id, None)
+            if not postings:
+                del self._postings[term]
+                self._vocabulary_dirty = True
+        self._doc_dates.pop(post_id, None)
+
+    def _ensure_built(self):
+        self.repository.refresh()
+        while not self._built:
+            changes = self._changes
+            rows = self.repository.rows()
+            with self._lock:
+                if self._built:
+                    return
+                if self._changes != changes:
+                    # A write landed while reading the rows; take them again
+                    continue
+                self._postings = defaultdict(dict)
+                self._doc_terms = {}
+                self._doc_dates = {}
+                for row in rows:
+                    self._add(row)
+                self._vocabulary_dirty = True
+                self._built = True
+
+    def _expand(self, term):
+        """Indexed terms matching a query term, with their match weight."""
+        if self._vocabulary_dirty:
+            self._vocabulary = sorted(self._postings)
+            self._vocabulary_dirty = False
+        matches = {}
+        if term in self._postings:
+            matches[term] = 1.0
+        if len(term) >= MIN_PREFIX_LENGTH:
+            start = bisect.bisect_left(self._vocabulary, term)
+            for candidate in self._vocabulary[start:]:
+                if not candidate.startswith(term):
+                    break
+                matches.setdefault(candidate, PREFIX_PENALTY)
+        return matches
+
+    def search(self, query):
+        """Ids of posts matching every term of ``query``, best first."""
+        terms = tokenize(query)
+        if not terms:
+            return []
+        self._ensure_built()
+        with self._lock:
+            total = max(len(self._doc_terms), 1)
+            scores = None
+            for term in dict.fromkeys(terms):
+                term_scores = defaultdict(float)
+                for match, factor in self._expand(term).items():
+                    postings = self._postings[match]
+                    idf = math.log(1 + total / len(postings))
+                    for post_id, weight in postings.items():
+                        term_scores[post_id] += factor * idf * (1 + math.log(max(weight, 1.0)))
+                if scores is None:
+                    scores = term_scores
+                else:
+                    scores = {
+                        post_id: score + term_scores[post_id]
+                        for post_id, score in scores.items() if post_id in term_scores
+                    }
+                if not scores:
+                    return []
+            dates = self._doc_dates
+            return sorted(scores, key=lambda post_id: (scores[post_id], dates.get(post_id, '')), reverse=True)
+
+
+class SearchResults:
+    """Lazy, sliceable sequence of posts for a list of ids, for Paginator."""
+    ordered = True
+
+    def __init__(self, model, ids):
+        self.model = model
+        self.ids = ids
+
+    def count(self):
+        return len(self.ids)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return [post for post in map(self.model.get, self.ids[key]) if post is not None]
+        return self.model.get(self.ids[key])
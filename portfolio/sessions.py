@@ -0,0 +1,237 @@
+"""Session engine: cached sessions with batched, write-behind database writes.
+
+Use with ``SESSION_ENGINE = "portfolio.sessions"``. Sessions are read from
+and written to the cache named by ``SESSION_CACHE_ALIAS`` like Django's
+``cached_db`` engine, so that cache must be shared by all worker processes
+and should hold nothing else, so other entries cannot get sessions culled.
+The database copy is updated by a background writer, which coalesces
+repeated saves of a session and commits them in one transaction; a key
+cycled at login is written through at once. Expired sessions are deleted on
+the same thread.
+"""
+import atexit
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.sessions.backends import cached_db
+from django.contrib.sessions.backends.base import CreateError
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'FLUSH_INTERVAL': 2.0,
+    # Flush early once this many sessions are waiting
+    'MAX_PENDING': 500,
+    # Seconds between expired-session sweeps; 0 leaves it to clearsessions
+    'SWEEP_INTERVAL': 60 * 60,
+    'SWEEP_BATCH_SIZE': 1000,
+}
+
+_DELETE = object()
+
+
+class SessionWriteBehind:
+    """Pending session writes, flushed to the database in batches."""
+
+    def __init__(self, flush_interval, max_pending, sweep_interval, sweep_batch_size):
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.sweep_interval = sweep_interval
+        self.sweep_batch_size = sweep_batch_size
+        self._pending = {}  # session_key -> (session_data, expire_date) or _DELETE
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopping = False
+        self._thread = None
+        self._atexit_registered = False
+        self._next_sweep = time.monotonic() + sweep_interval
+        self.stats = {'saves': 0, 'batches': 0, 'written': 0, 'deleted': 0, 'expired': 0}
+
+    @classmethod
+    def from_settings(cls):
+        config = {**DEFAULTS, **getattr(settings, 'SESSION_WRITE_BEHIND', {})}
+        return cls(
+            flush_interval=config['FLUSH_INTERVAL'],
+            max_pending=config['MAX_PENDING'],
+            sweep_interval=config['SWEEP_INTERVAL'],
+            sweep_batch_size=config['SWEEP_BATCH_SIZE'],
+        )
+
+    def _ensure_started(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stopping = False
+                self._thread = threading.Thread(target=self._run, name="session-write-behind", daemon=True)
+                self._thread.start()
+                if not self._atexit_registered:
+                    atexit.register(self.stop)
+                    self._atexit_registered = True
+
+    def save(self, session_key, session_data, expire_date):
+        self._enqueue(session_key, (session_data, expire_date))
+
+    def delete(self, session_key):
+        self._enqueue(session_key, _DELETE)
+
+    def _enqueue(self, session_key, entry):
+        self._ensure_started()
+        with self._lock:
+            self._pending[session_key] = entry
+            self.stats['saves'] += 1
+            full = len(self._pending) >= self.max_pending
+        if full:
+            self._wakeup.set()
+
+    def pending(self, session_key):
+        """Unflushed ``(session_data, expire_date)`` for a session, _DELETE, or None."""
+        with self._lock:
+            return self._pending.get(session_key)
+
+    def flush(self):
+        """Write everything pending now; returns the number of sessions written."""
+        from django.contrib.sessions.models import Session
+
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, {}
+            if not batch:
+                return 0
+            deletes = [key for key, entry in batch.items() if entry is _DELETE]
+            saves = [
+                Session(session_key=key, session_data=entry[0], expire_date=entry[1])
+                for key, entry in batch.items() if entry is not _DELETE
+            ]
+            try:
+                with transaction.atomic(using=Session.objects.db):
+                    if deletes:
+                        Session.objects.filter(session_key__in=deletes).delete()
+                    if saves:
+                        Session.objects.bulk_create(
+                            saves, update_conflicts=True, unique_fields=['session_key'],
+                            update_fields=['session_data', 'expire_date'],
+                        )
+            except Exception:
+                # Put the batch back unless a newer write superseded it
+                with self._lock:
+                    self._pending = {**batch, **self._pending}
+                raise
+            self.stats['batches'] += 1
+            self.stats['written'] += len(saves)
+            self.stats['deleted'] += len(deletes)
+            return len(batch)
+
+    def sweep(self):
+        """Delete expired sessions in small batches; returns how many went."""
+        from django.contrib.sessions.models import Session
+
+        removed = 0
+        cutoff = timezone.now()
+        while True:
+            # Short transactions keep the SQLite write lock free for requests
+            keys = list(
+                Session.objects.filter(expire_date__lt=cutoff)
+                .values_list('session_key', flat=True)[:self.sweep_batch_size]
+            )
+            if not keys:
+                break
+            Session.objects.filter(session_key__in=keys).delete()
+            removed += len(keys)
+        self.stats['expired'] += removed
+        return removed
+
+    def stop(self, timeout=10):
+        """Flush pending writes and stop the writer."""
+        thread = self._thread
+        if thread is None or not thread.is_alive():
+            self.flush()
+            return
+        self._stopping = True
+        self._wakeup.set()
+        thread.join(timeout)
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            close_old_connections()
+            try:
+                self.flush()
+                if self.sweep_interval and time.monotonic() >= self._next_sweep:
+                    self._next_sweep = time.monotonic() + self.sweep_interval
+                    self.sweep()
+            except Exception:
+                logger.exception("Session write-behind flush failed")
+            if self._stopping:
+                return
+
+
+write_behind = SessionWriteBehind.from_settings()
+
+
+class SessionStore(cached_db.SessionStore):
+    """``cached_db`` sessions whose database writes happen off the request."""
+
+    def load(self):
+        try:
+            data = self._cache.get(self.cache_key)
+        except Exception:
+            data = None
+        if data is None:
+            # The cache may have evicted a session that is not flushed yet
+            pending = write_behind.pending(self.session_key)
+            if pending is _DELETE:
+                self._session_key = None
+                return {}
+            if pending is not None:
+                session_data, expire_date = pending
+                data = self.decode(session_data)
+                self._cache.set(self.cache_key, data, self.get_expiry_age(expiry=expire_date))
+                return data
+            return super().load()
+        return data
+
+    def exists(self, session_key):
+        pending = write_behind.pending(session_key)
+        if pending is not None:
+            return pending is not _DELETE
+        return super().exists(session_key)
+
+    def save(self, must_create=False):
+        if self.session_key is None:
+            return self.create()
+        data = self._get_session(no_load=must_create)
+        timeout = self.get_expiry_age()
+        if must_create:
+            # create() has already checked the key is unused; cache.add() is
+            # atomic, so it catches a concurrent create of the same key
+            if not self._cache.add(self.cache_key, data, timeout):
+                raise CreateError
+        else:
+            self._cache.set(self.cache_key, data, timeout)
+        write_behind.save(self.session_key, self.encode(data), self.get_expiry_date())
+
+    def cycle_key(self):
+        # Login cycles the key; don't leave the authenticated session waiting
+        # on the writer, where a cache miss in another process would lose it
+        super().cycle_key()
+        write_behind.flush()
+
+    def delete(self, session_key=None):
+        if session_key is None:
+            if self.session_key is None:
+                return
+            session_key = self.session_key
+        self._cache.delete(self.cache_key_prefix + session_key)
+        write_behind.delete(session_key)
+
+    @classmethod
+    def clear_expired(cls):
+        write_behind.flush()
+        write_behind.sweep()
@@ -0,0 +1,116 @@
+import hashlib
+import os
+import posixpath
+import time
+import uuid
+from collections import Counter
+
+from django.core.files.storage import FileSystemStorage, storages
+
+# Directories under the media root that hold post files
+MEDIA_PREFIXES = ('blog_images', 'blog_pdfs')
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """File storage that names files by the SHA-256 of their content.
+
+    ``save('blog_pdfs/report.pdf', f)`` stores ``f`` as
+    ``blog_pdfs/ab/<sha256>.pdf``. Saving identical content again returns the
+    existing name without writing anything, so re-uploads are deduplicated
+    and every name refers to immutable content. The existing file is touched,
+    so ``sweep_orphans`` gives a reused file the same grace period as a new
+    one. New content is written to a hidden temporary name and renamed into
+    place, so concurrent saves of the same content cannot collide.
+    """
+
+    def get_available_name(self, name, max_length=None):
+        # _save() picks the final name from the content hash
+        return name
+
+    def _save(self, name, content):
+        digest = hashlib.sha256()
+        if hasattr(content, 'seek'):
+            content.seek(0)
+        for chunk in content.chunks():
+            digest.update(chunk)
+        if hasattr(content, 'seek'):
+            content.seek(0)
+        digest = digest.hexdigest()
+
+        directory, filename = posixpath.split(name)
+        ext = os.path.splitext(filename)[1].lower()
+        name = posixpath.join(directory, digest[:2], f'{digest}{ext}')
+        if self.exists(name):
+            touch(self, name)
+            return name
+        # The final name is fixed by the content, so Django's retry on an
+        # existing file would loop forever when an identical save wins the
+        # race. Either writer's file is correct, so the last rename wins.
+        temporary = super()._save(posixpath.join(posixpath.dirname(name), f'.{uuid.uuid4().hex}.tmp'), content)
+        try:
+            os.replace(self.path(temporary), self.path(name))
+        except BaseException:
+            self.delete(temporary)
+            raise
+        return name
+
+
+def touch(storage, name):
+    """Set a stored file's mtime to now, for ``sweep_orphans``' grace period.
+
+    For files that are reused rather than written: an orphan that is picked
+    up again by a new post would otherwise look old enough to delete before
+    the post referring to it is saved.
+    """
+    try:
+        os.utime(storage.path(name))
+    except (NotImplementedError, FileNotFoundError):
+        pass
+
+
+def get_media_storage():
+    """The storage blog post uploads are written to (``STORAGES['blog_media']``)."""
+    return storages['blog_media']
+
+
+def reference_counts(posts):
+    """How many posts refer to each stored media file."""
+    counts = Counter()
+    for post in posts:
+        for name in post.media_files():
+            counts[name] += 1
+    return counts
+
+
+def sweep_orphans(storage, referenced, grace_seconds=3600, dry_run=False):
+    """Delete media files no post refers to; returns the names removed.
+
+    Files modified within ``grace_seconds`` are kept, because an upload is
+    written to storage just before its post is saved. Temporary files from
+    interrupted saves are removed after the same grace period.
+    """
+    cutoff = time.time() - grace_seconds
+    removed = []
+
+    def walk(directory):
+        try:
+            subdirs, files = storage.listdir(directory)
+        except FileNotFoundError:
+            return
+        for subdir in subdirs:
+            yield from walk(posixpath.join(directory, subdir))
+        for filename in files:
+            yield posixpath.join(directory, filename)
+
+    for prefix in MEDIA_PREFIXES:
+        for name in walk(prefix):
+            filename = posixpath.basename(name)
+            # Hidden files are skipped, except temporaries left by a failed save
+            if name in referenced or (filename.startswith('.') and not filename.endswith('.tmp')):
+                continue
+            if storage.get_modified_time(name).timestamp() > cutoff:
+                continue
+            if not dry_run:
+                storage.delete(name)
+            removed.append(name)
+    return removed
@@ -0,0 +1,43 @@
+import atexit
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=getattr(settings, 'BACKGROUND_TASK_WORKERS', 2),
+                    thread_name_prefix='portfolio-task',
+                )
+                atexit.register(_executor.shutdown, wait=True)
+    return _executor
+
+
+def _run(func, args, kwargs):
+    try:
+        return func(*args, **kwargs)
+    except Exception:
+        logger.exception("Background task %s failed", getattr(func, '__name__', func))
+
+
+def submit(func, *args, **kwargs):
+    """Run ``func`` on the shared background pool, off the request thread.
+
+    With ``BACKGROUND_TASKS_EAGER`` set, the task runs immediately on the
+    calling thread instead, which keeps scripts and benchmarks deterministic.
+    """
+    if getattr(settings, 'BACKGROUND_TASKS_EAGER', False):
+        _run(func, args, kwargs)
+        return None
+    return _get_executor().submit(_run, func, args, kwargs)
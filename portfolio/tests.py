@@ -1,3 +1,1049 @@
-from django.test import TestCase
+import asyncio
+import contextlib
+import csv
+import json
+import os
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.core.cache import caches
+from django.core.files.base import ContentFile
+from django.core.paginator import Paginator
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+
+from . import geo, metrics
+from .benchmarks import isolated_stores
+from .comment_store import CommentStore
+from .content import derive_content_fields
+from .events import EventStore, _column_path, parse_scroll, parse_seconds
+from .fragment_cache import fragment_cache
+from .geo import UNKNOWN, GeoCache, get_country_and_region, lookup_remote
+from .ingest import AnalyticsIngestQueue
+from .models import BlogPost, Comment, VisitorProfile
+from .profile_store import VisitorProfileStore
+from .repository import BlogPostRepository
+from .rollups import RollupAccumulator, backfill
+from .storages import ContentAddressedStorage, sweep_orphans
+from .traffic import TrafficClassifier
+from .views import track_analytics_async
+
+
+class StoreTestCase(TestCase):
+    """Runs each test against fresh stores in a temporary directory."""
+
+    def setUp(self):
+        stack = contextlib.ExitStack()
+        self.addCleanup(stack.close)
+        self.directory = stack.enter_context(tempfile.TemporaryDirectory())
+        stack.enter_context(isolated_stores(self.directory))
+
+
+class BlogDetailETagTests(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        BlogPost(title='First post', content='<p>Hello</p>', author='Lokesh').save()
+        self.post = BlogPost.latest()[0]
+        self.url = f'/blog/details/{self.post.id}/'
+        # The ETag covers the CSRF cookie, which the first response sets
+        self.client.get(self.url)
+
+    def test_posting_a_comment_changes_the_etag(self):
+        etag = self.client.get(self.url)['ETag']
+        self.assertEqual(self.client.get(self.url, headers={'If-None-Match': etag}).status_code, 304)
+
+        response = self.client.post(self.url, {
+            'author': 'Reader', 'text': 'Nice post',
+            'blog_post_id': self.post.id, 'blog_post_title': self.post.title,
+        })
+        self.assertEqual(response.status_code, 302)
+
+        response = self.client.get(self.url, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertContains(response, 'Nice post')
+
+    def test_comment_from_another_process_changes_the_etag(self):
+        etag = self.client.get(self.url)['ETag']
+        # Written straight to the store, as another worker would: this
+        # process's cached versions are not bumped
+        Comment.store.append({
+            'blog_post_id': self.post.id, 'blog_post_title': self.post.title,
+            'author': 'Reader', 'text': 'From elsewhere', 'created_at': '',
+        })
+
+        response = self.client.get(self.url, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'From elsewhere')
+
+    def test_etag_does_not_depend_on_the_local_cache(self):
+        etag = self.client.get(self.url)['ETag']
+        # Another worker, or this one after its cache evicted the versions
+        caches['default'].clear()
+        self.assertEqual(self.client.get(self.url, headers={'If-None-Match': etag}).status_code, 304)
+
+        self.post.update(title='Renamed')
+        self.assertEqual(self.client.get(self.url, headers={'If-None-Match': etag}).status_code, 200)
+
+
+class BlogListETagTests(StoreTestCase):
+    def test_etag_follows_the_post_files(self):
+        BlogPost(title='First post', content='<p>Hello</p>', author='Lokesh').save()
+        etag = self.client.get('/blog')['ETag']
+        caches['default'].clear()
+        self.assertEqual(self.client.get('/blog', headers={'If-None-Match': etag}).status_code, 304)
+        self.assertNotEqual(self.client.get('/blog?page=2')['ETag'], etag)
+
+        BlogPost(title='Second post', content='<p>Hello</p>', author='Lokesh').save()
+        response = self.client.get('/blog', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Second post')
+
+
+class EventStoreTests(SimpleTestCase):
+    def setUp(self):
+        self.store = EventStore(self.enterContext(tempfile.TemporaryDirectory()))
+
+    def at(self, day, seconds):
+        return datetime.fromisoformat(day).replace(tzinfo=timezone.utc).timestamp() + seconds
+
+    def test_append_and_scan(self):
+        written = self.store.append([
+            (self.at('2024-01-01', 10), 'session-a', '/blog', 50, 30),
+            (self.at('2024-01-01', 3600), 'session-b', '/blog', 100, 5),
+            (self.at('2024-01-02', 0), 'session-a', '/about', 0, 1),
+        ])
+        self.assertEqual(written, 3)
+        self.assertEqual(self.store.days(), ['2024-01-01', '2024-01-02'])
+
+        first = self.store.read('2024-01-01')
+        self.assertEqual(list(first['time']), [10, 3600])
+        self.assertEqual(list(first['scroll']), [50, 100])
+        sessions = self.store.dictionary('2024-01-01', 'session')
+        self.assertEqual([sessions[code] for code in first['session']], ['session-a', 'session-b'])
+
+        scanned = dict(self.store.scan(['url'], start='2024-01-02'))
+        self.assertEqual(list(scanned), ['2024-01-02'])
+        self.assertEqual(list(scanned['2024-01-02']), ['url'])
+        self.assertEqual(self.store.dictionary('2024-01-02', 'url'), ['/about'])
+
+    def test_dictionary_codes_persist_across_instances(self):
+        self.store.append([(self.at('2024-01-01', 0), 'session-a', '/blog', 0, 0)])
+        store = EventStore(self.store.directory)
+        store.append([(self.at('2024-01-01', 1), 'session-a', '/blog', 0, 0)])
+        columns = store.read('2024-01-01')
+        self.assertEqual(list(columns['session']), [0, 0])
+        self.assertEqual(store.dictionary('2024-01-01', 'session'), ['session-a'])
+
+    def test_torn_columns_are_ignored_and_repaired(self):
+        self.store.append([(self.at('2024-01-01', 0), 'session-a', '/blog', 10, 1)])
+        # A crash after writing some of the columns of a second event
+        directory = self.store.day_directory('2024-01-01')
+        with open(_column_path(directory, 'time'), 'ab') as columnfile:
+            columnfile.write(b'\x01\x00\x00\x00')
+        self.assertEqual(len(self.store.read('2024-01-01')['time']), 1)
+
+        self.store.append([(self.at('2024-01-01', 5), 'session-b', '/about', 20, 2)])
+        columns = self.store.read('2024-01-01')
+        self.assertEqual(list(columns['time']), [0, 5])
+        self.assertEqual(list(columns['scroll']), [10, 20])
+
+    def test_out_of_range_numbers_parse_as_zero(self):
+        for value in ('inf%', '-inf', '1e999', float('inf'), 'nan'):
+            with self.subTest(value=value):
+                self.assertEqual(parse_scroll(value), 0)
+                self.assertEqual(parse_seconds(value), 0)
+        self.assertEqual(parse_scroll('250%'), 100)
+        self.assertEqual(parse_seconds('12.7'), 12)
+
+
+class BeaconIngestTests(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.queue = AnalyticsIngestQueue(
+            flush_interval=0.05, max_batch_size=100, max_queue_size=100, backpressure='block', block_timeout=0.5,
+        )
+        self.addCleanup(self.queue.stop)
+        for session_id in ('good', 'bad'):
+            VisitorProfile(session_id, '127.0.0.1', None, 'test', 'Desktop', [], [], [],
+                           country='India', region='Delhi').save()
+
+    def test_malformed_fields_are_coerced(self):
+        self.queue.submit_beacon('good', '127.0.0.1', '/blog', {'a': 1}, 'inf', utm_source=['x'], country=7)
+        self.queue.stop()
+        profile = VisitorProfile.get('good')
+        self.assertIsNone(profile.utm_source)
+        self.assertEqual(profile.country, 'India')
+        columns = VisitorProfile.events.read(VisitorProfile.events.days()[0])
+        self.assertEqual(list(columns['scroll']), [0])
+        self.assertEqual(list(columns['seconds']), [0])
+
+    def test_a_failing_session_does_not_lose_the_batch(self):
+        def clean_url(url):
+            if url == '/broken':
+                raise RuntimeError(url)
+            return url
+
+        with mock.patch('portfolio.ingest.clean_url', side_effect=clean_url), self.assertLogs('portfolio.ingest'):
+            self.queue.submit_beacon('bad', '127.0.0.1', ['/broken'], [10], [1])
+            self.queue.submit_beacon('good', '127.0.0.1', ['/blog'], [50], [5])
+            self.queue.stop()
+
+        self.assertEqual(self.queue.stats['failed'], 1)
+        days = VisitorProfile.events.days()
+        self.assertEqual(len(days), 1)
+        self.assertEqual(VisitorProfile.events.dictionary(days[0], 'url'), ['/blog'])
+
+
+class ContentAddressedStorageTests(SimpleTestCase):
+    def setUp(self):
+        self.storage = ContentAddressedStorage(location=self.enterContext(tempfile.TemporaryDirectory()))
+
+    def age(self, name, seconds):
+        moment = time.time() - seconds
+        os.utime(self.storage.path(name), (moment, moment))
+
+    def test_identical_content_is_stored_once(self):
+        first = self.storage.save('blog_pdfs/report.pdf', ContentFile(b'same bytes'))
+        second = self.storage.save('blog_pdfs/Other.PDF', ContentFile(b'same bytes'))
+        self.assertEqual(first, second)
+        self.assertRegex(first, r'^blog_pdfs/[0-9a-f]{2}/[0-9a-f]{64}\.pdf$')
+        self.assertEqual(self.storage.listdir(os.path.dirname(first))[1], [os.path.basename(first)])
+
+    def test_saving_again_refreshes_the_grace_period(self):
+        name = self.storage.save('blog_pdfs/report.pdf', ContentFile(b'bytes'))
+        self.age(name, 7200)
+        self.storage.save('blog_pdfs/again.pdf', ContentFile(b'bytes'))
+        self.assertEqual(sweep_orphans(self.storage, set()), [])
+
+    def test_losing_a_save_race_is_a_dedup_hit(self):
+        name = self.storage.save('blog_pdfs/report.pdf', ContentFile(b'bytes'))
+        # Both writers checked before either file existed
+        with mock.patch.object(self.storage, 'exists', return_value=False):
+            self.assertEqual(self.storage.save('blog_pdfs/report.pdf', ContentFile(b'bytes')), name)
+        self.assertEqual(self.storage.listdir(os.path.dirname(name))[1], [os.path.basename(name)])
+        with self.storage.open(name) as stored:
+            self.assertEqual(stored.read(), b'bytes')
+
+    def test_sweep_removes_old_unreferenced_files(self):
+        kept = self.storage.save('blog_images/a.png', ContentFile(b'kept'))
+        orphan = self.storage.save('blog_images/b.png', ContentFile(b'orphan'))
+        recent = self.storage.save('blog_images/c.png', ContentFile(b'recent'))
+        leftover = 'blog_images/ab/.interrupted.tmp'
+        os.makedirs(os.path.dirname(self.storage.path(leftover)), exist_ok=True)
+        with open(self.storage.path(leftover), 'wb') as partial:
+            partial.write(b'partial')
+        for name in (kept, orphan, leftover):
+            self.age(name, 7200)
+
+        self.assertEqual(sorted(sweep_orphans(self.storage, {kept}, dry_run=True)), sorted([orphan, leftover]))
+        self.assertTrue(self.storage.exists(orphan))
+        sweep_orphans(self.storage, {kept})
+        self.assertFalse(self.storage.exists(orphan))
+        self.assertFalse(self.storage.exists(leftover))
+        self.assertTrue(self.storage.exists(kept))
+        self.assertTrue(self.storage.exists(recent))
+
+
+class CommentMigrationTests(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        BlogPost(title='First post', content='<p>Hello</p>', author='Lokesh').save()
+        self.post = BlogPost.latest()[0]
+        self.comments = os.path.join(self.directory, 'migrated')
+        self.legacy = os.path.join(self.directory, 'comments.csv')
+        with open(self.legacy, 'w', newline='') as csvfile:
+            writer = csv.writer(csvfile)
+            writer.writerow(['blog_post_title', 'author', 'text', 'created_at'])
+            writer.writerow(['First post', 'Reader', 'Hi', ''])
+            writer.writerow(['Deleted post', 'Reader', 'Old', ''])
+            writer.writerow(['First post', 'Other', 'Hello', ''])
+
+    def store(self):
+        return CommentStore(self.comments, Comment.fields, legacy_csv=self.legacy)
+
+    def test_comments_are_split_by_post_id(self):
+        store = self.store()
+        self.assertEqual([row['text'] for row in store.for_post(self.post.id)], ['Hi', 'Hello'])
+        self.assertEqual([row['text'] for row in store.for_post('_orphaned')], ['Old'])
+        self.assertFalse(os.path.exists(self.legacy))
+        self.assertTrue(os.path.exists(self.legacy + '.migrated'))
+
+    def test_an_interrupted_migration_starts_over(self):
+        # Staged files from a crashed run are discarded, not duplicated
+        os.makedirs(self.comments + '.migrating')
+        with open(os.path.join(self.comments + '.migrating', f'{self.post.id}.csv'), 'w') as staged:
+            staged.write('blog_post_id,blog_post_title,author,text,created_at\n')
+            staged.write(f'{self.post.id},First post,Reader,Hi,\n')
+        self.assertEqual(len(self.store().for_post(self.post.id)), 2)
+        self.assertFalse(os.path.exists(self.comments + '.migrating'))
+
+    def test_concurrent_workers_migrate_once(self):
+        # One store per worker, sharing the directory as processes would
+        stores = [self.store() for _ in range(8)]
+        start = threading.Barrier(len(stores))
+        errors = []
+
+        def first_request(store):
+            start.wait()
+            try:
+                store.append({'blog_post_id': self.post.id, 'blog_post_title': 'First post',
+                              'author': 'New', 'text': 'Later', 'created_at': ''})
+            except Exception as error:
+                errors.append(error)
+
+        threads = [threading.Thread(target=first_request, args=(store,)) for store in stores]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        texts = [row['text'] for row in self.store().for_post(self.post.id)]
+        self.assertEqual(texts[:2], ['Hi', 'Hello'])
+        self.assertEqual(texts[2:], ['Later'] * len(stores))
+
+    def test_first_comments_write_one_header(self):
+        stores = [CommentStore(self.comments, Comment.fields) for _ in range(8)]
+        start = threading.Barrier(len(stores))
+
+        def comment(store):
+            start.wait()
+            store.append({'blog_post_id': 'new-post', 'blog_post_title': 'New post',
+                          'author': 'Reader', 'text': 'First!', 'created_at': ''})
+
+        threads = [threading.Thread(target=comment, args=(store,)) for store in stores]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        with open(os.path.join(self.comments, 'new-post.csv')) as csvfile:
+            self.assertEqual(csvfile.read().count('blog_post_id'), 1)
+
+
+class SessionCacheTests(SimpleTestCase):
+    def setUp(self):
+        directory = self.enterContext(tempfile.TemporaryDirectory())
+        configured = {
+            alias: {**config, 'LOCATION': os.path.join(directory, alias)} if 'LOCATION' in config else config
+            for alias, config in settings.CACHES.items()
+        }
+        self.enterContext(override_settings(CACHES=configured))
+
+    def test_sessions_have_a_cache_of_their_own(self):
+        geo = GeoCache.from_settings()
+        self.assertNotEqual(settings.SESSION_CACHE_ALIAS, geo.shared_alias)
+        self.assertNotEqual(settings.SESSION_CACHE_ALIAS, 'default')
+        self.assertGreater(settings.CACHES[geo.shared_alias]['OPTIONS']['MAX_ENTRIES'], geo.max_size)
+
+    def test_geo_lookups_do_not_evict_sessions(self):
+        sessions = caches[settings.SESSION_CACHE_ALIAS]
+        sessions.set('django.contrib.sessions.cached_db' + 'visitor', {'seen': True})
+        geo = GeoCache.from_settings()
+        for host in range(400):
+            geo.set(f'10.0.{host // 256}.{host % 256}', ('India', 'Delhi'))
+        self.assertEqual(sessions.get('django.contrib.sessions.cached_db' + 'visitor'), {'seen': True})
+
+
+class AnalyticsIngestQueueTests(StoreTestCase):
+    def make_queue(self, **options):
+        config = {'flush_interval': 10, 'max_batch_size': 100, 'max_queue_size': 100,
+                  'backpressure': 'block', 'block_timeout': 0.5, **options}
+        analytics = AnalyticsIngestQueue(**config)
+        self.addCleanup(analytics.stop)
+        return analytics
+
+    def profile(self, session_id, country='India', region='Delhi'):
+        return VisitorProfile(session_id, '8.8.8.8', None, 'test', 'Desktop', [], [], [],
+                              country=country, region=region)
+
+    def test_events_are_written_in_batches_and_flushed_on_stop(self):
+        analytics = self.make_queue(max_batch_size=2)
+        for number in range(5):
+            analytics.submit_profile(self.profile(f'session-{number}'))
+        analytics.stop()
+        self.assertEqual(analytics.stats['batches'], 3)
+        self.assertEqual(len(VisitorProfile.all()), 5)
+
+    def test_events_for_a_session_are_coalesced(self):
+        analytics = self.make_queue()
+        analytics.submit_profile(self.profile('session'))
+        for page in ('/blog', '/about', '/contact'):
+            analytics.submit_beacon('session', '8.8.8.8', [page], [50], [5], utm_source='mail')
+        analytics.stop()
+        self.assertEqual(analytics.stats['batches'], 1)
+        self.assertEqual(analytics.stats['written'], 1)
+        self.assertEqual(analytics.stats['events'], 3)
+        self.assertEqual(VisitorProfile.get('session').utm_source, 'mail')
+
+    def test_a_full_queue_drops_events(self):
+        analytics = self.make_queue(max_batch_size=1, max_queue_size=1, backpressure='drop')
+        with analytics._flush_lock:
+            # The writer takes the first event, then waits for the lock
+            analytics.submit_profile(self.profile('first'))
+            while not analytics._queue.empty():
+                time.sleep(0.01)
+            analytics.submit_profile(self.profile('queued'))
+            analytics.submit_profile(self.profile('dropped'))
+        analytics.stop()
+        self.assertEqual(analytics.stats['dropped'], 1)
+        self.assertEqual(sorted(profile.session_id for profile in VisitorProfile.all()), ['first', 'queued'])
+        # A dropped profile is submitted again by the next request
+        self.assertFalse(VisitorProfile.store.is_known('dropped'))
+
+    def test_locations_are_resolved_outside_the_flush_lock(self):
+        analytics = self.make_queue()
+        lookups = []
+
+        def lookup(ip_address):
+            self.assertFalse(analytics._flush_lock.locked())
+            lookups.append(ip_address)
+            return 'India', 'Delhi'
+
+        with mock.patch('portfolio.ingest.get_country_and_region', side_effect=lookup):
+            analytics.submit_profile(self.profile('unknown', 'Unknown', 'Unknown'))
+            analytics.submit_profile(self.profile('known', 'France', 'Paris'))
+            for session_id in ('unknown', 'unknown', 'known'):
+                analytics.submit_beacon(session_id, '8.8.8.8', ['/blog'], [50], [5])
+            analytics.stop()
+
+        self.assertEqual(lookups, ['8.8.8.8'])
+        self.assertEqual(VisitorProfile.get('unknown').country, 'India')
+        self.assertEqual(VisitorProfile.get('known').country, 'France')
+
+
+@override_settings(GEOIP_FALLBACK_URL='https://geo.invalid/{ip}')
+class LookupRemoteTests(SimpleTestCase):
+    def respond(self, status=200, body='{}'):
+        response = mock.Mock(status_code=status)
+        response.json.side_effect = lambda: json.loads(body)
+        return mock.patch('requests.get', return_value=response)
+
+    def test_provider_fields_are_used(self):
+        with self.respond(body='{"country": "IN", "region": "Delhi"}'):
+            self.assertEqual(lookup_remote('8.8.8.8'), ('IN', 'Delhi'))
+        with self.respond(body='{"country": "IN", "region": null}'):
+            self.assertEqual(lookup_remote('8.8.8.8'), ('IN', 'Unknown'))
+
+    def test_bad_responses_are_treated_as_not_found(self):
+        for status, body in ((200, 'not json'), (200, '["IN"]'), (200, 'null'), (429, '{}')):
+            with self.subTest(status=status, body=body), self.respond(status, body), self.assertLogs('portfolio.geo'):
+                self.assertIsNone(lookup_remote('8.8.8.8'))
+
+    @override_settings(GEOIP_FALLBACK_URL=None)
+    def test_nothing_is_requested_without_a_provider(self):
+        with mock.patch('requests.get') as get:
+            self.assertIsNone(lookup_remote('8.8.8.8'))
+        get.assert_not_called()
+
+
+class MetricsTests(StoreTestCase):
+    def test_responses_carry_server_timing(self):
+        response = self.client.get('/blog')
+        self.assertRegex(response['Server-Timing'], r'^total;dur=[0-9.]+')
+
+    @override_settings(METRICS_TOKEN='secret', METRICS_ALLOWED_IPS=[])
+    def test_metrics_need_the_token(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+        self.assertEqual(self.client.get('/metrics', headers={'Authorization': 'Bearer wrong'}).status_code, 403)
+        response = self.client.get('/metrics', headers={'Authorization': 'Bearer secret'})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('portfolio_request_seconds', response.content.decode())
+
+    def test_unusual_methods_share_one_label(self):
+        self.client.generic('BREW', '/blog')
+        self.client.generic('X' * 100, '/blog')
+        rendered = metrics.registry.render()
+        self.assertIn('method="OTHER"', rendered)
+        self.assertNotIn('BREW', rendered)
+        self.assertNotIn('XXXX', rendered)
+
+
+class RollupBackfillTests(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.analytics = AnalyticsIngestQueue(
+            flush_interval=10, max_batch_size=100, max_queue_size=100, backpressure='block', block_timeout=0.5,
+        )
+        self.addCleanup(self.analytics.stop)
+        for number in range(5):
+            self.visit(f'session-{number}', ['/blog', f'/post/{number}'])
+
+    def visit(self, session_id, pages):
+        self.analytics.submit_profile(VisitorProfile(
+            session_id, '8.8.8.8', None, 'test', 'Desktop', [], [], [], country='India', region='Delhi',
+        ))
+        self.analytics.submit_beacon(session_id, '8.8.8.8', pages, [50] * len(pages), [5] * len(pages))
+        self.analytics.drain()
+
+    def totals(self):
+        return VisitorProfile.rollups.totals('day', 'page', '0000', '9999')
+
+    def backfill(self, **options):
+        return backfill(VisitorProfile.rollups, VisitorProfile.events, VisitorProfile.store,
+                        VisitorProfile.events.days(), **options)
+
+    def test_backfill_reproduces_the_live_rollups(self):
+        live = self.totals()
+        VisitorProfile.rollups.replace_days(VisitorProfile.events.days(), RollupAccumulator())
+        self.assertEqual(self.totals(), [])
+
+        self.assertEqual(self.backfill(batch_size=2), 10)
+        self.assertEqual(self.totals(), live)
+        # Running it again changes nothing
+        self.backfill()
+        self.assertEqual(self.totals(), live)
+
+    def test_an_interrupted_backfill_resumes(self):
+        live = self.totals()
+        add = VisitorProfile.rollups.add
+        calls = []
+
+        def failing_add(accumulator, progress=None):
+            calls.append(progress)
+            if len(calls) == 3:
+                raise OSError('interrupted')
+            add(accumulator, progress)
+
+        with mock.patch.object(VisitorProfile.rollups, 'add', side_effect=failing_add):
+            with self.assertRaises(OSError):
+                self.backfill(batch_size=2)
+        self.assertEqual(VisitorProfile.rollups.backfill_position(','.join(VisitorProfile.events.days())), (2, 5))
+
+        self.backfill(batch_size=2)
+        self.assertEqual(self.totals(), live)
+        self.assertIsNone(VisitorProfile.rollups.backfill_position(','.join(VisitorProfile.events.days())))
+
+    def test_visits_ingested_during_a_backfill_are_counted_once(self):
+        rows_after = VisitorProfile.store.rows_after
+
+        def ingest_meanwhile(rowid, limit):
+            if not VisitorProfile.store.exists('late'):
+                self.visit('late', ['/late'])
+            return rows_after(rowid, limit)
+
+        with mock.patch.object(VisitorProfile.store, 'rows_after', side_effect=ingest_meanwhile):
+            self.backfill(batch_size=2)
+        visits = VisitorProfile.rollups.totals('day', 'all', '0000', '9999')[0]['visits']
+        self.assertEqual(visits, 6)
+
+
+class AsyncBeaconTests(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        VisitorProfile('visitor', '8.8.8.8', None, 'test', 'Desktop', [], [], []).save()
+        self.queue = self.enterContext(mock.patch('portfolio.views.analytics_queue'))
+
+    def beacon(self, body, session_key='visitor'):
+        request = RequestFactory().post('/track_analytics/', body, content_type='application/json')
+        request.session = mock.Mock(session_key=session_key)
+        return request
+
+    async def test_beacon_is_located_and_queued_without_blocking(self):
+        lookup = mock.AsyncMock(return_value=('India', 'Delhi'))
+        with mock.patch('portfolio.views.aget_country_and_region', lookup):
+            response = await track_analytics_async(self.beacon('{"page_urls": ["/blog"], "scroll_depth": ["50%"]}'))
+        self.assertEqual(response.status_code, 200)
+        self.queue.submit_beacon.assert_called_once()
+        kwargs = self.queue.submit_beacon.call_args.kwargs
+        self.assertEqual((kwargs['country'], kwargs['region'], kwargs['block']), ('India', 'Delhi', False))
+
+    async def test_bad_beacons_are_rejected(self):
+        for body, session_key in (('', 'visitor'), ('[1, 2]', 'visitor'), ('{', 'visitor'), ('{}', 'stranger')):
+            with self.subTest(body=body, session_key=session_key):
+                response = await track_analytics_async(self.beacon(body, session_key))
+                self.assertEqual(response.status_code, 400)
+        self.queue.submit_beacon.assert_not_called()
+
+
+class AsyncGeoTests(SimpleTestCase):
+    def test_fallback_sessions_are_closed_with_their_loop(self):
+        async def session():
+            state = await geo._loop_state()
+            self.assertIs(await geo._loop_state(), state)
+            return state.session
+
+        session = asyncio.run(session())
+        self.assertTrue(session.closed)
+
+    def test_shared_cache_reads_run_concurrently(self):
+        # Both reads must be in progress at once to pass the barrier
+        barrier = threading.Barrier(2, timeout=5)
+
+        def get(key):
+            barrier.wait()
+
+        shared = mock.Mock(get=mock.Mock(side_effect=get))
+        cache = GeoCache(shared_alias='shared')
+
+        async def lookups():
+            return await asyncio.gather(cache.aget('8.8.8.8'), cache.aget('8.8.4.4'))
+
+        with mock.patch.object(cache, '_shared', return_value=shared):
+            self.assertEqual(asyncio.run(lookups()), [None, None])
+        self.assertEqual(cache.stats['misses'], 2)
+
+
+class BlogPostRepositoryTests(SimpleTestCase):
+    fields = ['id', 'title', 'published_date']
+
+    def setUp(self):
+        self.directory = self.enterContext(tempfile.TemporaryDirectory())
+        self.path = os.path.join(self.directory, 'posts.csv')
+        self.log_path = os.path.join(self.directory, 'posts.log')
+
+    def repository(self, **kwargs):
+        return BlogPostRepository(self.path, self.fields, log_path=self.log_path, **kwargs)
+
+    def row(self, number):
+        return {'id': f'post-{number}', 'title': f'Post {number}', 'published_date': f'2024-01-{number:02d}'}
+
+    def test_torn_log_tail_is_ignored_and_dropped_by_the_next_write(self):
+        repository = self.repository()
+        repository.put(self.row(1))
+        with open(self.log_path, 'a') as logfile:
+            logfile.write(json.dumps({'op': 'put', 'row': self.row(2)})[:20])
+
+        repository = self.repository()
+        self.assertEqual([row['id'] for row in repository.rows()], ['post-1'])
+
+        repository.put(self.row(3))
+        with open(self.log_path) as logfile:
+            records = [json.loads(line) for line in logfile]
+        self.assertEqual([record['row']['id'] for record in records], ['post-1', 'post-3'])
+        self.assertEqual([row['id'] for row in self.repository().rows()], ['post-1', 'post-3'])
+
+    def test_compaction_folds_the_log_into_the_snapshot(self):
+        repository = self.repository(compact_threshold=3)
+        # Writes only count towards compaction once the files have been read
+        repository.rows()
+        for number in range(1, 4):
+            repository.put(self.row(number))
+        repository.delete('post-2')
+
+        with open(self.log_path) as logfile:
+            self.assertEqual(len(logfile.readlines()), 1)
+        self.assertEqual(
+            [row['id'] for row in self.repository().newest_first()], ['post-3', 'post-1']
+        )
+
+    def test_replaying_the_log_over_a_compacted_snapshot_is_harmless(self):
+        repository = self.repository()
+        repository.put(self.row(1))
+        repository.put({**self.row(1), 'title': 'Renamed'})
+        with open(self.log_path) as logfile:
+            log = logfile.read()
+        repository.compact()
+        # As if the process died before truncating the log
+        with open(self.log_path, 'w') as logfile:
+            logfile.write(log)
+
+        self.assertEqual(self.repository().rows(), [{**self.row(1), 'title': 'Renamed'}])
+
+
+    def test_patch_changes_only_the_given_fields(self):
+        repository = self.repository()
+        repository.put(self.row(1))
+        self.repository().patch('post-1', title='Elsewhere')
+
+        self.assertEqual(repository.patch('post-1', expected={'title': 'Post 1'}, published_date='x'), None)
+        self.assertEqual(repository.get('post-1'), {**self.row(1), 'title': 'Elsewhere'})
+
+
+class BlogPostUpdateTests(StoreTestCase):
+    def test_stale_background_results_are_not_stored(self):
+        BlogPost(title='First post', content='<p>Hello</p>', author='Lokesh', image='blog_images/old.png').save()
+        task_copy = BlogPost.latest()[0]
+        # The author replaces the image while variants of the old one are built
+        BlogPost.repository.patch(task_copy.id, image='blog_images/new.png')
+
+        self.assertFalse(task_copy.update(expected={'image': 'blog_images/old.png'}, image_variants={'webp': {}}))
+        post = BlogPost.get(task_copy.id)
+        self.assertEqual(post.image_path, 'blog_images/new.png')
+        self.assertEqual(post.image_variants, {})
+
+    def test_update_keeps_fields_written_by_others(self):
+        BlogPost(title='First post', content='<p>Hello</p>', author='Lokesh').save()
+        first, second = BlogPost.latest()[0], BlogPost.latest()[0]
+        first.update(title='Renamed')
+        second.update(content='<p>Rewritten</p>')
+        post = BlogPost.get(first.id)
+        self.assertEqual((post.title, post.content), ('Renamed', '<p>Rewritten</p>'))
+
+
+@override_settings(MEDIA_ACCEL_MODE=None)
+class ServeMediaTests(SimpleTestCase):
+    content = bytes(range(200))
+    hashed_name = f'blog_pdfs/ab/{"ab" * 32}.pdf'
+
+    def setUp(self):
+        media_root = self.enterContext(tempfile.TemporaryDirectory())
+        self.enterContext(override_settings(MEDIA_ROOT=media_root))
+        for name in ('plain.bin', self.hashed_name):
+            path = os.path.join(media_root, name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as mediafile:
+                mediafile.write(self.content)
+
+    def get(self, name, **headers):
+        return self.client.get(f'/media/{name}', headers=headers)
+
+    def test_byte_ranges(self):
+        cases = {
+            'bytes=0-9': (0, 9),
+            'bytes=190-': (190, 199),
+            'bytes=-5': (195, 199),
+            'bytes=150-999': (150, 199),
+        }
+        for header, (start, end) in cases.items():
+            with self.subTest(header):
+                response = self.get('plain.bin', Range=header)
+                self.assertEqual(response.status_code, 206)
+                self.assertEqual(response['Content-Range'], f'bytes {start}-{end}/200')
+                self.assertEqual(b''.join(response.streaming_content), self.content[start:end + 1])
+
+    def test_unsatisfiable_range(self):
+        response = self.get('plain.bin', Range='bytes=200-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], 'bytes */200')
+
+    def test_multiple_or_malformed_ranges_serve_the_whole_file(self):
+        for header in ('bytes=0-1,5-6', 'bytes=-', 'items=0-1'):
+            with self.subTest(header):
+                self.assertEqual(self.get('plain.bin', Range=header).status_code, 200)
+
+    def test_if_range_needs_a_strong_etag_match(self):
+        etag = self.get('plain.bin')['ETag']
+        self.assertEqual(self.get('plain.bin', Range='bytes=0-9', If_Range=etag).status_code, 206)
+        self.assertEqual(self.get('plain.bin', Range='bytes=0-9', If_Range=f'W/{etag}').status_code, 200)
+        self.assertEqual(self.get('plain.bin', Range='bytes=0-9', If_Range='"other"').status_code, 200)
+
+    def test_if_none_match(self):
+        etag = self.get('plain.bin')['ETag']
+        for header in (etag, f'W/{etag}', f'"other", {etag}', '*'):
+            with self.subTest(header):
+                self.assertEqual(self.get('plain.bin', If_None_Match=header).status_code, 304)
+        self.assertEqual(self.get('plain.bin', If_None_Match='"other"').status_code, 200)
+
+    def test_content_addressed_names_are_immutable(self):
+        response = self.get(self.hashed_name)
+        self.assertEqual(response['ETag'], f'"{"ab" * 32}.pdf"')
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertNotIn('immutable', self.get('plain.bin')['Cache-Control'])
+
+
+class FragmentCacheTests(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        BlogPost(title='First post', content='<p>Hello</p>', author='Lokesh').save()
+        self.post = BlogPost.latest()[0]
+
+    def test_comments_change_the_post_key_only(self):
+        post_key, list_key = fragment_cache.post_key(self.post.id), fragment_cache.list_key(1)
+        Comment('First post', 'Reader', 'Hi', blog_post_id=self.post.id).save()
+        self.assertNotEqual(fragment_cache.post_key(self.post.id), post_key)
+        self.assertEqual(fragment_cache.list_key(1), list_key)
+
+    def test_post_writes_change_both_keys(self):
+        post_key, list_key = fragment_cache.post_key(self.post.id), fragment_cache.list_key(1)
+        self.post.update(title='Renamed')
+        self.assertNotEqual(fragment_cache.post_key(self.post.id), post_key)
+        self.assertNotEqual(fragment_cache.list_key(1), list_key)
+
+    def test_fragments_are_rendered_once_per_version(self):
+        renders = []
+
+        def render():
+            renders.append(1)
+            return '<p>Rendered</p>'
+
+        key = fragment_cache.post_key(self.post.id)
+        self.assertEqual(fragment_cache.get_or_render(key, render), '<p>Rendered</p>')
+        self.assertEqual(fragment_cache.get_or_render(fragment_cache.post_key(self.post.id), render), '<p>Rendered</p>')
+        self.assertEqual(len(renders), 1)
+
+
+class SanitizerTests(SimpleTestCase):
+    def html(self, content):
+        return derive_content_fields(content)['content_html']
+
+    def test_scripts_and_handlers_are_removed(self):
+        self.assertEqual(
+            self.html('<p onclick="x()">Hi<script>alert(1)</script></p><object>gone</object>'),
+            '<p>Hi</p>',
+        )
+
+    def test_unsafe_urls_are_dropped(self):
+        self.assertEqual(self.html('<a href=" javascript:alert(1)">x</a>'), '<a>x</a>')
+        self.assertEqual(self.html('<img src="data:image/png;base64,AA">'), '<img>')
+        self.assertEqual(self.html('<a href="/blog">x</a>'), '<a href="/blog">x</a>')
+
+    def test_links_opening_a_new_tab_get_noopener(self):
+        self.assertEqual(
+            self.html('<a href="https://example.com" target="_blank" rel="opener">x</a>'),
+            '<a href="https://example.com" target="_blank" rel="noopener noreferrer">x</a>',
+        )
+
+    def test_only_allowlisted_style_properties_are_kept(self):
+        self.assertEqual(
+            self.html('<p style="text-align:center; color:red">x</p>'),
+            '<p style="text-align: center">x</p>',
+        )
+        self.assertEqual(
+            self.html('<img src="a.png" style="width:300px; background:url(x.png)">'),
+            '<img src="a.png" style="width: 300px">',
+        )
+        self.assertEqual(self.html('<p style="width:expression(alert(1))">x</p>'), '<p>x</p>')
+
+    def test_iframes_are_kept_only_from_allowed_hosts(self):
+        self.assertEqual(
+            self.html('<iframe src="https://www.youtube.com/embed/x" allowfullscreen>text</iframe>'),
+            '<iframe src="https://www.youtube.com/embed/x" allowfullscreen></iframe>',
+        )
+        for src in ('https://example.com/embed', 'http://www.youtube.com/embed/x', 'javascript:alert(1)'):
+            with self.subTest(src):
+                self.assertEqual(self.html(f'<iframe src="{src}"><p>text</p></iframe><p>after</p>'), '<p>after</p>')
+
+    def test_excerpt_and_reading_time(self):
+        fields = derive_content_fields('<h1>Title</h1><p>' + 'word ' * 450 + '</p>')
+        self.assertEqual(fields['word_count'], 451)
+        self.assertEqual(fields['reading_time'], 3)
+        self.assertTrue(fields['excerpt'].startswith('Title word word'))
+        self.assertTrue(fields['excerpt'].endswith('…'))
+
+
+class VisitorProfileStoreTests(SimpleTestCase):
+    def setUp(self):
+        self.directory = self.enterContext(tempfile.TemporaryDirectory())
+
+    def store(self, **kwargs):
+        return VisitorProfileStore(os.path.join(self.directory, 'profiles.sqlite3'), VisitorProfile.fields, **kwargs)
+
+    def row(self, session_id, **fields):
+        return {
+            'session_id': session_id, 'ip_address': '8.8.8.8', 'utm_source': None, 'user_agent': 'test',
+            'device_type': 'Desktop', 'page_urls': [], 'scroll_depth': [], 'time_spent': [],
+            'country': 'Unknown', 'region': 'Unknown', 'date_time_visited': '2024-01-01T00:00:00', **fields,
+        }
+
+    def test_upsert_replaces_the_row_for_a_session(self):
+        store = self.store()
+        store.upsert(self.row('a', page_urls=['/blog']))
+        store.upsert_many([self.row('a', page_urls=['/blog', '/about'], country='IN'), self.row('b')])
+        self.assertEqual(store.count(), 2)
+        self.assertEqual(store.get('a')['page_urls'], ['/blog', '/about'])
+        self.assertEqual(store.get('a')['country'], 'IN')
+        self.assertEqual(set(store.get_many(['a', 'b', 'missing'])), {'a', 'b'})
+
+    def test_update_only_changes_the_given_fields(self):
+        store = self.store()
+        store.upsert(self.row('a'))
+        store.update(self.row('a', country='IN', user_agent='other'), ['country'])
+        store.update(self.row('missing', country='IN'), ['country'])
+        self.assertEqual((store.get('a')['country'], store.get('a')['user_agent']), ('IN', 'test'))
+        self.assertIsNone(store.get('missing'))
+
+    def test_profiles_written_elsewhere_are_found(self):
+        writer, reader = self.store(), self.store()
+        self.assertFalse(reader.exists('a'))
+        writer.upsert(self.row('a'))
+        self.assertFalse(reader.is_known('a'))
+        self.assertTrue(reader.exists('a'))
+        self.assertTrue(reader.is_known('a'))
+
+    def test_known_sessions_are_bounded(self):
+        store = self.store(known_cache_size=2)
+        store.upsert_many([self.row(session_id) for session_id in 'abc'])
+        self.assertEqual([store.is_known(session_id) for session_id in 'abc'], [False, True, True])
+        store.delete('c')
+        self.assertFalse(store.is_known('c'))
+        self.assertFalse(store.exists('c'))
+
+    def test_legacy_csv_is_imported_once(self):
+        legacy = os.path.join(self.directory, 'visitorprofiles.csv')
+        with open(legacy, 'w', newline='') as csvfile:
+            writer = csv.DictWriter(csvfile, fieldnames=VisitorProfile.fields)
+            writer.writeheader()
+            writer.writerow({**self.row('legacy'), 'page_urls': '["/blog"]', 'scroll_depth': '', 'time_spent': ''})
+        store = self.store(legacy_csv=legacy)
+        self.assertEqual(store.get('legacy')['page_urls'], ['/blog'])
+        store.delete('legacy')
+        self.assertIsNone(self.store(legacy_csv=legacy).get('legacy'))
+
+
+class GeoCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.now = 1000.0
+        self.enterContext(mock.patch('portfolio.geo.time.monotonic', side_effect=lambda: self.now))
+
+    def test_least_recently_used_addresses_are_evicted(self):
+        cache = GeoCache(max_size=2)
+        cache.set('1.1.1.1', ('AU', 'Queensland'))
+        cache.set('8.8.8.8', ('US', 'California'))
+        cache.get('1.1.1.1')
+        cache.set('9.9.9.9', ('CH', 'Zurich'))
+        self.assertIsNone(cache.get('8.8.8.8'))
+        self.assertEqual(cache.get('1.1.1.1'), ('AU', 'Queensland'))
+        self.assertEqual((len(cache), cache.stats['evictions']), (2, 1))
+
+    def test_failed_lookups_expire_sooner(self):
+        cache = GeoCache(ttl=100, negative_ttl=10)
+        cache.set('1.1.1.1', ('AU', 'Queensland'))
+        cache.set('192.0.2.1', UNKNOWN)
+        self.now += 11
+        self.assertIsNone(cache.get('192.0.2.1'))
+        self.assertEqual(cache.get('1.1.1.1'), ('AU', 'Queensland'))
+        self.now += 90
+        self.assertIsNone(cache.get('1.1.1.1'))
+
+    def test_lookups_go_through_the_cache(self):
+        cache = GeoCache()
+        with mock.patch('portfolio.geo.geo_cache', cache), \
+                mock.patch('portfolio.geo.lookup_local', return_value=None), \
+                mock.patch('portfolio.geo.lookup_remote', return_value=None) as remote:
+            self.assertEqual(get_country_and_region('8.8.8.8'), UNKNOWN)
+            self.assertEqual(get_country_and_region('8.8.8.8'), UNKNOWN)
+            # Private addresses are never looked up
+            self.assertEqual(get_country_and_region('10.0.0.1'), UNKNOWN)
+        remote.assert_called_once_with('8.8.8.8')
+        self.assertEqual(cache.stats['hits'], 1)
+
+    def test_workers_share_results_through_the_shared_cache(self):
+        caches['default'].clear()
+        self.addCleanup(caches['default'].clear)
+        GeoCache(shared_alias='default').set('8.8.8.8', ('US', 'California'))
+        other = GeoCache(shared_alias='default')
+        self.assertEqual(other.get('8.8.8.8'), ('US', 'California'))
+        self.assertEqual(other.stats['shared_hits'], 1)
+
+
+class LatestPostsTests(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        for day in range(1, 13):
+            BlogPost(title=f'Post {day}', content='<p>Hello</p>', author='Lokesh',
+                     published_date=f'2024-01-{day:02d}T00:00:00').save()
+
+    def test_only_the_requested_page_is_built(self):
+        with mock.patch.object(BlogPost, '_from_row', wraps=BlogPost._from_row) as from_row:
+            page = Paginator(BlogPost.latest(), 5).page(2)
+            titles = [post.title for post in page]
+        self.assertEqual(titles, [f'Post {day}' for day in range(7, 2, -1)])
+        self.assertEqual(from_row.call_count, 5)
+
+    def test_indexing_and_length(self):
+        posts = BlogPost.latest()
+        self.assertEqual(len(posts), 12)
+        self.assertEqual((posts[0].title, posts[-1].title), ('Post 12', 'Post 1'))
+        self.assertEqual([post.title for post in posts[10:20]], ['Post 2', 'Post 1'])
+        with self.assertRaises(IndexError):
+            posts[12]
+
+    def test_out_of_range_pages_show_the_nearest_page(self):
+        self.assertContains(self.client.get('/blog?page=abc'), 'Post 12')
+        response = self.client.get('/blog?page=99')
+        self.assertContains(response, 'Post 1<')
+        self.assertNotContains(response, 'Post 12')
+
+
+class SearchTests(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.posts = {}
+        for title, content, day in (
+            ('Optimizing Django', '<p>Caching and <strong>profiling</strong>.</p>', 1),
+            ('Travel notes', '<p>Django came up while optimizing a trip.</p>', 2),
+            ('Cooking', '<p>Optimal pasta.</p>', 3),
+        ):
+            post = BlogPost(title=title, content=content, author='Lokesh', published_date=f'2024-01-0{day}')
+            post.save()
+            self.posts[title] = post
+
+    def titles(self, query):
+        return [post.title for post in BlogPost.search(query)]
+
+    def test_title_matches_rank_first(self):
+        self.assertEqual(self.titles('django'), ['Optimizing Django', 'Travel notes'])
+
+    def test_terms_match_as_prefixes(self):
+        titles = self.titles('optim')
+        self.assertEqual(titles[0], 'Optimizing Django')
+        self.assertCountEqual(titles, ['Optimizing Django', 'Travel notes', 'Cooking'])
+        # Exact terms outrank longer words they are a prefix of
+        self.assertEqual(self.titles('optimal')[0], 'Cooking')
+        self.assertEqual(self.titles('o'), [])
+
+    def test_every_term_must_match(self):
+        self.assertEqual(self.titles('django trip'), ['Travel notes'])
+        self.assertEqual(self.titles('django pasta'), [])
+
+    def test_markup_is_not_indexed(self):
+        self.assertEqual(self.titles('strong'), [])
+        self.assertEqual(self.titles('profiling'), ['Optimizing Django'])
+
+    def test_writes_update_the_index(self):
+        self.assertEqual(self.titles('cooking'), ['Cooking'])
+        self.posts['Cooking'].update(title='Baking')
+        self.assertEqual(self.titles('cooking'), [])
+        self.assertEqual(self.titles('baking'), ['Baking'])
+        self.posts['Travel notes'].delete()
+        self.assertEqual(self.titles('django'), ['Optimizing Django'])
+
+    def test_search_page(self):
+        response = self.client.get('/blog/search', {'q': 'pasta'})
+        self.assertContains(response, 'Cooking')
+        self.assertNotContains(response, 'Travel notes')
+
+
+class TrafficClassifierTests(SimpleTestCase):
+    browser = 'Mozilla/5.0 (X11; Linux x86_64) Firefox/126.0'
+
+    def test_requests_are_classified(self):
+        classifier = TrafficClassifier(['/static/', '/admin/'], ['bot', 'curl'])
+        cases = [
+            ('/static/site.css', self.browser, 'path'),
+            ('/admin/login/', self.browser, 'path'),
+            ('/blog', 'Mozilla/5.0 (compatible; Googlebot/2.1)', 'bot'),
+            ('/blog', 'curl/8.5.0', 'bot'),
+            ('/blog', '', 'bot'),
+            ('/blog', self.browser, None),
+            ('/blog/static/', self.browser, None),
+        ]
+        for path, user_agent, reason in cases:
+            with self.subTest(path=path, user_agent=user_agent):
+                self.assertEqual(classifier.classify(path, user_agent), reason)
+        self.assertEqual(classifier.stats, {'path': 2, 'bot': 3, 'tracked': 2})
+
+    def test_empty_user_agents_can_be_tracked(self):
+        classifier = TrafficClassifier([], [], skip_empty_user_agent=False)
+        self.assertIsNone(classifier.classify('/blog', ''))
+
+
+class AnalyticsMiddlewareTests(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        configured = {
+            alias: {**config, 'LOCATION': os.path.join(self.directory, alias)} if 'LOCATION' in config else config
+            for alias, config in settings.CACHES.items()
+        }
+        self.enterContext(override_settings(CACHES=configured))
+        self.queue = self.enterContext(mock.patch('portfolio.middleware.analytics_queue'))
+        write_behind = self.enterContext(mock.patch('portfolio.sessions.write_behind'))
+        write_behind.pending.return_value = None
+
+    def test_visitors_get_a_session_and_a_profile(self):
+        response = self.client.get('/blog', headers={'User-Agent': TrafficClassifierTests.browser})
+        self.assertIn(settings.SESSION_COOKIE_NAME, response.cookies)
+        self.queue.submit_profile.assert_called_once()
+        profile = self.queue.submit_profile.call_args.args[0]
+        self.assertEqual(profile.session_id, response.cookies[settings.SESSION_COOKIE_NAME].value)
+
+    def test_bots_and_static_files_are_skipped(self):
+        for path, user_agent in (('/blog', 'Googlebot/2.1'), ('/blog', ''), ('/metrics', TrafficClassifierTests.browser)):
+            with self.subTest(path=path, user_agent=user_agent):
+                response = self.client.get(path, headers={'User-Agent': user_agent})
+                self.assertNotIn(settings.SESSION_COOKIE_NAME, response.cookies)
+        self.queue.submit_profile.assert_not_called()
@@ -0,0 +1,68 @@
+import re
+import threading
+from collections import Counter
+
+from django.conf import settings
+
+DEFAULTS = {
+    # Requests under these paths never create sessions or visitor profiles
+    'EXCLUDED_PATH_PREFIXES': (
+        '/static/', '/media/', '/admin/', '/ckeditor/', '/track_analytics/', '/favicon.ico',
+        '/robots.txt', '/sitemap.xml', '/health', '/metrics',
+    ),
+    # Case-insensitive substrings of crawler, monitor and script user agents
+    'BOT_USER_AGENTS': (
+        'bot', 'crawl', 'spider', 'slurp', 'archiver', 'facebookexternalhit', 'embedly', 'preview',
+        'lighthouse', 'headless', 'monitor', 'uptime', 'pingdom', 'curl', 'wget', 'python-requests',
+        'python-urllib', 'aiohttp', 'httpclient', 'go-http-client', 'okhttp', 'java/', 'libwww',
+    ),
+    # Requests without a User-Agent are treated as bots
+    'SKIP_EMPTY_USER_AGENT': True,
+}
+
+
+class TrafficClassifier:
+    """Decides which requests analytics should ignore.
+
+    Path prefixes and bot user-agent fragments are each compiled into one
+    regular expression, so classifying a request is two anchored regex
+    matches however long the lists are. ``stats`` counts each outcome.
+    """
+
+    def __init__(self, excluded_prefixes, bot_user_agents, skip_empty_user_agent=True):
+        self.skip_empty_user_agent = skip_empty_user_agent
+        # Longest first, so overlapping prefixes behave predictably
+        prefixes = sorted(excluded_prefixes, key=len, reverse=True)
+        self._path = re.compile('|'.join(map(re.escape, prefixes))) if prefixes else None
+        self._bot = re.compile('|'.join(map(re.escape, bot_user_agents)), re.IGNORECASE) if bot_user_agents else None
+        self._lock = threading.Lock()
+        self.stats = Counter()
+
+    @classmethod
+    def from_settings(cls):
+        config = {**DEFAULTS, **getattr(settings, 'ANALYTICS_TRAFFIC', {})}
+        return cls(
+            excluded_prefixes=config['EXCLUDED_PATH_PREFIXES'],
+            bot_user_agents=config['BOT_USER_AGENTS'],
+            skip_empty_user_agent=config['SKIP_EMPTY_USER_AGENT'],
+        )
+
+    def classify(self, path, user_agent):
+        """Why a request should skip analytics ('path' or 'bot'), or None."""
+        if self._path is not None and self._path.match(path):
+            reason = 'path'
+        elif not user_agent:
+            reason = 'bot' if self.skip_empty_user_agent else None
+        elif self._bot is not None and self._bot.search(user_agent):
+            reason = 'bot'
+        else:
+            reason = None
+        with self._lock:
+            self.stats[reason or 'tracked'] += 1
+        return reason
+
+    def classify_request(self, request):
+        return self.classify(request.path_info, request.META.get('HTTP_USER_AGENT', ''))
+
+
+traffic_classifier = TrafficClassifier.from_settings()
@@ -1,50 +1,109 @@
 from django.shortcuts import render, redirect, get_object_or_404
-from django.core.paginator import Paginator
-from django.http import JsonResponse, HttpResponseForbidden
+from django.core.paginator import EmptyPage, PageNotAnInteger, Paginator
+from django.http import HttpResponse, JsonResponse, HttpResponseForbidden
+from django.template.loader import render_to_string
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.decorators import login_required, permission_required
 from django.utils.timezone import now
+from datetime import datetime, timedelta
+from django.views.decorators.http import condition
+from django.conf import settings
 from .models import BlogPost, Comment, VisitorProfile
 from portfolio.models import BlogPost, Comment, VisitorProfile
+from . import metrics
 from .forms import BlogPostForm, CommentForm
+from .fragment_cache import fragment_cache
+from .geo import aget_country_and_region
+from .ingest import analytics_queue
+import hashlib
+import hmac
 import json
-import requests
 import csv
 from django.http import Http404
 
-API_TOKEN = 'dd69563fa6b218'  
-
 def welcomePage_view(request):
     return render(request, "welcomePage.html")
 
+def _page_number(paginator, page_number):
+    """The page Paginator.get_page() would show, without building it."""
+    try:
+        return paginator.validate_number(page_number)
+    except PageNotAnInteger:
+        return 1
+    except EmptyPage:
+        return paginator.num_pages
+
+def _etag(*parts):
+    # Built only from files every worker shares, so all workers agree on
+    # it; BLOG_ETAG_VERSION is bumped when templates change
+    parts = (getattr(settings, 'BLOG_ETAG_VERSION', 1),) + parts
+    return hashlib.sha1(':'.join(str(part) for part in parts).encode()).hexdigest()
+
+def blog_list_etag(request):
+    # Only stats the post files; no posts are loaded and nothing is rendered
+    return _etag('list', *BlogPost.repository.signature(), request.GET.get('page', ''))
+
+def blog_detail_etag(request, id):
+    row = BlogPost.repository.get(id)
+    post = sorted(row.items()) if row else None
+    # The page embeds a CSRF token, which changes when the CSRF cookie does
+    csrf_cookie = request.COOKIES.get(settings.CSRF_COOKIE_NAME, '')
+    return _etag('post', id, post, Comment.store.stamp(id), csrf_cookie)
+
+@condition(etag_func=blog_list_etag)
 def blog_list(request):
-    all_posts = BlogPost.all()
-    posts = sorted(all_posts, key=lambda x: x.published_date, reverse=True)
+    posts = BlogPost.latest()
     paginator = Paginator(posts, 5)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    page_number = _page_number(paginator, request.GET.get('page'))
 
-    return render(request, 'blog_list.html', {
+    # The list page has no per-user content, so the whole page is cached
+    html = fragment_cache.get_or_render(
+        fragment_cache.list_key(page_number),
+        lambda: render_to_string('blog_list.html', {
+            'page_obj': paginator.page(page_number)
+        }, request),
+    )
+    return HttpResponse(html)
+
+def blog_search(request):
+    query = request.GET.get('q', '').strip()
+    paginator = Paginator(BlogPost.search(query), 5)
+    page_obj = paginator.get_page(request.GET.get('page'))
+
+    return render(request, 'blog_search.html', {
+        'query': query,
         'page_obj': page_obj
     })
 
+@condition(etag_func=blog_detail_etag)
 def blog_detail(request, id):
-    post = next((p for p in BlogPost.all() if p.id == id), None)
+    post = BlogPost.get(id)
     if not post:
         raise Http404("Blog post not found")
     
-    comments = [comment for comment in Comment.all() if comment.blog_post_title == post.title]
-
     if request.method == 'POST':
         form = CommentForm(request.POST)
         if form.is_valid():
+            # Attach the comment to the post in the URL, whatever the form says
+            form.cleaned_data['blog_post_id'] = post.id
+            form.cleaned_data['blog_post_title'] = post.title
             form.save()
             return redirect('blog_detail', id=post.id)
     else:
-        form = CommentForm(initial={'blog_post_title': post.title})
+        form = CommentForm(initial={'blog_post_id': post.id, 'blog_post_title': post.title})
+
+    # Everything but the comment form is cached until the post or its comments change
+    body_html = fragment_cache.get_or_render(
+        fragment_cache.post_key(post.id),
+        lambda: render_to_string('blog_detail_body.html', {
+            'post': post,
+            'comments': Comment.for_post(post.id)
+        }),
+    )
 
     return render(request, 'blog_detail.html', {
         'post': post,
-        'comments': comments,
+        'body_html': body_html,
         'form': form
     })
 
@@ -71,22 +130,12 @@ def blog_create(request):
 
 @login_required
 def delete_post(request, post_id):
-    posts = BlogPost.all()
-    post_to_delete = next((p for p in posts if p.id == post_id), None)
+    post_to_delete = BlogPost.get(post_id)
 
     if not post_to_delete:
         return render(request, '404.html', status=404)
     if request.user.is_staff or request.user.is_superuser:
-        posts.remove(post_to_delete)
-        with open('data/posts.csv', 'w', newline='') as file:
-            writer = csv.writer(file)
-            writer.writerow(BlogPost.fields)
-            for post in posts:
-                writer.writerow([
-                    post.id, post.title, post.content, post.image, post.pdf,
-                    post.published_date, post.author
-                ])
-                
+        post_to_delete.delete()
         return redirect('blog_list')
     else:
         return HttpResponseForbidden("You are not authorized to delete this post.")
@@ -114,6 +163,22 @@ import json
 from django.http import JsonResponse
 from django.views.decorators.csrf import csrf_exempt
 
+def _beacon_fields(data):
+    # The queue coerces the per-page lists; text fields are checked here so
+    # the geo lookup below sees a real "Unknown"
+    def text(name, default):
+        value = data.get(name, default)
+        return value if isinstance(value, str) else default
+
+    return {
+        'page_urls': data.get("page_urls", []),
+        'scroll_depth': data.get("scroll_depth", []),
+        'time_spent': data.get("time_spent", []),
+        'utm_source': text("utm_source", None),
+        'country': text("country", "Unknown"),
+        'region': text("region", "Unknown"),
+    }
+
 @csrf_exempt
 def track_analytics(request):
     if request.method == 'POST':
@@ -123,47 +188,130 @@ def track_analytics(request):
                 return JsonResponse({'error': 'Empty request body'}, status=400)
             
             data = json.loads(request.body.decode('utf-8'))
-        except json.JSONDecodeError:
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            return JsonResponse({'error': 'Invalid JSON'}, status=400)
+        if not isinstance(data, dict):
             return JsonResponse({'error': 'Invalid JSON'}, status=400)
         
         # Extract data from the POST request
-        page_urls = data.get("page_urls", [])
-        scroll_depth = data.get("scroll_depth", [])
-        time_spent = data.get("time_spent", [])
-        country = data.get("country", "Unknown")
-        region = data.get("region", "Unknown")
-        utm_source = data.get("utm_source")
-
-        print("Received data:", data)
+        fields = _beacon_fields(data)
 
         # Retrieve the session ID
         session_id = request.session.session_key
-        visitor_profiles = VisitorProfile.all()  # Load all profiles from CSV
-        visitor_profile = next((vp for vp in visitor_profiles if vp.session_id == session_id), None)
-
-        if visitor_profile:
-            # Update the existing profile with new data
-            visitor_profile.page_urls.extend(page_urls)
-            visitor_profile.scroll_depth.extend(scroll_depth)
-            visitor_profile.time_spent.extend(time_spent)
-            visitor_profile.utm_source = utm_source or visitor_profile.utm_source
-            
-            # Update country and region if they are unknown
-            if visitor_profile.country == 'Unknown' or visitor_profile.region == 'Unknown':
-                if country == 'Unknown' and region == 'Unknown':
-                    country, region = get_country_and_region(get_client_ip(request))
-                
-                visitor_profile.country = country
-                visitor_profile.region = region
 
-            # Save updated profile back to CSV
-            visitor_profile.update()
+        if session_id and VisitorProfile.exists(session_id):
+            # Merged into the stored profile by the background writer
+            analytics_queue.submit_beacon(session_id, get_client_ip(request), **fields)
 
             return JsonResponse({'status': 'success'})
 
     return JsonResponse({'status': 'failure'}, status=400)
 
 
+@csrf_exempt
+async def track_analytics_async(request):
+    """track_analytics for ASGI: nothing here blocks the event loop.
+
+    The geo lookup is awaited here instead of running on the ingest writer,
+    and the beacon is handed to the queue without waiting for room.
+    """
+    if request.method != 'POST':
+        return JsonResponse({'status': 'failure'}, status=400)
+    if not request.body:
+        return JsonResponse({'error': 'Empty request body'}, status=400)
+    try:
+        data = json.loads(request.body.decode('utf-8'))
+    except (json.JSONDecodeError, UnicodeDecodeError):
+        return JsonResponse({'error': 'Invalid JSON'}, status=400)
+    if not isinstance(data, dict):
+        return JsonResponse({'error': 'Invalid JSON'}, status=400)
+
+    session_id = request.session.session_key
+    if not session_id or not await VisitorProfile.aexists(session_id):
+        return JsonResponse({'status': 'failure'}, status=400)
+
+    fields = _beacon_fields(data)
+    ip_address = get_client_ip(request)
+    if fields['country'] == 'Unknown' and fields['region'] == 'Unknown':
+        fields['country'], fields['region'] = await aget_country_and_region(ip_address)
+    analytics_queue.submit_beacon(session_id, ip_address, block=False, **fields)
+    return JsonResponse({'status': 'success'})
+
+
+REPORT_FORMATS = {'day': '%Y-%m-%d', 'hour': '%Y-%m-%dT%H'}
+REPORT_DEFAULT_SPAN = {'day': timedelta(days=6), 'hour': timedelta(hours=47)}
+
+def _report_metrics(row):
+    views = row['views'] or 0
+    return {
+        'views': views,
+        'visits': row['visits'] or 0,
+        'avg_seconds': round(row['seconds'] / views, 1) if views else None,
+        'avg_scroll': round(row['scroll'] / views, 1) if views else None,
+    }
+
+@staff_member_required
+def analytics_report(request):
+    """Traffic totals for a range of hourly or daily buckets, as JSON.
+
+    ``period`` is 'day' (default) or 'hour'; ``start`` and ``end`` are
+    buckets like 2024-05-01 or 2024-05-01T13 and default to the last week
+    or the last 48 hours.
+    """
+    period = request.GET.get('period', 'day')
+    if period not in REPORT_FORMATS:
+        return JsonResponse({'error': "period must be 'day' or 'hour'"}, status=400)
+    bucket_format = REPORT_FORMATS[period]
+    try:
+        end = datetime.strptime(request.GET['end'], bucket_format) if 'end' in request.GET else now()
+        start = (datetime.strptime(request.GET['start'], bucket_format) if 'start' in request.GET
+                 else end - REPORT_DEFAULT_SPAN[period])
+        limit = min(max(int(request.GET.get('limit', 20)), 1), 500)
+    except ValueError:
+        return JsonResponse({'error': 'Invalid start, end or limit'}, status=400)
+    start, end = start.strftime(bucket_format), end.strftime(bucket_format)
+
+    rollups = VisitorProfile.rollups
+    totals = rollups.totals(period, 'all', start, end)
+
+    def breakdown(dimension, limit=limit):
+        return [
+            {'value': row['value'], **_report_metrics(row)}
+            for row in rollups.totals(period, dimension, start, end, limit)
+        ]
+
+    return JsonResponse({
+        'period': period,
+        'start': start,
+        'end': end,
+        'totals': _report_metrics(totals[0]) if totals else _report_metrics(
+            {'views': 0, 'visits': 0, 'seconds': 0, 'scroll': 0}),
+        'series': [{'bucket': row['bucket'], **_report_metrics(row)} for row in rollups.series(period, start, end)],
+        'top_pages': breakdown('page'),
+        'scroll_depth': sorted(breakdown('scroll', None), key=lambda row: int(row['value'])),
+        'countries': breakdown('country'),
+        'devices': breakdown('device'),
+        'utm_sources': breakdown('utm_source'),
+    })
+
+
+
+def _metrics_token_matches(request):
+    token = getattr(settings, 'METRICS_TOKEN', '')
+    scheme, _, credentials = request.headers.get('Authorization', '').partition(' ')
+    return bool(token) and scheme.lower() == 'bearer' and hmac.compare_digest(credentials.strip(), token)
+
+def metrics_view(request):
+    """Prometheus text metrics, for staff users, METRICS_TOKEN or METRICS_ALLOWED_IPS."""
+    allowed = (
+        request.user.is_staff
+        or _metrics_token_matches(request)
+        or request.META.get('REMOTE_ADDR') in getattr(settings, 'METRICS_ALLOWED_IPS', ())
+    )
+    if not allowed:
+        return HttpResponseForbidden()
+    return HttpResponse(metrics.registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
 
 # Helper Functions
 
@@ -175,15 +323,3 @@ def get_client_ip(request):
         ip = request.META.get('REMOTE_ADDR')
     return ip
 
-
-def get_country_and_region(ip_address):
-    response = requests.get(f'https://ipinfo.io/{ip_address}/json?token={API_TOKEN}')
-    
-    if response.status_code == 200:
-        data = response.json()
-        country = data.get('country', 'Unknown')
-        region = data.get('region', 'Unknown')
-        return country, region
-    else:
-        print("Failed to fetch data:", response.status_code)
-        return 'Unknown', 'Unknown'